@@ -1,23 +1,37 @@
-# analytics.py ✅ v1.0 - تحليل التفاعلات وتوجيه النشر
+# analytics.py ✅ v1.1 - تحليل التفاعلات وتوجيه النشر (يقرأ unified_db عبر tracker)
 from __future__ import annotations
-import json, os
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Any
+from typing import Dict, Iterator, List, Optional, Any
 from collections import defaultdict
+import heapq
 
-ANALYTICS_DB = os.getenv("ANALYTICS_DB_PATH", "analytics_db.json")
+import tracker
 
-def _load_db() -> Dict:
-    if not os.path.exists(ANALYTICS_DB):
-        return {"posts": {}, "stats_history": []}
-    with open(ANALYTICS_DB, "r", encoding="utf-8") as f:
-        return json.load(f)
+# The only columns analytics ever reads; history and raw responses are never touched.
+POST_FIELDS = ["platform", "category", "published_at", "metrics"]
+TOP_POST_FIELDS = ["id", "platform", "platform_post_id", "category", "short_title", "published_at", "tracked_url", "metrics"]
 
+def _posts(days: Optional[int] = None, platform: Optional[str] = None, fields: List[str] = POST_FIELDS) -> Iterator[Dict]:
+    """سجلات tracker مُسقطة بشكل analytics (metrics ← stats) — قراءة فقط، بلا نسخة من القاعدة"""
+    since = (datetime.utcnow() - timedelta(days=days)).strftime("%Y-%m-%dT%H:%M:%SZ") if days else None
+    for post in tracker.scan_posts(fields, since=since, platform=platform):
+        post["stats"] = post.pop("metrics", None) or {}
+        yield post
+
+def _has_stats(post: Dict) -> bool:
+    stats = post["stats"]
+    return bool(stats) and "error" not in stats
+
+def data_version() -> str:
+    """يتغير كلما تغيّر مصدر البيانات — مفتاح صلاحية النتائج المخزنة مؤقتًا"""
+    return tracker.data_version()
+
+# link_clicks = visits through /r/{post_id} (tracker.record_clicks): the closest signal to a sale.
 PLATFORM_WEIGHTS = {
-    "tiktok":    {"views": 1.0, "likes": 3.0, "comments": 5.0, "shares": 8.0},
-    "telegram":  {"reactions": 5.0, "forwards": 8.0},
-    "facebook":  {"impressions": 0.5, "reactions": 4.0, "clicks": 6.0, "shares": 8.0},
-    "instagram": {"impressions": 0.5, "likes": 3.0, "comments": 5.0, "shares": 8.0, "saved": 6.0},
+    "tiktok":    {"views": 1.0, "likes": 3.0, "comments": 5.0, "shares": 8.0, "link_clicks": 10.0},
+    "telegram":  {"reactions": 5.0, "forwards": 8.0, "link_clicks": 10.0},
+    "facebook":  {"impressions": 0.5, "reactions": 4.0, "clicks": 6.0, "shares": 8.0, "link_clicks": 10.0},
+    "instagram": {"impressions": 0.5, "likes": 3.0, "comments": 5.0, "shares": 8.0, "saved": 6.0, "link_clicks": 10.0},
 }
 
 def compute_engagement_score(platform: str, stats: Dict) -> float:
@@ -25,20 +39,12 @@ def compute_engagement_score(platform: str, stats: Dict) -> float:
     return round(sum(float(stats.get(m,0) or 0) * w for m, w in weights.items()), 2)
 
 def analyze_by_category(days: int = 30) -> List[Dict]:
-    db, cutoff = _load_db(), datetime.utcnow() - timedelta(days=days)
     scores: Dict[str, List[float]] = defaultdict(list)
-    for post in db["posts"].values():
-        try:
-            pub = datetime.fromisoformat(post.get("published_at","2000-01-01"))
-        except Exception:
-            continue
-        if pub < cutoff:
-            continue
-        stats = post.get("stats", {})
-        if not stats or "error" in stats:
+    for post in _posts(days):
+        if not _has_stats(post):
             continue
-        scores[post.get("category","غير محدد")].append(
-            compute_engagement_score(post["platform"], stats)
+        scores[post.get("category") or "غير محدد"].append(
+            compute_engagement_score(post["platform"], post["stats"])
         )
     result = [
         {"category": cat, "avg_score": round(sum(v)/len(v),2),
@@ -48,19 +54,11 @@ def analyze_by_category(days: int = 30) -> List[Dict]:
     return sorted(result, key=lambda x: x["avg_score"], reverse=True)
 
 def analyze_by_platform(days: int = 30) -> List[Dict]:
-    db, cutoff = _load_db(), datetime.utcnow() - timedelta(days=days)
     scores: Dict[str, List[float]] = defaultdict(list)
-    for post in db["posts"].values():
-        try:
-            pub = datetime.fromisoformat(post.get("published_at","2000-01-01"))
-        except Exception:
-            continue
-        if pub < cutoff:
-            continue
-        stats = post.get("stats", {})
-        if not stats or "error" in stats:
+    for post in _posts(days, fields=["platform", "metrics"]):
+        if not _has_stats(post):
             continue
-        scores[post["platform"]].append(compute_engagement_score(post["platform"], stats))
+        scores[post["platform"]].append(compute_engagement_score(post["platform"], post["stats"]))
     result = [
         {"platform": p, "avg_score": round(sum(v)/len(v),2), "post_count": len(v)}
         for p, v in scores.items()
@@ -68,37 +66,35 @@ def analyze_by_platform(days: int = 30) -> List[Dict]:
     return sorted(result, key=lambda x: x["avg_score"], reverse=True)
 
 def analyze_best_posting_hours(platform: Optional[str] = None, days: int = 30) -> List[Dict]:
-    db, cutoff = _load_db(), datetime.utcnow() - timedelta(days=days)
     hour_scores: Dict[int, List[float]] = defaultdict(list)
-    for post in db["posts"].values():
+    for post in _posts(days, platform):
         try:
-            pub = datetime.fromisoformat(post.get("published_at","2000-01-01"))
+            pub = datetime.fromisoformat(post.get("published_at") or "")
         except Exception:
             continue
-        if pub < cutoff or (platform and post.get("platform") != platform):
+        if not _has_stats(post):
             continue
-        stats = post.get("stats", {})
-        if not stats or "error" in stats:
-            continue
-        hour_scores[pub.hour].append(compute_engagement_score(post["platform"], stats))
+        hour_scores[pub.hour].append(compute_engagement_score(post["platform"], post["stats"]))
     result = [
         {"hour": h, "avg_score": round(sum(v)/len(v),2), "samples": len(v)}
         for h, v in hour_scores.items()
     ]
     return sorted(result, key=lambda x: x["avg_score"], reverse=True)
 
-def get_top_posts(limit: int = 5, platform: Optional[str] = None) -> List[Dict]:
-    db   = _load_db()
+def get_top_posts(limit: int = 5, platform: Optional[str] = None, days: Optional[int] = None) -> List[Dict]:
+    scored = []
+    for post in _posts(days, platform, fields=["id", "platform", "metrics"]):
+        if _has_stats(post):
+            scored.append((compute_engagement_score(post["platform"], post["stats"]), post["id"]))
+    # Only the winners are projected with their display columns.
+    top = heapq.nlargest(limit, scored, key=lambda x: x[0])
     data = []
-    for key, post in db["posts"].items():
-        stats = post.get("stats", {})
-        if not stats or "error" in stats:
-            continue
-        if platform and post.get("platform") != platform:
-            continue
-        score = compute_engagement_score(post["platform"], stats)
-        data.append({**post, "key": key, "score": score})
-    return sorted(data, key=lambda x: x["score"], reverse=True)[:limit]
+    for score, post_id in top:
+        row = tracker.get_post_by_id(post_id) or {}
+        post = {k: row[k] for k in TOP_POST_FIELDS if k in row}
+        post["stats"] = post.pop("metrics", None) or {}
+        data.append({**post, "key": f"{post.get('platform')}:{post.get('platform_post_id')}", "score": score})
+    return data
 
 def _build_advice(best_cat, best_plat, timing) -> List[str]:
     advice = []
@@ -146,19 +142,20 @@ def generate_publishing_recommendation(days: int = 30) -> Dict:
         "actionable_advice":  _build_advice(best_cat, best_plat, timing),
     }
 
-def get_dashboard_summary() -> Dict:
-    db    = _load_db()
-    posts = list(db["posts"].values())
+def get_dashboard_summary(days: int = 30) -> Dict:
     by_pl = defaultdict(int)
-    ok    = 0
-    for p in posts:
-        by_pl[p["platform"]] += 1
-        if p.get("stats") and "error" not in p.get("stats",{}):
+    total = ok = clicks = 0
+    for p in _posts(fields=["platform", "metrics"]):
+        total += 1
+        by_pl[p.get("platform")] += 1
+        clicks += int(p["stats"].get("link_clicks") or 0)
+        if _has_stats(p):
             ok += 1
     return {
-        "total_posts_tracked": len(posts),
+        "total_posts_tracked": total,
         "posts_with_stats":    ok,
+        "link_clicks":         clicks,
         "by_platform":         dict(by_pl),
         "last_updated":        datetime.utcnow().isoformat(),
-        "recommendation":      generate_publishing_recommendation(),
+        "recommendation":      generate_publishing_recommendation(days),
     }
@@ -0,0 +1,101 @@
+"""
+نتائج analytics جاهزة للإرسال: تُحسب في thread خارج حلقة الأحداث، وتُخزَّن مرمّزة ومضغوطة مع ETag
+
+- المفتاح: (الدالة، المعاملات)؛ الصلاحية: analytics.data_version() + ANALYTICS_CACHE_TTL
+- نتيجة منتهية المهلة حديثًا وبنفس data_version تُرسل فورًا ويُعاد حسابها في الخلفية (stale-while-revalidate)
+- تغيّر data_version يعني إعادة الحساب قبل الرد
+- طلبات متزامنة لنفس المفتاح تنتظر حسابًا واحدًا
+"""
+import os
+import gzip
+import json
+import time
+import asyncio
+import hashlib
+from typing import Any, Callable, Dict, Tuple
+
+from fastapi import Request
+from fastapi.responses import Response
+
+from instrumentation import ANALYTICS_CACHE
+
+ANALYTICS_CACHE_TTL = float(os.environ.get("ANALYTICS_CACHE_TTL", "300"))
+# How long past expiry a cached result may still be served while it refreshes; 0 always recomputes first.
+ANALYTICS_CACHE_MAX_STALE = float(os.environ.get("ANALYTICS_CACHE_MAX_STALE", "900"))
+ANALYTICS_CACHE_MAX_ENTRIES = int(os.environ.get("ANALYTICS_CACHE_MAX_ENTRIES", "256"))
+GZIP_MIN_BYTES = 1024
+
+_entries: Dict[Tuple, Dict[str, Any]] = {}
+_inflight: Dict[Tuple, asyncio.Task] = {}
+
+
+def _encode(result: Any, version: str) -> Dict[str, Any]:
+    body = json.dumps({"ok": True, **result} if isinstance(result, dict) else {"ok": True, "items": result},
+                      ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
+    return {
+        "version": version,
+        "at": time.monotonic(),
+        "body": body,
+        "gzip": gzip.compress(body, compresslevel=6) if len(body) >= GZIP_MIN_BYTES else None,
+        "etag": '"' + hashlib.sha1(body).hexdigest() + '"',
+    }
+
+
+def _compute(fn: Callable, version_fn: Callable[[], str], params: Dict[str, Any]) -> Dict[str, Any]:
+    # The version is read before computing, so a write during the run makes the entry stale, not wrong.
+    version = version_fn()
+    return _encode(fn(**params), version)
+
+
+def _start(key: Tuple, fn: Callable, version_fn: Callable[[], str], params: Dict[str, Any]) -> asyncio.Task:
+    task = _inflight.get(key)
+    if task is None:
+        async def run():
+            try:
+                entry = await asyncio.to_thread(_compute, fn, version_fn, params)
+                _entries[key] = entry
+                while len(_entries) > ANALYTICS_CACHE_MAX_ENTRIES:
+                    _entries.pop(next(iter(_entries)))
+                return entry
+            finally:
+                _inflight.pop(key, None)
+
+        task = _inflight[key] = asyncio.create_task(run())
+        # A failed background refresh keeps serving the stale entry; nobody awaits it.
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+    return task
+
+
+async def get(fn: Callable, version_fn: Callable[[], str], **params) -> Dict[str, Any]:
+    key = (fn.__name__, tuple(sorted(params.items())))
+    entry = _entries.get(key)
+    if entry is not None:
+        version = await asyncio.to_thread(version_fn)
+        age = time.monotonic() - entry["at"]
+        if entry["version"] == version and age < ANALYTICS_CACHE_TTL:
+            ANALYTICS_CACHE.inc(result="hit")
+            return entry
+        # Stale means "same data, TTL ran out"; after a write the old body and ETag must not be served.
+        if entry["version"] == version and ANALYTICS_CACHE_MAX_STALE > 0 and age < ANALYTICS_CACHE_TTL + ANALYTICS_CACHE_MAX_STALE:
+            ANALYTICS_CACHE.inc(result="stale")
+            _start(key, fn, version_fn, params)
+            return entry
+    ANALYTICS_CACHE.inc(result="miss")
+    return await asyncio.shield(_start(key, fn, version_fn, params))
+
+
+def clear() -> None:
+    _entries.clear()
+
+
+def respond(request: Request, entry: Dict[str, Any]) -> Response:
+    headers = {"ETag": entry["etag"], "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    inm = request.headers.get("if-none-match")
+    if inm:
+        tags = [t.strip() for t in inm.split(",")]
+        if "*" in tags or entry["etag"] in tags or f"W/{entry['etag']}" in tags:
+            ANALYTICS_CACHE.inc(result="not_modified")
+            return Response(status_code=304, headers=headers)
+    if entry["gzip"] is not None and "gzip" in (request.headers.get("accept-encoding") or "").lower():
+        return Response(entry["gzip"], media_type="application/json", headers={**headers, "Content-Encoding": "gzip"})
+    return Response(entry["body"], media_type="application/json", headers=headers)
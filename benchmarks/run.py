@@ -0,0 +1,382 @@
+"""
+python -m benchmarks.run                      # 1k و10k، مقارنة بـ baseline.json
+python -m benchmarks.run --sizes 1000,10000,100000
+python -m benchmarks.run --save-baseline      # تحديث baseline.json بنتائج هذا الجهاز
+python -m benchmarks.run --only track_publish,sync_all
+
+كل قياس يعمل في عملية مستقلة ومجلد مؤقت خاص به، فذروة RSS تخص القياس وحده
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import hashlib
+import argparse
+import platform
+import resource
+import statistics
+import subprocess
+import tempfile
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+from urllib.parse import parse_qs
+
+from benchmarks import synthetic
+
+BENCH_DIR = Path(__file__).resolve().parent
+REPO_DIR = BENCH_DIR.parent
+BASELINE_PATH = BENCH_DIR / "baseline.json"
+DEFAULT_SIZES = [1000, 10000]
+# p50 latency may grow by this fraction before it is flagged.
+LATENCY_TOLERANCE = 0.25
+RSS_TOLERANCE = 0.20
+
+
+# ─────────────────────────────────────────────
+# Measurement
+# ─────────────────────────────────────────────
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes.
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def measure(fn: Callable[[], Any], repeat: int, warmup: int = 1, ops: int = 1, setup: Optional[Callable[[], Any]] = None) -> Dict[str, Any]:
+    for _ in range(warmup):
+        if setup:
+            setup()
+        fn()
+    samples = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    samples.sort()
+    total = sum(samples)
+    return {
+        "p50_ms": round(statistics.median(samples) * 1000 / ops, 3),
+        "p95_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000 / ops, 3),
+        "min_ms": round(samples[0] * 1000 / ops, 3),
+        "ops_per_s": round(ops * len(samples) / total, 1) if total else None,
+        "repeat": repeat,
+    }
+
+
+def run_async(coro_fn: Callable[[], Any]) -> Callable[[], Any]:
+    loop = asyncio.new_event_loop()
+    return lambda: loop.run_until_complete(coro_fn())
+
+
+# ─────────────────────────────────────────────
+# Mock upstreams
+# ─────────────────────────────────────────────
+def mock_transport():
+    import httpx
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        path = request.url.path
+        if path.endswith("/v2/video/query/"):
+            ids = json.loads(request.content)["filters"]["video_ids"]
+            return httpx.Response(200, json={
+                "data": {"videos": [
+                    {"id": vid, "view_count": 1000, "like_count": 50, "comment_count": 5, "share_count": 3}
+                    for vid in ids
+                ]},
+                "error": {"code": "ok"},
+            })
+        if "/bot" in path:
+            method = path.rsplit("/", 1)[-1]
+            if method == "getMe":
+                return httpx.Response(200, json={"ok": True, "result": {"id": 1}})
+            if method == "getChatMemberCount":
+                return httpx.Response(200, json={"ok": True, "result": 1234})
+            if method == "forwardMessage":
+                return httpx.Response(200, json={"ok": True, "result": {"message_id": 9, "views": 800, "forwards": 4}})
+            return httpx.Response(200, json={"ok": True, "result": True})
+        batch = json.loads(parse_qs(request.content.decode())["batch"][0])
+        return httpx.Response(200, json=[
+            {"code": 200, "body": json.dumps({"like_count": 10, "comments_count": 2, "shares": {"count": 1}})}
+            for _ in batch
+        ])
+
+    return httpx.MockTransport(handler)
+
+
+def fake_fetch(url, output_path, conditional=True):
+    from PIL import Image
+    seed = sum(map(ord, url)) % 255
+    Image.new("RGB", (1200, 1200), (seed, 90, 255 - seed)).save(output_path, quality=90)
+    with open(output_path, "rb") as f:
+        return output_path, hashlib.sha256(f.read()).hexdigest()
+
+
+# ─────────────────────────────────────────────
+# Benchmarks
+# ─────────────────────────────────────────────
+def bench_tracker_load_db(size: int, workdir: Path) -> Dict[str, Any]:
+    synthetic.write_json(Path(os.environ["UNIFIED_DB_PATH"]), synthetic.make_unified_db(size))
+    import tracker
+
+    def cold():
+        tracker._db_cache["db"] = None
+
+    result = measure(tracker.load_db, repeat=5, setup=cold)
+    result["warm_p50_ms"] = measure(tracker.load_db, repeat=20)["p50_ms"]
+    return result
+
+
+def bench_tracker_save_db(size: int, workdir: Path) -> Dict[str, Any]:
+    synthetic.write_json(Path(os.environ["UNIFIED_DB_PATH"]), synthetic.make_unified_db(size))
+    import tracker
+    db = tracker.load_db()
+    return measure(lambda: tracker.save_db(db), repeat=5)
+
+
+def bench_track_publish(size: int, workdir: Path) -> Dict[str, Any]:
+    synthetic.write_json(Path(os.environ["UNIFIED_DB_PATH"]), synthetic.make_unified_db(size))
+    import tracker
+    batch = 100
+    counter = iter(range(10 ** 9))
+
+    async def publish_batch():
+        for _ in range(batch):
+            i = next(counter)
+            await tracker.track_publish({
+                "product_id": f"bench-{i}",
+                "platform": "tiktok",
+                "platform_post_id": f"v.pub_url/bench{i}",
+                "category": "سماعات",
+            })
+
+    return measure(run_async(publish_batch), repeat=3, ops=batch)
+
+
+def bench_sync_all(size: int, workdir: Path) -> Dict[str, Any]:
+    synthetic.write_json(Path(os.environ["UNIFIED_DB_PATH"]), synthetic.make_unified_db(size))
+    import httpx
+    import metrics_fetchers
+    import tracker
+
+    client = httpx.AsyncClient(transport=mock_transport())
+    metrics_fetchers.shared_client = lambda: client
+    eligible = sum(
+        1 for row in tracker.load_posts()
+        if time.time() - time.mktime(time.strptime(row["published_at"], "%Y-%m-%dT%H:%M:%SZ")) <= 7 * 86400
+    )
+    result = measure(run_async(tracker.run_sync_all), repeat=3, warmup=0)
+    result["posts_synced_per_run"] = eligible
+    result["posts_per_s"] = round(eligible / (result["p50_ms"] / 1000), 1) if result["p50_ms"] else None
+    return result
+
+
+def bench_recommendation(size: int, workdir: Path) -> Dict[str, Any]:
+    synthetic.write_json(Path(os.environ["UNIFIED_DB_PATH"]), synthetic.make_unified_db(size))
+    import analytics
+    return measure(analytics.generate_publishing_recommendation, repeat=5)
+
+
+def bench_slide_render(size: int, workdir: Path) -> Dict[str, Any]:
+    import video_generator
+    video_generator.fetch_image = fake_fetch
+    deals = iter(synthetic.make_deals(1000))
+
+    def render():
+        with tempfile.TemporaryDirectory() as tmpdir:
+            video_generator.render_deal_slide(next(deals), os.path.join(tmpdir, "slide.jpg"), tmpdir)
+
+    cold = measure(render, repeat=10)
+    warm_deal = synthetic.make_deals(1, seed=2)[0]
+
+    def render_cached_layer():
+        with tempfile.TemporaryDirectory() as tmpdir:
+            video_generator.render_deal_slide(warm_deal, os.path.join(tmpdir, "slide.jpg"), tmpdir)
+
+    cold["cached_layer_p50_ms"] = measure(render_cached_layer, repeat=10)["p50_ms"]
+    return cold
+
+
+def bench_video_encode(size: int, workdir: Path) -> Dict[str, Any]:
+    import video_generator
+    video_generator.fetch_image = fake_fetch
+    deals = iter(synthetic.make_deals(20, seed=3))
+    out = workdir / "out.mp4"
+
+    def encode():
+        if video_generator.create_video_from_deal(next(deals), str(out), duration=3.0) is None:
+            raise RuntimeError("encode failed")
+
+    return measure(encode, repeat=3, warmup=0)
+
+
+def bench_startup_import(size: int, workdir: Path) -> Dict[str, Any]:
+    # A fresh interpreter per sample: this is what every cold container pays before serving.
+    def start(code: str) -> Callable[[], Any]:
+        return lambda: subprocess.run([sys.executable, "-c", code], cwd=workdir, env=os.environ, check=True, capture_output=True)
+
+    result = measure(start("import main"), repeat=5)
+    result["interpreter_p50_ms"] = measure(start("pass"), repeat=5)["p50_ms"]
+    return result
+
+
+def bench_startup_lifespan(size: int, workdir: Path) -> Dict[str, Any]:
+    import main
+
+    async def cycle():
+        async with main.lifespan(main.app):
+            pass
+
+    return measure(run_async(cycle), repeat=5)
+
+
+# size-independent benchmarks run once with size=None
+BENCHMARKS: Dict[str, Dict[str, Any]] = {
+    "tracker_load_db": {"fn": bench_tracker_load_db, "sized": True},
+    "tracker_save_db": {"fn": bench_tracker_save_db, "sized": True},
+    "track_publish": {"fn": bench_track_publish, "sized": True},
+    "sync_all": {"fn": bench_sync_all, "sized": True},
+    "recommendation": {"fn": bench_recommendation, "sized": True},
+    "slide_render": {"fn": bench_slide_render, "sized": False},
+    "video_encode": {"fn": bench_video_encode, "sized": False},
+    "startup_import": {"fn": bench_startup_import, "sized": False},
+    "startup_lifespan": {"fn": bench_startup_lifespan, "sized": False},
+}
+
+
+def bench_env(workdir: Path) -> Dict[str, str]:
+    return {
+        **os.environ,
+        "PYTHONPATH": os.pathsep.join(filter(None, [str(REPO_DIR), os.environ.get("PYTHONPATH")])),
+        "UNIFIED_DB_PATH": str(workdir / "unified_db.json"),
+        "PUBLISH_DB": str(workdir / "publish_log.json"),
+        "TOKENS_PATH": str(workdir / "tokens.json"),
+        "RENDER_CACHE_DIR": str(workdir / "render_cache"),
+        "STATE_BACKEND_URL": f"sqlite:///{workdir / 'shared_state.db'}",
+        "TELEGRAM_BOT_TOKEN": "bench",
+        "FACEBOOK_PAGE_ACCESS_TOKEN": "bench",
+        "TIKTOK_METRICS_RATE": "0",
+        "TELEGRAM_METRICS_RATE": "0",
+        "GRAPH_METRICS_RATE": "0",
+    }
+
+
+def run_child(name: str, size: Optional[int]) -> None:
+    workdir = Path(os.environ["BENCH_WORKDIR"])
+    synthetic.write_json(Path(os.environ["TOKENS_PATH"]), {"access_token": "bench"})
+    try:
+        result = BENCHMARKS[name]["fn"](size, workdir)
+    except ImportError as e:
+        result = {"skipped": f"missing dependency: {e.name or e}"}
+    except Exception as e:
+        result = {"error": f"{type(e).__name__}: {e}"}
+    result["peak_rss_mb"] = peak_rss_mb()
+    print(json.dumps(result))
+
+
+def run_one(name: str, size: Optional[int], timeout: float) -> Dict[str, Any]:
+    with tempfile.TemporaryDirectory(prefix="bench-") as workdir:
+        env = {**bench_env(Path(workdir)), "BENCH_WORKDIR": workdir}
+        cmd = [sys.executable, "-m", "benchmarks.run", "--child", name]
+        if size is not None:
+            cmd += ["--child-size", str(size)]
+        try:
+            proc = subprocess.run(cmd, cwd=REPO_DIR, env=env, capture_output=True, text=True, timeout=timeout)
+        except subprocess.TimeoutExpired:
+            return {"error": f"timeout after {timeout}s"}
+        lines = [line for line in proc.stdout.splitlines() if line.startswith("{")]
+        if proc.returncode != 0 or not lines:
+            return {"error": (proc.stderr or "no output").strip().splitlines()[-1][:300]}
+        return json.loads(lines[-1])
+
+
+# ─────────────────────────────────────────────
+# Baseline
+# ─────────────────────────────────────────────
+def machine_info() -> Dict[str, Any]:
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    }
+
+
+def load_baseline() -> Dict[str, Any]:
+    if not BASELINE_PATH.exists():
+        return {}
+    return json.loads(BASELINE_PATH.read_text(encoding="utf-8")).get("results", {})
+
+
+def compare(key: str, current: Dict[str, Any], base: Optional[Dict[str, Any]], tolerance: float = LATENCY_TOLERANCE) -> List[str]:
+    if not base or "p50_ms" not in current or "p50_ms" not in base:
+        return []
+    flags = []
+    # Both the median and the best run must be slower, so one noisy sample does not flag.
+    slower = current["p50_ms"] > base["p50_ms"] * (1 + tolerance)
+    if slower and current.get("min_ms", 0) > base.get("min_ms", 0) * (1 + tolerance):
+        flags.append(f"{key}: p50 {base['p50_ms']}ms → {current['p50_ms']}ms")
+    base_rss, rss = base.get("peak_rss_mb"), current.get("peak_rss_mb")
+    if base_rss and rss and rss > base_rss * (1 + RSS_TOLERANCE):
+        flags.append(f"{key}: peak RSS {base_rss}MB → {rss}MB")
+    return flags
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.run")
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)))
+    parser.add_argument("--only", default="")
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--json", dest="json_out", default="")
+    parser.add_argument("--timeout", type=float, default=1800)
+    parser.add_argument("--tolerance", type=float, default=LATENCY_TOLERANCE, help="allowed p50 slowdown, e.g. 0.5 on noisy shared runners")
+    parser.add_argument("--child", default="", help=argparse.SUPPRESS)
+    parser.add_argument("--child-size", type=int, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        run_child(args.child, args.child_size)
+        return 0
+
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+    names = [n.strip() for n in args.only.split(",") if n.strip()] or list(BENCHMARKS)
+    baseline = load_baseline()
+    results: Dict[str, Any] = {}
+    regressions: List[str] = []
+
+    for name in names:
+        for size in (sizes if BENCHMARKS[name]["sized"] else [None]):
+            key = name if size is None else f"{name}@{size}"
+            result = run_one(name, size, args.timeout)
+            results[key] = result
+            flags = compare(key, result, baseline.get(key), args.tolerance)
+            regressions += flags
+            status = result.get("skipped") or result.get("error") or (
+                f"p50={result['p50_ms']}ms p95={result['p95_ms']}ms "
+                f"ops/s={result['ops_per_s']} rss={result['peak_rss_mb']}MB"
+            )
+            print(f"{'!!' if flags else '  '} {key:<28} {status}", flush=True)
+
+    if args.json_out:
+        Path(args.json_out).write_text(json.dumps({"meta": machine_info(), "results": results}, indent=2), encoding="utf-8")
+
+    if args.save_baseline:
+        merged = {**baseline, **{k: v for k, v in results.items() if "p50_ms" in v}}
+        BASELINE_PATH.write_text(
+            json.dumps({"meta": machine_info(), "results": merged}, ensure_ascii=False, indent=2) + "\n",
+            encoding="utf-8",
+        )
+        print(f"baseline saved: {BASELINE_PATH}")
+        return 0
+
+    if regressions:
+        print("\nregressions:")
+        for flag in regressions:
+            print(f"  - {flag}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
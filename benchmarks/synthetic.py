@@ -0,0 +1,91 @@
+import json
+import random
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Dict, List
+
+PLATFORMS = ["tiktok", "telegram", "facebook", "instagram"]
+CATEGORIES = ["سماعات", "ساعة ذكية", "هاتف ذكي", "إكسسوارات", "منزل", "مطبخ", "ألعاب", "جمال"]
+COUNTRIES = ["MA", "DZ", "TN", "EG", "SA", "AE", "FR"]
+
+
+def iso(ts: float) -> str:
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(ts))
+
+
+def _metrics(rng: random.Random, platform: str) -> Dict[str, Any]:
+    views = rng.randint(100, 200000)
+    metrics = {
+        "views": views,
+        "likes": int(views * rng.uniform(0.01, 0.12)),
+        "comments": int(views * rng.uniform(0.001, 0.01)),
+        "shares": int(views * rng.uniform(0.0005, 0.01)),
+        "metrics_source": f"{platform}_synthetic",
+    }
+    if platform in ("facebook", "instagram"):
+        metrics["impressions"] = metrics.pop("views")
+    if platform == "telegram":
+        metrics["forwards"] = int(views * rng.uniform(0.001, 0.02))
+        metrics["reactions"] = int(views * rng.uniform(0.005, 0.05))
+    return metrics
+
+
+def make_posts(count: int, seed: int = 1, days: int = 60, history: int = 4) -> List[Dict[str, Any]]:
+    """
+    منشورات بشكل unified_db موزعة على آخر days يومًا (حوالي 7/days منها مؤهل للمزامنة)
+    """
+    rng = random.Random(seed)
+    now = time.time()
+    posts = []
+    for i in range(count):
+        platform = PLATFORMS[i % len(PLATFORMS)]
+        published = now - rng.uniform(0, days * 86400)
+        posts.append({
+            "id": str(uuid.UUID(int=rng.getrandbits(128))),
+            "product_id": f"prod-{rng.randint(1, max(1, count // 3))}",
+            "platform": platform,
+            "platform_post_id": f"{platform[:2]}{i}" if platform != "tiktok" else f"v.pub_url/{7300000000000000000 + i}",
+            "publish_status": "published",
+            "published_at": iso(published),
+            "country": rng.choice(COUNTRIES),
+            "category": rng.choice(CATEGORIES),
+            "short_title": f"عرض رقم {i}",
+            "source_mode": "deal",
+            "tracked_url": f"https://example.test/r/{i}",
+            "destination_url": f"https://shop.example.test/p/{i}",
+            "channel_id": "@bench",
+            "raw_publish_response": {"publish_id": f"pub_{i}"},
+            "metrics": _metrics(rng, platform),
+            "history": [
+                {"event": "metrics_synced", "at": iso(published + h * 3600), "platform": platform}
+                for h in range(history)
+            ],
+        })
+    return posts
+
+
+def make_unified_db(count: int, seed: int = 1) -> Dict[str, Any]:
+    return {
+        "meta": {"schema_version": 1, "created_at": iso(time.time()), "updated_at": iso(time.time())},
+        "posts": make_posts(count, seed),
+        "clicks": [],
+    }
+
+
+def make_deals(count: int, seed: int = 1) -> List[Dict[str, Any]]:
+    rng = random.Random(seed)
+    return [
+        {
+            "image_url": f"https://img.example.test/{seed}/{i}.jpg",
+            "title": f"{rng.choice(CATEGORIES)} — عرض {i}",
+            "price": f"{rng.randint(49, 2999)} MAD",
+            "discount": f"{rng.randint(5, 70)}%",
+        }
+        for i in range(count)
+    ]
+
+
+def write_json(path: Path, data: Any) -> Path:
+    path.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+    return path
@@ -0,0 +1,188 @@
+import os
+import time
+import asyncio
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+CLICK_BUFFER_SIZE = int(os.environ.get("CLICK_BUFFER_SIZE", "100000"))
+CLICK_FLUSH_INTERVAL = float(os.environ.get("CLICK_FLUSH_INTERVAL", "5"))
+CLICK_FLUSH_BATCH = int(os.environ.get("CLICK_FLUSH_BATCH", "5000"))
+CLICK_DEST_TTL_SECONDS = float(os.environ.get("CLICK_DEST_TTL", "300"))
+CLICK_DEST_MISS_TTL_SECONDS = 30.0
+CLICK_DEST_CACHE_MAX = 50000
+# Unknown ids live in their own small cache so probing random ids cannot evict real destinations.
+CLICK_DEST_MISS_CACHE_MAX = 5000
+
+# Set by a CDN/proxy in front of the app; the first one present wins.
+COUNTRY_HEADERS = ("cf-ipcountry", "x-vercel-ip-country", "cloudfront-viewer-country", "x-country-code")
+
+BOT_MARKERS = ("bot", "crawler", "spider", "preview", "facebookexternalhit", "slurp", "curl", "python-requests", "httpx")
+IN_APP_MARKERS = ("tiktok", "bytedance", "musical_ly", "telegram", "fban", "fbav", "instagram")
+
+# ring buffer: إن امتلأ قبل التفريغ تُسقط أقدم النقرات بدل أن يتباطأ التحويل
+_buffer: Deque[Dict[str, Any]] = deque(maxlen=CLICK_BUFFER_SIZE)
+_destinations: Dict[str, Tuple[str, float]] = {}
+_unknown: Dict[str, float] = {}
+_flusher: Optional[asyncio.Task] = None
+_wake: Optional[asyncio.Event] = None
+STATS = {"recorded": 0, "flushed": 0, "dropped": 0, "flush_errors": 0, "dest_hits": 0, "dest_misses": 0}
+
+
+def utc_now() -> str:
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+
+
+# ─────────────────────────────────────────────
+# Classification
+# ─────────────────────────────────────────────
+def agent_class(user_agent: str) -> str:
+    ua = (user_agent or "").lower()
+    if not ua:
+        return "unknown"
+    if any(marker in ua for marker in BOT_MARKERS):
+        return "bot"
+    if any(marker in ua for marker in IN_APP_MARKERS):
+        return "in_app"
+    if "ipad" in ua or "tablet" in ua:
+        return "tablet"
+    if "mobi" in ua or "android" in ua or "iphone" in ua:
+        return "mobile"
+    return "desktop"
+
+
+def country_hint(headers) -> Optional[str]:
+    for name in COUNTRY_HEADERS:
+        value = (headers.get(name) or "").strip().upper()
+        if len(value) == 2 and value.isalpha() and value != "XX":
+            return value
+    # Accept-Language "ar-MA,ar;q=0.9" → MA
+    lang = (headers.get("accept-language") or "").split(",")[0].strip()
+    if "-" in lang:
+        region = lang.split("-")[-1].split(";")[0].upper()
+        if len(region) == 2 and region.isalpha():
+            return region
+    return None
+
+
+# ─────────────────────────────────────────────
+# Buffer
+# ─────────────────────────────────────────────
+def record_click(post_id: str, headers) -> None:
+    """
+    O(1) في الذاكرة فقط — لا قفل ولا قرص في مسار التحويل
+    """
+    if len(_buffer) == _buffer.maxlen:
+        STATS["dropped"] += 1
+    _buffer.append({
+        "post_id": post_id,
+        "at": utc_now(),
+        "country": country_hint(headers),
+        "agent": agent_class(headers.get("user-agent") or ""),
+    })
+    STATS["recorded"] += 1
+    if _wake is not None and len(_buffer) >= CLICK_FLUSH_BATCH:
+        _wake.set()
+
+
+def drain(limit: int = CLICK_FLUSH_BATCH) -> List[Dict[str, Any]]:
+    events = []
+    while _buffer and len(events) < limit:
+        events.append(_buffer.popleft())
+    return events
+
+
+def pending() -> int:
+    return len(_buffer)
+
+
+async def flush(store: Callable[[List[Dict[str, Any]]], Awaitable[Any]]) -> int:
+    total = 0
+    while _buffer:
+        events = drain()
+        try:
+            await store(events)
+        except Exception:
+            # نعيدها إلى مقدمة المخزن لتُحاول في الدورة التالية
+            STATS["flush_errors"] += 1
+            _buffer.extendleft(reversed(events))
+            break
+        total += len(events)
+        STATS["flushed"] += len(events)
+    return total
+
+
+async def _flush_loop(store: Callable[[List[Dict[str, Any]]], Awaitable[Any]]) -> None:
+    while True:
+        try:
+            await asyncio.wait_for(_wake.wait(), timeout=CLICK_FLUSH_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        _wake.clear()
+        await flush(store)
+
+
+def start_flusher(store: Callable[[List[Dict[str, Any]]], Awaitable[Any]]) -> None:
+    global _flusher, _wake
+    if _flusher is None or _flusher.done():
+        _wake = asyncio.Event()
+        _flusher = asyncio.create_task(_flush_loop(store))
+
+
+async def stop_flusher(store: Callable[[List[Dict[str, Any]]], Awaitable[Any]]) -> None:
+    global _flusher
+    if _flusher is not None:
+        _flusher.cancel()
+        try:
+            await _flusher
+        except asyncio.CancelledError:
+            pass
+        _flusher = None
+    await flush(store)
+
+
+# ─────────────────────────────────────────────
+# Destinations
+# ─────────────────────────────────────────────
+def _bounded_put(cache: Dict[str, Any], key: str, value: Any, limit: int) -> None:
+    if key not in cache and len(cache) >= limit:
+        cache.pop(next(iter(cache)), None)
+    cache[key] = value
+
+
+def remember_destination(row: Dict[str, Any]) -> None:
+    """
+    مستمع tracker.add_post_listener: كل منشور يُحفظ يدخل الذاكرة المؤقتة قبل أول نقرة عليه
+    """
+    post_id = row.get("id")
+    # tracked_url is usually this very /r/ link, so only destination_url is followed.
+    url = row.get("destination_url")
+    if post_id and url:
+        _unknown.pop(post_id, None)
+        _bounded_put(_destinations, post_id, (url, time.monotonic() + CLICK_DEST_TTL_SECONDS), CLICK_DEST_CACHE_MAX)
+
+
+async def resolve_destination(post_id: str, lookup: Callable[[str], Optional[Dict[str, Any]]]) -> Optional[str]:
+    """
+    الوجهة من ذاكرة مؤقتة بمهلة؛ lookup (قاعدة البيانات) في thread فقط عند أول طلب أو بعد انتهاء المهلة
+    """
+    now = time.monotonic()
+    cached = _destinations.get(post_id)
+    if cached and cached[1] > now:
+        STATS["dest_hits"] += 1
+        return cached[0]
+    if _unknown.get(post_id, 0) > now:
+        STATS["dest_hits"] += 1
+        return None
+    STATS["dest_misses"] += 1
+    row = await asyncio.to_thread(lookup, post_id)
+    url = (row or {}).get("destination_url") or None
+    if url:
+        _bounded_put(_destinations, post_id, (url, now + CLICK_DEST_TTL_SECONDS), CLICK_DEST_CACHE_MAX)
+    else:
+        _destinations.pop(post_id, None)
+        _bounded_put(_unknown, post_id, now + CLICK_DEST_MISS_TTL_SECONDS, CLICK_DEST_MISS_CACHE_MAX)
+    return url
+
+
+def stats() -> Dict[str, Any]:
+    return {**STATS, "pending": len(_buffer), "buffer_size": _buffer.maxlen, "cached_destinations": len(_destinations), "cached_unknown": len(_unknown)}
@@ -0,0 +1,223 @@
+import os
+import time
+import hashlib
+import mimetypes
+from collections import deque
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Any, Dict, Optional, Tuple
+
+import anyio
+from fastapi import Request
+from fastapi.responses import JSONResponse, Response
+
+FILES_CACHE_CONTROL = os.environ.get("FILES_CACHE_CONTROL", "public, max-age=31536000, immutable")
+# مثال: "/_protected_files/" — يترك nginx يرسل الملف بـ sendfile بدل عملية Python
+FILES_ACCEL_REDIRECT = os.environ.get("FILES_ACCEL_REDIRECT", "").strip()
+FILES_CHUNK_SIZE = int(os.environ.get("FILES_CHUNK_SIZE", str(1024 * 1024)))
+FILES_IO_THREADS = int(os.environ.get("FILES_IO_THREADS", "8"))
+
+# Dedicated thread budget for disk reads so large TikTok pulls cannot starve
+# the default pool that sync endpoints such as /extract run on.
+_io_limiter: Optional[anyio.CapacityLimiter] = None
+
+DOWNLOAD_STATS: Dict[str, Any] = {
+    "downloads": 0,
+    "bytes_sent": 0,
+    "seconds": 0.0,
+    "active": 0,
+    "recent": deque(maxlen=200),
+}
+
+
+def io_limiter() -> anyio.CapacityLimiter:
+    global _io_limiter
+    if _io_limiter is None:
+        _io_limiter = anyio.CapacityLimiter(FILES_IO_THREADS)
+    return _io_limiter
+
+
+def resolve_file(root: str, name: str) -> Optional[str]:
+    base = os.path.realpath(root)
+    path = os.path.realpath(os.path.join(base, name))
+    if not path.startswith(base + os.sep) or not os.path.isfile(path):
+        return None
+    return path
+
+
+def strong_etag(st: os.stat_result) -> str:
+    # Files under FILES_DIR are written once under a fresh uuid name, so
+    # inode + size + mtime identify the exact bytes.
+    raw = f"{st.st_ino}-{st.st_size}-{st.st_mtime_ns}".encode()
+    return '"' + hashlib.sha1(raw).hexdigest() + '"'
+
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    يدعم نطاقًا واحدًا فقط: bytes=a-b | bytes=a- | bytes=-n
+    يرجع (start, end) شاملًا، أو None إذا كان غير صالح، أو (-1, -1) إذا غير قابل للتلبية
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, _, last = spec.strip().partition("-")
+    try:
+        if first == "":
+            length = int(last)
+            if length <= 0:
+                return (-1, -1)
+            return (max(0, size - length), size - 1)
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        return None
+    if start >= size or end < start:
+        return (-1, -1)
+    return (start, min(end, size - 1))
+
+
+def _not_modified(request: Request, etag: str, mtime: float) -> bool:
+    inm = request.headers.get("if-none-match")
+    if inm:
+        tags = [t.strip() for t in inm.split(",")]
+        return "*" in tags or etag in tags or f"W/{etag}" in tags
+    ims = request.headers.get("if-modified-since")
+    if ims:
+        try:
+            return int(mtime) <= int(parsedate_to_datetime(ims).timestamp())
+        except Exception:
+            return False
+    return False
+
+
+def _record_download(name: str, status: int, sent: int, started: float, completed: bool) -> None:
+    elapsed = max(time.perf_counter() - started, 1e-6)
+    DOWNLOAD_STATS["downloads"] += 1
+    DOWNLOAD_STATS["bytes_sent"] += sent
+    DOWNLOAD_STATS["seconds"] += elapsed
+    DOWNLOAD_STATS["recent"].append({
+        "file": name,
+        "status": status,
+        "bytes": sent,
+        "seconds": round(elapsed, 4),
+        "bytes_per_sec": int(sent / elapsed),
+        "completed": completed,
+        "at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    })
+
+
+def download_stats() -> Dict[str, Any]:
+    seconds = DOWNLOAD_STATS["seconds"]
+    return {
+        "downloads": DOWNLOAD_STATS["downloads"],
+        "active": DOWNLOAD_STATS["active"],
+        "bytes_sent": DOWNLOAD_STATS["bytes_sent"],
+        "avg_bytes_per_sec": int(DOWNLOAD_STATS["bytes_sent"] / seconds) if seconds else 0,
+        "recent": list(DOWNLOAD_STATS["recent"]),
+    }
+
+
+class SendfileResponse(Response):
+    """
+    يرسل مقطعًا [offset, offset+count) من ملف:
+    - zerocopysend إن دعمه الخادم (sendfile من النواة)
+    - pathsend للملف كاملًا
+    - وإلا قراءة pread على خيوط مخصصة دون حجز حلقة الأحداث
+    """
+
+    def __init__(self, path: str, name: str, offset: int, count: int, status_code: int, headers: Dict[str, str], send_body: bool = True):
+        super().__init__(content=None, status_code=status_code, headers=headers)
+        self.path = path
+        self.name = name
+        self.offset = offset
+        self.count = count
+        self.send_body = send_body
+
+    async def __call__(self, scope, receive, send) -> None:
+        extensions = scope.get("extensions") or {}
+        started = time.perf_counter()
+        sent = 0
+        completed = False
+        DOWNLOAD_STATS["active"] += 1
+        try:
+            await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+            if not self.send_body or self.count == 0:
+                await send({"type": "http.response.body", "body": b""})
+                completed = True
+                return
+
+            if "http.response.zerocopysend" in extensions:
+                with open(self.path, "rb") as f:
+                    await send({
+                        "type": "http.response.zerocopysend",
+                        "file": f.fileno(),
+                        "offset": self.offset,
+                        "count": self.count,
+                    })
+                sent = self.count
+            elif "http.response.pathsend" in extensions and self.offset == 0 and self.count == os.path.getsize(self.path):
+                await send({"type": "http.response.pathsend", "path": self.path})
+                sent = self.count
+            else:
+                fd = os.open(self.path, os.O_RDONLY)
+                try:
+                    pos, end = self.offset, self.offset + self.count
+                    while pos < end:
+                        n = min(FILES_CHUNK_SIZE, end - pos)
+                        chunk = await anyio.to_thread.run_sync(os.pread, fd, n, pos, limiter=io_limiter())
+                        if not chunk:
+                            break
+                        pos += len(chunk)
+                        sent += len(chunk)
+                        await send({"type": "http.response.body", "body": chunk, "more_body": pos < end})
+                finally:
+                    os.close(fd)
+            completed = sent == self.count
+        except OSError:
+            pass
+        finally:
+            DOWNLOAD_STATS["active"] -= 1
+            if self.send_body:
+                _record_download(self.name, self.status_code, sent, started, completed)
+
+
+def serve_file(request: Request, root: str, name: str):
+    path = resolve_file(root, name)
+    if not path:
+        return JSONResponse({"ok": False, "error": "file_not_found"}, status_code=404)
+
+    st = os.stat(path)
+    size = st.st_size
+    etag = strong_etag(st)
+    headers = {
+        "accept-ranges": "bytes",
+        "etag": etag,
+        "last-modified": formatdate(st.st_mtime, usegmt=True),
+        "cache-control": FILES_CACHE_CONTROL,
+        "content-type": mimetypes.guess_type(path)[0] or "application/octet-stream",
+    }
+
+    if _not_modified(request, etag, st.st_mtime):
+        return Response(status_code=304, headers={k: headers[k] for k in ("etag", "last-modified", "cache-control")})
+
+    status_code, start, end = 200, 0, size - 1
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (not if_range or if_range.strip() == etag):
+        rng = parse_range(range_header, size)
+        if rng == (-1, -1):
+            return Response(status_code=416, headers={"content-range": f"bytes */{size}", "accept-ranges": "bytes"})
+        if rng:
+            status_code, (start, end) = 206, rng
+            headers["content-range"] = f"bytes {start}-{end}/{size}"
+
+    count = max(0, end - start + 1)
+    headers["content-length"] = str(count)
+
+    if FILES_ACCEL_REDIRECT:
+        # nginx يتولى Range و sendfile بنفسه؛ نعيد الرأس فقط
+        accel = {k: v for k, v in headers.items() if k not in ("content-length", "content-range")}
+        accel["x-accel-redirect"] = FILES_ACCEL_REDIRECT.rstrip("/") + "/" + os.path.relpath(path, os.path.realpath(root))
+        accel["x-accel-buffering"] = "no"
+        return Response(status_code=200, headers=accel)
+
+    return SendfileResponse(path, name, start, count, status_code, headers, send_body=request.method != "HEAD")
@@ -0,0 +1,225 @@
+"""
+خريطة تفاعل مسبقة الحساب: (المنصة، الفئة، يوم الأسبوع، الساعة UTC) ← تقدير مُنكمِش
+
+- كل منشور له مساهمة واحدة تُطرح وتُضاف عند وصول مقاييس جديدة (tracker.add_post_listener)
+- التقدير: الخانة تنكمش نحو خانة المنصة لنفس اليوم/الساعة، وهذه تنكمش نحو متوسط المنصة
+  فالخانات قليلة العينات لا تتصدر بمنشور واحد محظوظ
+- ترتيب الخانات الـ168 لكل (منصة، فئة) يُحفظ ويُبطَل عند أي تحديث لتلك المنصة،
+  فأفضل خانة قادمة تُقرأ من رأس الترتيب
+"""
+import os
+import math
+import time
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+import tracker
+
+# Pseudo-observations of the parent estimate each bucket starts with.
+HEATMAP_PRIOR_STRENGTH = float(os.environ.get("HEATMAP_PRIOR_STRENGTH", "5"))
+HEATMAP_MAX_AGE_DAYS = int(os.environ.get("HEATMAP_MAX_AGE_DAYS", "180"))
+# Full rebuild interval, so posts age out of HEATMAP_MAX_AGE_DAYS without a restart.
+HEATMAP_REBUILD_SECONDS = int(os.environ.get("HEATMAP_REBUILD_SECONDS", "3600"))
+
+ALL = "*"
+WEEKDAYS = ("Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun")
+SLOTS = 7 * 24
+
+_lock = threading.RLock()
+_state: Dict[str, Any] = {
+    "posts": None,      # the tracker posts list the aggregates were built from
+    "built_at": 0.0,
+    "cells": {},        # (platform, category, weekday, hour) -> [n, sum]
+    "totals": {},       # platform -> [n, sum]
+    "contrib": {},      # post id -> (platform, category, weekday, hour, value)
+    "ranks": {},        # (platform, category) -> [(estimate, n, platform_n, weekday, hour), ...] best first
+}
+
+
+def _category(value: Any) -> str:
+    return str(value or "").strip().lower() or ALL
+
+
+def _parse_time(value: Any) -> Optional[datetime]:
+    try:
+        dt = datetime.fromisoformat(str(value or "").strip())
+    except ValueError:
+        return None
+    return dt.astimezone(timezone.utc) if dt.tzinfo else dt.replace(tzinfo=timezone.utc)
+
+
+def _observation(row: Dict[str, Any], cutoff: datetime) -> Optional[Tuple[str, str, int, int, float]]:
+    metrics = row.get("metrics") or {}
+    platform = (row.get("platform") or "").strip().lower()
+    # No views yet means no engagement rate, not a zero one.
+    if not platform or not (metrics.get("views") or metrics.get("impressions")):
+        return None
+    published = _parse_time(row.get("published_at"))
+    if published is None or published < cutoff:
+        return None
+    # log1p keeps a single viral post from dominating its bucket's mean.
+    value = math.log1p(max(0.0, tracker.compute_engagement_score(metrics)))
+    return platform, _category(row.get("category")), published.weekday(), published.hour, value
+
+
+def _apply(obs: Tuple[str, str, int, int, float], sign: int) -> None:
+    platform, category, weekday, hour, value = obs
+    updates = [(_state["totals"], platform), (_state["cells"], (platform, ALL, weekday, hour))]
+    if category != ALL:
+        updates.append((_state["cells"], (platform, category, weekday, hour)))
+    for bucket, key in updates:
+        n, total = bucket.get(key, (0, 0.0))
+        n += sign
+        if n <= 0:
+            bucket.pop(key, None)
+        else:
+            bucket[key] = [n, total + sign * value]
+
+
+def _cutoff() -> datetime:
+    return datetime.now(timezone.utc) - timedelta(days=HEATMAP_MAX_AGE_DAYS)
+
+
+def rebuild(posts: List[Dict[str, Any]]) -> None:
+    with _lock:
+        _state.update({"posts": posts, "built_at": time.monotonic(), "cells": {}, "totals": {}, "contrib": {}, "ranks": {}})
+        cutoff = _cutoff()
+        for row in posts:
+            obs = _observation(row, cutoff)
+            if obs is not None:
+                _state["contrib"][row.get("id")] = obs
+                _apply(obs, 1)
+
+
+def observe(row: Dict[str, Any]) -> None:
+    """
+    تحديث تزايدي بمنشور واحد: تُطرح مساهمته السابقة وتُضاف الجديدة
+    """
+    with _lock:
+        if _state["posts"] is None:
+            return
+        post_id = row.get("id")
+        old = _state["contrib"].pop(post_id, None)
+        new = _observation(row, _cutoff())
+        if new is not None:
+            _state["contrib"][post_id] = new
+        if old == new:
+            return
+        touched = set()
+        for obs, sign in ((old, -1), (new, 1)):
+            if obs is not None:
+                _apply(obs, sign)
+                touched.add(obs[0])
+        _state["ranks"] = {key: rank for key, rank in _state["ranks"].items() if key[0] not in touched}
+
+
+tracker.add_post_listener(observe)
+
+
+def _ensure_fresh() -> None:
+    posts = tracker.load_posts()
+    with _lock:
+        # A different list object means a snapshot written by another worker or save_posts().
+        if posts is not _state["posts"] or time.monotonic() - _state["built_at"] > HEATMAP_REBUILD_SECONDS:
+            rebuild(posts)
+
+
+def _estimate(platform: str, category: str, weekday: int, hour: int) -> Tuple[float, int, int]:
+    k = HEATMAP_PRIOR_STRENGTH
+    tn, ts = _state["totals"].get(platform, (0, 0.0))
+    prior = ts / tn if tn else 0.0
+    pn, ps = _state["cells"].get((platform, ALL, weekday, hour), (0, 0.0))
+    slot = (ps + k * prior) / (pn + k) if pn + k else prior
+    if category == ALL:
+        return slot, pn, pn
+    cn, cs = _state["cells"].get((platform, category, weekday, hour), (0, 0.0))
+    return ((cs + k * slot) / (cn + k) if cn + k else slot), cn, pn
+
+
+def _ranking(platform: str, category: str) -> List[Tuple[float, int, int, int, int]]:
+    key = (platform, category)
+    rank = _state["ranks"].get(key)
+    if rank is None:
+        rank = []
+        for weekday in range(7):
+            for hour in range(24):
+                est, n, pn = _estimate(platform, category, weekday, hour)
+                rank.append((est, n, pn, weekday, hour))
+        rank.sort(key=lambda r: (r[0], r[1], r[2]), reverse=True)
+        _state["ranks"][key] = rank
+    return rank
+
+
+def _next_start(now: datetime, weekday: int, hour: int) -> datetime:
+    base = now.replace(minute=0, second=0, microsecond=0)
+    ahead = ((weekday - base.weekday()) * 24 + (hour - base.hour)) % SLOTS
+    if ahead == 0 and now > base:
+        ahead = SLOTS
+    return base + timedelta(hours=ahead)
+
+
+def _basis(category: str, n: int, platform_n: int) -> str:
+    if category != ALL and n:
+        return "category"
+    return "platform_slot" if platform_n else "platform_mean"
+
+
+def best_slot(platform: str, category: Optional[str] = None, within_hours: int = SLOTS, now: Optional[datetime] = None) -> Optional[Dict[str, Any]]:
+    """
+    أفضل خانة قادمة خلال within_hours — رأس الترتيب المحفوظ، فلا يمر على المنشورات
+    None إن لم يكن للمنصة أي منشور له مقاييس
+    """
+    _ensure_fresh()
+    platform = (platform or "").strip().lower()
+    category = _category(category)
+    now = (now or datetime.now(timezone.utc)).astimezone(timezone.utc)
+    horizon = timedelta(hours=max(1, min(int(within_hours), SLOTS)))
+    with _lock:
+        tn, ts = _state["totals"].get(platform, (0, 0.0))
+        if not tn:
+            return None
+        for est, n, pn, weekday, hour in _ranking(platform, category):
+            starts_at = _next_start(now, weekday, hour)
+            if starts_at - now < horizon:
+                break
+        k = HEATMAP_PRIOR_STRENGTH
+        return {
+            "platform": platform,
+            "category": None if category == ALL else category,
+            "weekday": weekday,
+            "weekday_name": WEEKDAYS[weekday],
+            "hour_utc": hour,
+            "starts_at": starts_at.strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "estimated_score": round(math.expm1(est), 4),
+            "platform_mean_score": round(math.expm1(ts / tn), 4),
+            "samples": n,
+            "platform_samples": pn,
+            "confidence": round(n / (n + k), 3) if n + k else 1.0,
+            "basis": _basis(category, n, pn),
+        }
+
+
+def grid(platform: str, category: Optional[str] = None) -> Dict[str, Any]:
+    """
+    المصفوفة 7×24 (الاثنين أولًا، ساعات UTC) بالتقديرات المنكمشة وعدد العينات
+    """
+    _ensure_fresh()
+    platform = (platform or "").strip().lower()
+    category = _category(category)
+    with _lock:
+        scores = [[0.0] * 24 for _ in range(7)]
+        samples = [[0] * 24 for _ in range(7)]
+        for est, n, _, weekday, hour in _ranking(platform, category):
+            scores[weekday][hour] = round(math.expm1(est), 4)
+            samples[weekday][hour] = n
+        tn = _state["totals"].get(platform, (0, 0.0))[0]
+    return {
+        "platform": platform,
+        "category": None if category == ALL else category,
+        "weekdays": list(WEEKDAYS),
+        "scores": scores,
+        "samples": samples,
+        "platform_samples": tn,
+        "prior_strength": HEATMAP_PRIOR_STRENGTH,
+    }
@@ -0,0 +1,141 @@
+import os
+import json
+import time
+import hashlib
+import asyncio
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from persistence import atomic_write_json, load_json
+from shared_state import shared_lock
+
+IDEMPOTENCY_PATH = Path(os.environ.get("IDEMPOTENCY_PATH", "idempotency.json"))
+IDEMPOTENCY_TTL_SECONDS = int(os.environ.get("IDEMPOTENCY_TTL_SECONDS", str(7 * 24 * 3600)))
+# Upper bound on how long another worker's in-flight publish may hold a key.
+IDEMPOTENCY_INFLIGHT_TTL_SECONDS = float(os.environ.get("IDEMPOTENCY_INFLIGHT_TTL", str(30 * 60)))
+
+_inflight: Dict[str, asyncio.Future] = {}
+_file_hashes: Dict[Tuple[str, int, int], str] = {}
+
+
+def utc_now() -> str:
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+
+
+# ─────────────────────────────────────────────
+# Keys
+# ─────────────────────────────────────────────
+def _digest(obj: Any) -> str:
+    raw = json.dumps(obj, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def file_content_hash(path: str) -> str:
+    st = os.stat(path)
+    cache_key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    cached = _file_hashes.get(cache_key)
+    if cached:
+        return cached
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(block)
+    _file_hashes[cache_key] = h.hexdigest()
+    return _file_hashes[cache_key]
+
+
+def client_key(value: Optional[str]) -> Optional[str]:
+    value = (value or "").strip()
+    return f"client:{value}" if value else None
+
+
+async def video_key(filepath: str, title: str) -> str:
+    content = await asyncio.to_thread(file_content_hash, filepath)
+    return "video:" + _digest({"content": content, "title": title})
+
+
+def photo_key(photo_images, title: str) -> str:
+    return "photo:" + _digest({"images": list(photo_images or []), "title": title})
+
+
+def deal_key(render_input: Any, title: str) -> str:
+    return "deal:" + _digest({"render": render_input, "title": title})
+
+
+# ─────────────────────────────────────────────
+# Store
+# ─────────────────────────────────────────────
+def load_store() -> Dict[str, Any]:
+    return load_json(IDEMPOTENCY_PATH, dict, validate=lambda d: isinstance(d, dict))
+
+
+def save_store(store: Dict[str, Any]) -> None:
+    now = time.time()
+    live = {k: v for k, v in store.items() if float(v.get("expires_ts") or 0) > now}
+    atomic_write_json(IDEMPOTENCY_PATH, live)
+
+
+def get_stored(key: str) -> Optional[Dict[str, Any]]:
+    entry = load_store().get(key)
+    if not entry or float(entry.get("expires_ts") or 0) <= time.time():
+        return None
+    return entry
+
+
+async def store_result(key: str, result: Dict[str, Any]) -> None:
+    async with shared_lock("idempotency:store"):
+        store = load_store()
+        store[key] = {
+            "publish_id": result.get("publish_id"),
+            "result": result,
+            "created_at": utc_now(),
+            "expires_ts": time.time() + IDEMPOTENCY_TTL_SECONDS,
+        }
+        save_store(store)
+
+
+async def run_once(key: Optional[str], fn: Callable[[], Awaitable[Any]]):
+    """
+    - نتيجة محفوظة للمفتاح: تُعاد دون رفع جديد
+    - طلب مماثل قيد التنفيذ: ينتظر نفس النتيجة
+    - تُحفظ النتائج الناجحة فقط (dict فيه ok=True) ليبقى إعادة المحاولة بعد الفشل ممكنًا
+    """
+    if not key:
+        return await fn()
+
+    stored = get_stored(key)
+    if stored:
+        return {**stored["result"], "idempotent_replay": True, "idempotency_key": key}
+
+    pending = _inflight.get(key)
+    if pending is not None:
+        result = await asyncio.shield(pending)
+        if isinstance(result, dict):
+            return {**result, "idempotent_replay": True, "idempotency_key": key}
+        return result
+
+    future = asyncio.get_running_loop().create_future()
+    _inflight[key] = future
+    try:
+        # عمال آخرون بنفس المفتاح ينتظرون هنا، ثم يجدون النتيجة المحفوظة
+        async with shared_lock(f"idempotency:{key}", ttl=IDEMPOTENCY_INFLIGHT_TTL_SECONDS, wait=IDEMPOTENCY_INFLIGHT_TTL_SECONDS):
+            stored = get_stored(key)
+            if stored:
+                result = {**stored["result"], "idempotent_replay": True, "idempotency_key": key}
+            else:
+                result = await fn()
+                if isinstance(result, dict) and result.get("ok"):
+                    result = {**result, "idempotency_key": key}
+                    await store_result(key, result)
+        future.set_result(result)
+        return result
+    except asyncio.CancelledError:
+        future.cancel()
+        raise
+    except Exception as e:
+        future.set_exception(e)
+        # نتجنب تحذير "Future exception was never retrieved" إن لم يكن هناك منتظرون
+        future.exception()
+        raise
+    finally:
+        _inflight.pop(key, None)
@@ -0,0 +1,276 @@
+import os
+import re
+import time
+import bisect
+import threading
+from typing import Any, Dict, Iterable, List, Tuple
+
+# Prometheus text exposition (format 0.0.4) without the prometheus_client dependency.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SLOW_BUCKETS = (0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+BYTES_BUCKETS = (64 * 1024, 1 << 20, 5 << 20, 10 << 20, 64 << 20, 256 << 20, 1 << 30, 4 << 30)
+THROUGHPUT_BUCKETS = (128 * 1024, 512 * 1024, 1 << 20, 2 << 20, 5 << 20, 10 << 20, 25 << 20, 50 << 20, 100 << 20)
+
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "1").strip() not in ("0", "false", "no")
+
+_registry: List["_Metric"] = []
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels_text(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _fmt(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(n, "")) for n in self.label_names)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labels: Iterable[str] = ()):
+        super().__init__(name, help_text, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return self.header() + [f"{self.name}{_labels_text(self.label_names, k)} {_fmt(v)}" for k, v in items]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, labels: Iterable[str] = ()):
+        super().__init__(name, help_text, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = float(value)
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return self.header() + [f"{self.name}{_labels_text(self.label_names, k)} {_fmt(v)}" for k, v in items]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels: Iterable[str] = (), buckets: Iterable[float] = LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+        # key -> [bucket counts..., +Inf count, sum]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            row = self._values.get(key)
+            if row is None:
+                row = self._values[key] = [0.0] * (len(self.buckets) + 2)
+            row[idx] += 1
+            row[-1] += value
+
+    def time(self, **labels) -> "_Timer":
+        return _Timer(self, labels)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = [(k, list(v)) for k, v in self._values.items()]
+        lines = self.header()
+        for key, row in items:
+            cumulative = 0.0
+            for bound, count in zip(self.buckets + (float("inf"),), row[:-1]):
+                cumulative += count
+                le = 'le="%s"' % _fmt(bound)
+                lines.append(f"{self.name}_bucket{_labels_text(self.label_names, key, le)} {_fmt(cumulative)}")
+            lines.append(f"{self.name}_sum{_labels_text(self.label_names, key)} {_fmt(row[-1])}")
+            lines.append(f"{self.name}_count{_labels_text(self.label_names, key)} {_fmt(cumulative)}")
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram: Histogram, labels: Dict[str, Any]):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+        return False
+
+
+def render() -> str:
+    lines: List[str] = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# ─────────────────────────────────────────────
+# Metrics
+# ─────────────────────────────────────────────
+HTTP_REQUEST_SECONDS = Histogram(
+    "ouinoual_http_request_duration_seconds", "Request latency by route template.", ("method", "route", "status"),
+)
+HTTP_IN_FLIGHT = Gauge("ouinoual_http_requests_in_flight", "Requests currently being served.")
+EXTERNAL_API_SECONDS = Histogram(
+    "ouinoual_external_api_duration_seconds", "Latency of outbound API calls until response headers.",
+    ("service", "endpoint", "method", "status"),
+)
+EXTERNAL_API_ERRORS = Counter(
+    "ouinoual_external_api_errors_total", "Outbound API calls that failed before a response.", ("service", "endpoint", "error"),
+)
+YTDLP_SECONDS = Histogram("ouinoual_ytdlp_download_duration_seconds", "yt-dlp run time.", ("status",), buckets=SLOW_BUCKETS)
+YTDLP_BYTES = Histogram("ouinoual_ytdlp_download_size_bytes", "Size of files downloaded by yt-dlp.", buckets=BYTES_BUCKETS)
+UPLOAD_BYTES = Counter("ouinoual_upload_bytes_total", "Bytes PUT to TikTok upload URLs.")
+UPLOAD_CHUNK_SECONDS = Histogram("ouinoual_upload_chunk_duration_seconds", "Time per uploaded chunk.", ("status",))
+UPLOAD_THROUGHPUT = Histogram(
+    "ouinoual_upload_throughput_bytes_per_second", "Per-upload average throughput.", buckets=THROUGHPUT_BUCKETS,
+)
+DB_SECONDS = Histogram("ouinoual_db_operation_duration_seconds", "unified_db load/save/journal time.", ("op",))
+DB_FILE_BYTES = Gauge("ouinoual_db_file_size_bytes", "Size of the JSON stores on disk.", ("file",))
+TOKEN_REFRESH = Counter("ouinoual_token_refresh_total", "TikTok access token refreshes.", ("result",))
+QUEUE_DEPTH = Gauge("ouinoual_queue_depth", "Pending work per queue.", ("queue",))
+METRICS_SYNC_POSTS = Counter("ouinoual_metrics_sync_posts_total", "Posts refreshed by metrics sync.", ("platform",))
+ANALYTICS_CACHE = Counter("ouinoual_analytics_cache_total", "Analytics endpoint cache lookups.", ("result",))
+
+
+# ─────────────────────────────────────────────
+# httpx hooks
+# ─────────────────────────────────────────────
+SERVICE_HOSTS = {
+    "open.tiktokapis.com": "tiktok",
+    "open-upload.tiktokapis.com": "tiktok_upload",
+    "api.telegram.org": "telegram",
+    "graph.facebook.com": "graph",
+}
+_ID_SEGMENT = re.compile(r"^(?:\d+|[0-9a-fA-F-]{16,}|[A-Za-z0-9_\-~.]{24,})$")
+
+
+def service_for(host: str) -> str:
+    if host in SERVICE_HOSTS:
+        return SERVICE_HOSTS[host]
+    if "upload" in host and "tiktok" in host:
+        return "tiktok_upload"
+    return host or "unknown"
+
+
+def endpoint_for(path: str) -> str:
+    """
+    قوالب ثابتة لعدد محدود من السلاسل: التوكن والمعرفات تُستبدل
+    """
+    parts = []
+    for segment in path.split("/"):
+        if segment.startswith("bot") and ":" in segment:
+            parts.append("bot{token}")
+        elif _ID_SEGMENT.match(segment):
+            parts.append("{id}")
+        else:
+            parts.append(segment)
+    return "/".join(parts) or "/"
+
+
+async def _on_request(request) -> None:
+    request.extensions["ouinoual_started"] = time.perf_counter()
+
+
+async def _on_response(response) -> None:
+    request = response.request
+    started = request.extensions.get("ouinoual_started")
+    if started is None:
+        return
+    EXTERNAL_API_SECONDS.observe(
+        time.perf_counter() - started,
+        service=service_for(request.url.host),
+        endpoint=endpoint_for(request.url.path),
+        method=request.method,
+        status=response.status_code,
+    )
+
+
+HTTPX_EVENT_HOOKS = {"request": [_on_request], "response": [_on_response]} if METRICS_ENABLED else {}
+
+
+def record_http_error(url, error: BaseException) -> None:
+    EXTERNAL_API_ERRORS.inc(service=service_for(url.host), endpoint=endpoint_for(url.path), error=type(error).__name__)
+
+
+# ─────────────────────────────────────────────
+# ASGI middleware
+# ─────────────────────────────────────────────
+class MetricsMiddleware:
+    """
+    وسيط ASGI خام (لا BaseHTTPMiddleware) كي لا يُخزن جسم الاستجابة ولا يكسر البث/SSE
+    القالب من scope["route"].path فيبقى عدد السلاسل محدودًا
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_IN_FLIGHT.inc(-1)
+            route = scope.get("route")
+            HTTP_REQUEST_SECONDS.observe(
+                time.perf_counter() - started,
+                method=scope.get("method", ""),
+                route=getattr(route, "path", None) or "unmatched",
+                status=status["code"],
+            )
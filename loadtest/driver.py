@@ -0,0 +1,300 @@
+"""
+مشغّل حمل: طلبات نشر ومزامنة متزامنة ضد التطبيق، ثم تقرير بالإنتاجية وزمن الذيل
+
+python -m loadtest.driver                                   # يشغّل fake_api والتطبيق في مجلد مؤقت
+python -m loadtest.driver --concurrency 50 --duration 60 --mix publish=2,photo=1,sync=4
+python -m loadtest.driver --latency-ms 300 --rate-limit-rate 0.05 --error-rate 0.01
+python -m loadtest.driver --app-url http://127.0.0.1:8000 --fake-url http://127.0.0.1:9100
+
+مع --app-url يجب أن يكون التطبيق قد شُغّل بـ TIKTOK_API_BASE/TELEGRAM_API_BASE تشير إلى fake_api
+"""
+import os
+import sys
+import json
+import time
+import random
+import socket
+import asyncio
+import argparse
+import subprocess
+import tempfile
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import httpx
+
+from benchmarks.run import REPO_DIR, bench_env
+
+LOADTEST_FILE_ID = "loadtest"
+DEFAULT_MIX = "publish=2,photo=1,sync=4"
+SEED_PLATFORMS = ("tiktok", "telegram")
+
+
+# ─────────────────────────────────────────────
+# Processes
+# ─────────────────────────────────────────────
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_ready(url: str, timeout: float = 30) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(url, timeout=1).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"not ready after {timeout}s: {url}")
+
+
+def prepare_workdir(workdir: Path, video_kb: int) -> None:
+    (workdir / "files").mkdir(parents=True, exist_ok=True)
+    with open(workdir / "files" / f"{LOADTEST_FILE_ID}.mp4", "wb") as f:
+        f.write(os.urandom(video_kb * 1024))
+    now = time.time()
+    (workdir / "tokens.json").write_text(json.dumps({
+        "access_token": "act.fake.loadtest",
+        "refresh_token": "rft.fake.loadtest",
+        "open_id": "fake-open-id",
+        "expires_at": now + 365 * 86400,
+        "refresh_expires_at": now + 365 * 86400,
+    }), encoding="utf-8")
+
+
+@contextmanager
+def spawned_stack(args) -> Iterator[Tuple[str, str]]:
+    """
+    fake_api والتطبيق كعمليتين uvicorn منفصلتين — التطبيق يعمل كما في الإنتاج، فقط عناوين الـ API تتغير
+    """
+    with tempfile.TemporaryDirectory(prefix="loadtest-") as tmp:
+        workdir = Path(tmp)
+        prepare_workdir(workdir, args.video_kb)
+        fake_port, app_port = free_port(), free_port()
+        fake_url, app_url = f"http://127.0.0.1:{fake_port}", f"http://127.0.0.1:{app_port}"
+        env = {
+            **bench_env(workdir),
+            "TIKTOK_API_BASE": fake_url,
+            "TELEGRAM_API_BASE": fake_url,
+            "GRAPH_API_BASE": f"{fake_url}/v19.0",
+            "TELEGRAM_CHANNEL_ID": "@loadtest",
+            "TIKTOK_METRICS_RATE": str(args.tiktok_rate),
+            "TELEGRAM_METRICS_RATE": str(args.telegram_rate),
+        }
+        log = open(workdir / "stack.log", "wb")
+        procs = [
+            subprocess.Popen(
+                [sys.executable, "-m", "loadtest.fake_api", "--port", str(fake_port)],
+                cwd=REPO_DIR, env=env, stdout=log, stderr=subprocess.STDOUT,
+            ),
+            subprocess.Popen(
+                [sys.executable, "-m", "uvicorn", "main:app", "--port", str(app_port), "--log-level", "warning"],
+                cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT,
+            ),
+        ]
+        try:
+            wait_ready(f"{fake_url}/_fake/stats")
+            wait_ready(f"{app_url}/health")
+            yield app_url, fake_url
+        except RuntimeError:
+            log.flush()
+            sys.stderr.write((workdir / "stack.log").read_text(errors="replace")[-3000:])
+            raise
+        finally:
+            for proc in procs:
+                proc.terminate()
+            for proc in procs:
+                try:
+                    proc.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    proc.kill()
+            log.close()
+
+
+# ─────────────────────────────────────────────
+# Scenarios
+# ─────────────────────────────────────────────
+async def seed_posts(client: httpx.AsyncClient, app_url: str, count: int) -> List[Dict[str, str]]:
+    posts = []
+    for i in range(count):
+        platform = SEED_PLATFORMS[i % len(SEED_PLATFORMS)]
+        platform_post_id = f"v.pub_url/{7300000000000000000 + i}" if platform == "tiktok" else str(1000 + i)
+        r = await client.post(f"{app_url}/track-publish", json={
+            "platform": platform,
+            "product_id": f"lt-{i}",
+            "platform_post_id": platform_post_id,
+            "category": random.choice(("electronics", "beauty", "home")),
+            "channel_id": "@loadtest" if platform == "telegram" else None,
+        })
+        r.raise_for_status()
+        posts.append({"platform": platform, "platform_post_id": platform_post_id})
+    return posts
+
+
+def build_requests(app_url: str, posts: List[Dict[str, str]]):
+    def publish():
+        return "POST", f"{app_url}/tiktok/publish", {
+            "file_id": LOADTEST_FILE_ID, "title": "load test", "allow_duplicate": True,
+        }
+
+    def photo():
+        return "POST", f"{app_url}/tiktok/publish_photo", {
+            "photo_url": f"https://example.invalid/{random.randint(1, 10**9)}.jpg", "title": "load test", "allow_duplicate": True,
+        }
+
+    def sync():
+        return "POST", f"{app_url}/sync-metrics", random.choice(posts)
+
+    def sync_all():
+        return "GET", f"{app_url}/metrics/all", None
+
+    return {"publish": publish, "photo": photo, "sync": sync, "sync_all": sync_all}
+
+
+def parse_mix(text: str) -> Dict[str, int]:
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip():
+            mix[name.strip()] = int(weight or 1)
+    return mix
+
+
+async def run_load(app_url: str, args) -> Dict[str, Any]:
+    samples: Dict[str, List[float]] = defaultdict(list)
+    statuses: Dict[str, Counter] = defaultdict(Counter)
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as client:
+        posts = await seed_posts(client, app_url, args.seed_posts)
+        builders = build_requests(app_url, posts)
+        mix = parse_mix(args.mix)
+        unknown = set(mix) - set(builders)
+        if unknown:
+            raise SystemExit(f"unknown scenario(s): {', '.join(sorted(unknown))}")
+        names, weights = list(mix), list(mix.values())
+
+        deadline = time.monotonic() + args.duration
+        remaining = [args.requests] if args.requests else None
+
+        def more() -> bool:
+            if remaining is not None:
+                if remaining[0] <= 0:
+                    return False
+                remaining[0] -= 1
+                return True
+            return time.monotonic() < deadline
+
+        async def worker():
+            while more():
+                name = random.choices(names, weights)[0]
+                method, url, body = builders[name]()
+                started = time.perf_counter()
+                try:
+                    r = await client.request(method, url, json=body)
+                    status = str(r.status_code)
+                except httpx.HTTPError as e:
+                    status = type(e).__name__
+                samples[name].append(time.perf_counter() - started)
+                statuses[name][status] += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - started
+
+    report = {"elapsed_s": round(elapsed, 2), "concurrency": args.concurrency, "scenarios": {}}
+    all_samples: List[float] = []
+    for name in names:
+        report["scenarios"][name] = summarize(samples[name], statuses[name], elapsed)
+        all_samples += samples[name]
+    report["total"] = summarize(all_samples, sum(statuses.values(), Counter()), elapsed)
+    return report
+
+
+def percentile(sorted_samples: List[float], q: float) -> float:
+    if not sorted_samples:
+        return 0.0
+    return sorted_samples[min(len(sorted_samples) - 1, int(len(sorted_samples) * q))]
+
+
+def summarize(samples: List[float], statuses: Counter, elapsed: float) -> Dict[str, Any]:
+    ordered = sorted(samples)
+    ok = sum(n for status, n in statuses.items() if status.startswith("2"))
+    return {
+        "requests": len(ordered),
+        "ok": ok,
+        "throughput_rps": round(len(ordered) / elapsed, 1) if elapsed else None,
+        "p50_ms": round(percentile(ordered, 0.50) * 1000, 1),
+        "p90_ms": round(percentile(ordered, 0.90) * 1000, 1),
+        "p99_ms": round(percentile(ordered, 0.99) * 1000, 1),
+        "max_ms": round(ordered[-1] * 1000, 1) if ordered else 0.0,
+        "statuses": dict(statuses),
+    }
+
+
+def print_report(report: Dict[str, Any], fake_stats: Optional[Dict[str, Any]]) -> None:
+    print(f"elapsed {report['elapsed_s']}s, concurrency {report['concurrency']}")
+    print(f"{'scenario':<10} {'reqs':>6} {'ok':>6} {'rps':>7} {'p50':>8} {'p90':>8} {'p99':>8} {'max':>8}  statuses")
+    for name, row in [*report["scenarios"].items(), ("total", report["total"])]:
+        print(
+            f"{name:<10} {row['requests']:>6} {row['ok']:>6} {row['throughput_rps'] or 0:>7} "
+            f"{row['p50_ms']:>7}ms {row['p90_ms']:>7}ms {row['p99_ms']:>7}ms {row['max_ms']:>7}ms  "
+            + " ".join(f"{k}={v}" for k, v in sorted(row["statuses"].items()))
+        )
+    if fake_stats:
+        print("\nupstream calls:", json.dumps(fake_stats.get("requests", {}), sort_keys=True))
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m loadtest.driver")
+    parser.add_argument("--app-url", default="", help="an already running app; spawns one when empty")
+    parser.add_argument("--fake-url", default="", help="fake_api of an already running stack, for config and stats")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=20, help="seconds, ignored when --requests is set")
+    parser.add_argument("--requests", type=int, default=0)
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="weighted scenarios: publish, photo, sync, sync_all")
+    parser.add_argument("--seed-posts", type=int, default=200)
+    parser.add_argument("--video-kb", type=int, default=2048)
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--latency-ms", type=float, default=None)
+    parser.add_argument("--jitter-ms", type=float, default=None)
+    parser.add_argument("--error-rate", type=float, default=None)
+    parser.add_argument("--rate-limit-rate", type=float, default=None)
+    parser.add_argument("--tiktok-rate", type=float, default=0, help="TIKTOK_METRICS_RATE for a spawned app (0 = unlimited)")
+    parser.add_argument("--telegram-rate", type=float, default=0, help="TELEGRAM_METRICS_RATE for a spawned app (0 = unlimited)")
+    parser.add_argument("--json", dest="json_out", default="")
+    args = parser.parse_args(argv)
+
+    fake_config = {
+        key: getattr(args, key)
+        for key in ("latency_ms", "jitter_ms", "error_rate", "rate_limit_rate")
+        if getattr(args, key) is not None
+    }
+
+    def run(app_url: str, fake_url: str) -> Tuple[Dict[str, Any], Optional[Dict[str, Any]]]:
+        if fake_url:
+            httpx.post(f"{fake_url}/_fake/reset")
+            if fake_config:
+                httpx.post(f"{fake_url}/_fake/config", json=fake_config)
+        report = asyncio.run(run_load(app_url, args))
+        fake_stats = httpx.get(f"{fake_url}/_fake/stats").json() if fake_url else None
+        return report, fake_stats
+
+    if args.app_url:
+        report, fake_stats = run(args.app_url.rstrip("/"), args.fake_url.rstrip("/"))
+    else:
+        with spawned_stack(args) as (app_url, fake_url):
+            report, fake_stats = run(app_url, fake_url)
+
+    print_report(report, fake_stats)
+    if args.json_out:
+        Path(args.json_out).write_text(json.dumps({**report, "upstream": fake_stats}, indent=2), encoding="utf-8")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,308 @@
+"""
+خادم محلي يحاكي TikTok وTelegram وGraph API لاختبارات الحمل — لا طلب يخرج للإنترنت
+
+python -m loadtest.fake_api --port 9100 --latency-ms 80 --jitter-ms 40 --error-rate 0.01 --rate-limit-rate 0.02
+
+ثم يُشغَّل التطبيق مع:
+TIKTOK_API_BASE=http://127.0.0.1:9100
+TELEGRAM_API_BASE=http://127.0.0.1:9100
+GRAPH_API_BASE=http://127.0.0.1:9100/v19.0
+
+الإعدادات تتغير أثناء التشغيل عبر POST /_fake/config، والعدادات في GET /_fake/stats
+"""
+import os
+import json
+import time
+import uuid
+import random
+import asyncio
+import argparse
+from collections import Counter
+from typing import Any, Dict, Optional
+from urllib.parse import parse_qs
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+CONFIG: Dict[str, Any] = {
+    "latency_ms": float(os.environ.get("FAKE_LATENCY_MS", "50")),
+    "jitter_ms": float(os.environ.get("FAKE_JITTER_MS", "25")),
+    # Fraction of requests answered with a 5xx / a 429 before doing any work.
+    "error_rate": float(os.environ.get("FAKE_ERROR_RATE", "0")),
+    "rate_limit_rate": float(os.environ.get("FAKE_RATE_LIMIT_RATE", "0")),
+    "retry_after": int(os.environ.get("FAKE_RETRY_AFTER", "1")),
+    # Upload PUT time per MiB on top of the base latency, to mimic a bandwidth cap.
+    "upload_ms_per_mb": float(os.environ.get("FAKE_UPLOAD_MS_PER_MB", "20")),
+    # status/fetch polls before a publish reports PUBLISH_COMPLETE.
+    "polls_to_complete": int(os.environ.get("FAKE_POLLS_TO_COMPLETE", "2")),
+}
+
+STATS: Counter = Counter()
+_publishes: Dict[str, Dict[str, Any]] = {}
+
+app = FastAPI(redirect_slashes=False)
+
+
+async def delay(extra_ms: float = 0.0) -> None:
+    ms = CONFIG["latency_ms"] + random.uniform(-1, 1) * CONFIG["jitter_ms"] + extra_ms
+    if ms > 0:
+        await asyncio.sleep(ms / 1000)
+
+
+def injected_failure(service: str) -> Optional[JSONResponse]:
+    roll = random.random()
+    if roll < CONFIG["rate_limit_rate"]:
+        STATS[f"{service}:429"] += 1
+        headers = {"Retry-After": str(CONFIG["retry_after"])}
+        if service == "telegram":
+            body = {
+                "ok": False,
+                "error_code": 429,
+                "description": f"Too Many Requests: retry after {CONFIG['retry_after']}",
+                "parameters": {"retry_after": CONFIG["retry_after"]},
+            }
+        elif service == "graph":
+            body = {"error": {"message": "(#4) Application request limit reached", "type": "OAuthException", "code": 4}}
+        else:
+            body = {"error": {"code": "rate_limit_exceeded", "message": "fake rate limit", "log_id": uuid.uuid4().hex}}
+        return JSONResponse(body, status_code=429, headers=headers)
+    if roll < CONFIG["rate_limit_rate"] + CONFIG["error_rate"]:
+        STATS[f"{service}:5xx"] += 1
+        if service == "telegram":
+            return JSONResponse({"ok": False, "error_code": 500, "description": "Internal Server Error"}, status_code=500)
+        return JSONResponse({"error": {"code": "internal_error", "message": "fake failure"}}, status_code=500)
+    return None
+
+
+def tiktok_ok(data: Dict[str, Any]) -> Dict[str, Any]:
+    return {"data": data, "error": {"code": "ok", "message": "", "log_id": uuid.uuid4().hex}}
+
+
+# ─────────────────────────────────────────────
+# Control
+# ─────────────────────────────────────────────
+@app.get("/_fake/config")
+def get_config():
+    return CONFIG
+
+
+@app.post("/_fake/config")
+async def set_config(request: Request):
+    body = await request.json()
+    for key, value in body.items():
+        if key in CONFIG:
+            CONFIG[key] = type(CONFIG[key])(value)
+    return CONFIG
+
+
+@app.get("/_fake/stats")
+def get_stats():
+    return {"requests": dict(STATS), "publishes": len(_publishes)}
+
+
+@app.post("/_fake/reset")
+def reset_stats():
+    STATS.clear()
+    _publishes.clear()
+    return {"ok": True}
+
+
+# ─────────────────────────────────────────────
+# TikTok
+# ─────────────────────────────────────────────
+@app.post("/v2/oauth/token/")
+async def oauth_token(request: Request):
+    STATS["tiktok:oauth_token"] += 1
+    await delay()
+    failure = injected_failure("tiktok")
+    if failure:
+        return failure
+    form = parse_qs((await request.body()).decode())
+    if not (form.get("refresh_token") or form.get("code")):
+        return JSONResponse({"error": "invalid_request", "error_description": "missing grant"}, status_code=400)
+    return {
+        "access_token": f"act.fake.{uuid.uuid4().hex}",
+        "refresh_token": f"rft.fake.{uuid.uuid4().hex}",
+        "expires_in": 86400,
+        "refresh_expires_in": 31536000,
+        "open_id": "fake-open-id",
+        "scope": "user.info.basic,video.upload,video.publish",
+        "token_type": "Bearer",
+    }
+
+
+@app.get("/v2/user/info/")
+async def user_info():
+    STATS["tiktok:user_info"] += 1
+    await delay()
+    return injected_failure("tiktok") or tiktok_ok({
+        "user": {"open_id": "fake-open-id", "display_name": "Load Test", "avatar_url": "https://example.invalid/a.png"},
+    })
+
+
+@app.post("/v2/post/publish/video/init/")
+async def video_init(request: Request):
+    STATS["tiktok:video_init"] += 1
+    await delay()
+    failure = injected_failure("tiktok")
+    if failure:
+        return failure
+    source = (await request.json()).get("source_info") or {}
+    publish_id = f"v_pub_file~v2.{uuid.uuid4().int % 10**19}"
+    _publishes[publish_id] = {
+        "kind": "video",
+        "video_size": int(source.get("video_size") or 0),
+        "received": 0,
+        "polls": 0,
+    }
+    upload_url = f"{str(request.base_url).rstrip('/')}/upload/{publish_id}"
+    return tiktok_ok({"publish_id": publish_id, "upload_url": upload_url})
+
+
+@app.put("/upload/{publish_id}")
+async def upload_chunk(publish_id: str, request: Request):
+    STATS["tiktok_upload:put"] += 1
+    pub = _publishes.get(publish_id)
+    if pub is None:
+        return JSONResponse({"error": {"code": "invalid_params", "message": "unknown upload"}}, status_code=404)
+    size = 0
+    async for part in request.stream():
+        size += len(part)
+    await delay(CONFIG["upload_ms_per_mb"] * size / (1024 * 1024))
+    failure = injected_failure("tiktok_upload")
+    if failure:
+        return failure
+    pub["received"] += size
+    STATS["tiktok_upload:bytes"] += size
+    return JSONResponse({}, status_code=201 if pub["received"] >= pub["video_size"] else 206)
+
+
+@app.post("/v2/post/publish/content/init/")
+async def content_init():
+    STATS["tiktok:content_init"] += 1
+    await delay()
+    failure = injected_failure("tiktok")
+    if failure:
+        return failure
+    publish_id = f"p_pub_url~v2.{uuid.uuid4().int % 10**19}"
+    _publishes[publish_id] = {"kind": "photo", "video_size": 0, "received": 0, "polls": 0}
+    return tiktok_ok({"publish_id": publish_id})
+
+
+@app.post("/v2/post/publish/status/fetch/")
+async def status_fetch(request: Request):
+    STATS["tiktok:status_fetch"] += 1
+    await delay()
+    failure = injected_failure("tiktok")
+    if failure:
+        return failure
+    publish_id = (await request.json()).get("publish_id")
+    pub = _publishes.get(publish_id)
+    if pub is None:
+        return JSONResponse({"data": {}, "error": {"code": "invalid_publish_id", "message": "not found"}}, status_code=400)
+    pub["polls"] += 1
+    if pub["kind"] == "video" and pub["received"] < pub["video_size"]:
+        return tiktok_ok({"status": "PROCESSING_UPLOAD", "uploaded_bytes": pub["received"]})
+    if pub["polls"] < CONFIG["polls_to_complete"]:
+        return tiktok_ok({"status": "PROCESSING_DOWNLOAD"})
+    return tiktok_ok({"status": "PUBLISH_COMPLETE", "publicaly_available_post_id": [uuid.uuid4().int % 10**19]})
+
+
+@app.post("/v2/video/query/")
+async def video_query(request: Request):
+    STATS["tiktok:video_query"] += 1
+    await delay()
+    failure = injected_failure("tiktok")
+    if failure:
+        return failure
+    ids = ((await request.json()).get("filters") or {}).get("video_ids") or []
+    now = time.time()
+    return tiktok_ok({"videos": [
+        {
+            "id": vid,
+            # Grows with time so repeated syncs see changing metrics.
+            "view_count": int(now / 10) % 100000 + len(vid) * 37,
+            "like_count": int(now / 60) % 5000,
+            "comment_count": int(now / 600) % 300,
+            "share_count": int(now / 900) % 200,
+            "reach_user_count": int(now / 15) % 80000,
+        }
+        for vid in ids
+    ]})
+
+
+# ─────────────────────────────────────────────
+# Telegram
+# ─────────────────────────────────────────────
+@app.post("/bot{token}/{method}")
+async def telegram_method(token: str, method: str, request: Request):
+    STATS[f"telegram:{method}"] += 1
+    await delay()
+    failure = injected_failure("telegram")
+    if failure:
+        return failure
+    try:
+        body = await request.json()
+    except Exception:
+        body = {}
+    if method == "getMe":
+        return {"ok": True, "result": {"id": 777000, "is_bot": True, "username": "fake_loadtest_bot"}}
+    if method == "getChatMemberCount":
+        return {"ok": True, "result": 12500}
+    if method == "forwardMessage":
+        return {"ok": True, "result": {
+            "message_id": random.randint(1, 10**9),
+            "views": int(body.get("message_id") or 0) * 13 % 20000,
+            "forwards": int(body.get("message_id") or 0) % 40,
+            "reactions": {"results": [{"type": {"emoji": "👍"}, "count": 7}]},
+        }}
+    if method == "deleteMessage":
+        return {"ok": True, "result": True}
+    return JSONResponse({"ok": False, "error_code": 404, "description": "Not Found: method not found"}, status_code=404)
+
+
+# ─────────────────────────────────────────────
+# Graph API (batch only — the fetchers never call single nodes)
+# ─────────────────────────────────────────────
+@app.post("/{version}/")
+async def graph_batch(version: str, request: Request):
+    STATS["graph:batch"] += 1
+    await delay()
+    failure = injected_failure("graph")
+    if failure:
+        return failure
+    form = parse_qs((await request.body()).decode())
+    batch = json.loads((form.get("batch") or ["[]"])[0])
+    return [{"code": 200, "body": json.dumps(graph_node(sub.get("relative_url", "").split("?")[0]))} for sub in batch]
+
+
+def graph_node(post_id: str) -> Dict[str, Any]:
+    # Counts derive from the id, so a response matched to the wrong row is visible.
+    n = sum(post_id.encode()) % 50 + 1
+    return {
+        "id": post_id,
+        "like_count": 40 * n, "comments_count": 6 * n, "shares": {"count": 3 * n},
+        "reactions": {"summary": {"total_count": 44 * n}}, "comments": {"summary": {"total_count": 6 * n}},
+        "insights": {"data": [
+            {"name": name, "values": [{"value": value * n}]}
+            for name, value in (("impressions", 900), ("reach", 700), ("post_impressions", 900), ("post_clicks", 12))
+        ]},
+    }
+
+
+def main(argv=None) -> None:
+    import uvicorn
+
+    parser = argparse.ArgumentParser(prog="python -m loadtest.fake_api")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    for key, value in CONFIG.items():
+        parser.add_argument(f"--{key.replace('_', '-')}", type=type(value), default=value)
+    args = parser.parse_args(argv)
+    for key in CONFIG:
+        CONFIG[key] = getattr(args, key)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
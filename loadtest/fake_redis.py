@@ -0,0 +1,144 @@
+"""
+بديل Redis داخل العملية بواجهة redis-py — لاختبار RedisStateBackend دون خادم Redis ولا حزمة redis
+
+from loadtest.fake_redis import FakeRedis
+shared_state.set_backend(shared_state.RedisStateBackend(FakeRedis()))
+
+يدعم فقط ما يستعمله RedisStateBackend: SET NX/PX، GET، DEL، PEXPIRE، SCAN،
+وWATCH/MULTI/EXEC عبر pipeline(). الانتهاء بالساعة الأحادية ويُقيَّم عند كل قراءة.
+"""
+import time
+import fnmatch
+import threading
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+
+class WatchError(Exception):
+    pass
+
+
+def _bytes(value: Any) -> bytes:
+    if isinstance(value, bytes):
+        return value
+    return str(value).encode("utf-8")
+
+
+class FakeRedis:
+    def __init__(self):
+        self._data: Dict[bytes, Tuple[bytes, Optional[float]]] = {}
+        # Bumped on every write to a key; WATCH compares it at EXEC time.
+        self._versions: Dict[bytes, int] = {}
+        self._lock = threading.RLock()
+
+    def _live(self, key: bytes) -> Optional[Tuple[bytes, Optional[float]]]:
+        item = self._data.get(key)
+        if item and item[1] is not None and item[1] <= time.monotonic():
+            del self._data[key]
+            self._touch(key)
+            return None
+        return item
+
+    def _touch(self, key: bytes) -> None:
+        self._versions[key] = self._versions.get(key, 0) + 1
+
+    def set(self, key, value, nx: bool = False, px: Optional[int] = None) -> Optional[bool]:
+        key = _bytes(key)
+        with self._lock:
+            if nx and self._live(key):
+                return None
+            self._data[key] = (_bytes(value), time.monotonic() + px / 1000 if px else None)
+            self._touch(key)
+            return True
+
+    def get(self, key) -> Optional[bytes]:
+        with self._lock:
+            item = self._live(_bytes(key))
+            return item[0] if item else None
+
+    def delete(self, *keys) -> int:
+        removed = 0
+        with self._lock:
+            for key in map(_bytes, keys):
+                if self._live(key):
+                    del self._data[key]
+                    self._touch(key)
+                    removed += 1
+        return removed
+
+    def pexpire(self, key, ms: int) -> bool:
+        key = _bytes(key)
+        with self._lock:
+            item = self._live(key)
+            if not item:
+                return False
+            self._data[key] = (item[0], time.monotonic() + ms / 1000)
+            self._touch(key)
+            return True
+
+    def pttl(self, key) -> int:
+        with self._lock:
+            item = self._live(_bytes(key))
+            if not item:
+                return -2
+            return -1 if item[1] is None else int((item[1] - time.monotonic()) * 1000)
+
+    def scan_iter(self, match: str = "*") -> Iterator[bytes]:
+        with self._lock:
+            keys = [k for k in list(self._data) if self._live(k)]
+        pattern = _bytes(match)
+        return iter([k for k in keys if fnmatch.fnmatchcase(k, pattern)])
+
+    def pipeline(self) -> "FakePipeline":
+        return FakePipeline(self)
+
+
+class FakePipeline:
+    def __init__(self, client: FakeRedis):
+        self.client = client
+        self._watched: Dict[bytes, int] = {}
+        self._queued: Optional[List[Tuple[str, tuple, dict]]] = None
+
+    def __enter__(self) -> "FakePipeline":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.reset()
+
+    def reset(self) -> None:
+        self._watched.clear()
+        self._queued = None
+
+    def watch(self, *keys) -> None:
+        with self.client._lock:
+            for key in map(_bytes, keys):
+                self.client._live(key)
+                self._watched[key] = self.client._versions.get(key, 0)
+
+    def unwatch(self) -> None:
+        self._watched.clear()
+
+    def multi(self) -> None:
+        self._queued = []
+
+    def __getattr__(self, name: str):
+        # Before MULTI commands run immediately (the WATCH read); after it they are queued.
+        command = getattr(self.client, name)
+
+        def call(*args, **kwargs):
+            if self._queued is None:
+                return command(*args, **kwargs)
+            self._queued.append((name, args, kwargs))
+            return self
+
+        return call
+
+    def execute(self) -> List[Any]:
+        with self.client._lock:
+            for key, version in self._watched.items():
+                self.client._live(key)
+                if self.client._versions.get(key, 0) != version:
+                    self.reset()
+                    raise WatchError(key)
+            results = [getattr(self.client, name)(*args, **kwargs) for name, args, kwargs in self._queued or []]
+        self.reset()
+        return results
@@ -2,15 +2,36 @@ import os
 import json
 import time
 import uuid
+import asyncio
 import secrets
+import importlib
 import subprocess
-from typing import Optional
+from contextlib import asynccontextmanager
+from typing import Any, Dict, Optional
 from urllib.parse import urlencode
 
 import httpx
-from fastapi import FastAPI, Request
-from fastapi.responses import JSONResponse, RedirectResponse, HTMLResponse, FileResponse
-from fastapi.staticfiles import StaticFiles
+from fastapi import FastAPI, Header, Request
+from fastapi.responses import JSONResponse, RedirectResponse, HTMLResponse, FileResponse, StreamingResponse, PlainTextResponse
+
+from file_serving import serve_file, download_stats
+from persistence import atomic_write_json, load_json
+import instrumentation
+import tracing
+from instrumentation import HTTPX_EVENT_HOOKS, MetricsMiddleware
+from tracing import TracingMiddleware
+import idempotency
+import publish_jobs
+import publish_queue
+import upload_sessions
+import clicks
+import transcode
+import shared_state
+
+try:
+    import orjson
+except Exception:
+    orjson = None
 
 try:
     from tracker import (
@@ -19,29 +40,181 @@ try:
         run_sync_all,
         get_post,
         get_all_posts,
+        iter_posts,
+        HEAVY_POST_FIELDS,
+        get_post_by_id,
+        record_clicks,
+        migrate_publish_log,
+        start_history_compactor,
+        stop_history_compactor,
+        add_post_listener,
     )
+    from metrics_fetchers import aclose_shared_client
 except Exception:
     track_publish = None
     sync_metrics_for_post = None
     run_sync_all = None
     get_post = None
     get_all_posts = None
+    iter_posts = None
+    HEAVY_POST_FIELDS = ()
+    get_post_by_id = None
+    record_clicks = None
+    migrate_publish_log = None
+    start_history_compactor = None
+    stop_history_compactor = None
+    add_post_listener = None
+    aclose_shared_client = None
+
+try:
+    import heatmap
+except Exception:
+    heatmap = None
 
-app = FastAPI(redirect_slashes=False)
+try:
+    import analytics
+    import analytics_cache
+except Exception:
+    analytics = None
+    analytics_cache = None
+
+PROCESS_STARTED = time.perf_counter()
+# Comma list of: video, fonts, http, tokens, db, analytics, media (or "all"). Empty = nothing preloaded.
+STARTUP_WARMUP = os.environ.get("STARTUP_WARMUP", "").strip()
+# 1 = the app only accepts traffic once warmup is done; 0 = warmup runs in the background.
+STARTUP_WARMUP_BLOCKING = os.environ.get("STARTUP_WARMUP_BLOCKING", "0").strip() in ("1", "true", "yes")
+WARMUP_STEPS = ("video", "fonts", "http", "tokens", "db", "analytics", "media")
+
+_optional_modules: Dict[str, Any] = {}
+STARTUP: Dict[str, Any] = {"ready_ms": None, "warmup": {}}
+
+
+def optional_module(name: str):
+    """
+    وحدات ثقيلة اختيارية (video_generator → Pillow/moviepy/arabic_reshaper) تُحمّل عند أول استخدام
+    None إن كانت تبعياتها غير مثبتة
+    """
+    if name not in _optional_modules:
+        try:
+            _optional_modules[name] = importlib.import_module(name)
+        except Exception:
+            _optional_modules[name] = None
+    return _optional_modules[name]
+
+
+async def load_optional_module(name: str):
+    # The first import can take seconds; it must not stall the event loop.
+    if name in _optional_modules:
+        return _optional_modules[name]
+    return await asyncio.to_thread(optional_module, name)
+
+
+async def warm_up(steps) -> None:
+    for step in steps:
+        started = time.perf_counter()
+        try:
+            if step == "video":
+                result = "ok" if await load_optional_module("video_generator") else "unavailable"
+            elif step == "fonts":
+                video_generator = await load_optional_module("video_generator")
+                if video_generator is None or video_generator.missing_dependencies():
+                    result = "unavailable"
+                else:
+                    result = await asyncio.to_thread(video_generator.warm_up)
+            elif step == "http":
+                from metrics_fetchers import TIKTOK_API_BASE as fetchers_api_base, shared_client
+
+                await shared_client().head(fetchers_api_base)
+                result = "ok"
+            elif step == "tokens":
+                # Refreshes an expired token now rather than inside the first publish.
+                _, err = await get_valid_access_token()
+                result = "ok" if err is None else "no_valid_token"
+            elif step == "db":
+                from tracker import load_db
+
+                result = {"posts": len(load_db().get("posts", []))}
+            elif step == "analytics":
+                # Fills the default dashboard so the first request is a cache hit.
+                if analytics_cache is None:
+                    result = "unavailable"
+                else:
+                    entry = await analytics_cache.get(analytics.get_dashboard_summary, analytics.data_version, days=30)
+                    result = {"bytes": len(entry["body"])}
+            elif step == "media":
+                # Incremental: only new or changed files in MEDIA_DIR are hashed.
+                media_index = await load_optional_module("media_index")
+                if media_index is None:
+                    result = "unavailable"
+                else:
+                    index = await asyncio.to_thread(media_index.build_index)
+                    result = {"assets": len(index["assets"])}
+            else:
+                result = "unknown_step"
+        except Exception as e:
+            result = f"error: {type(e).__name__}: {e}"
+        STARTUP["warmup"][step] = {"result": result, "ms": round((time.perf_counter() - started) * 1000, 1)}
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    publish_queue.start_scheduler(run_queued_publish, tiktok_account)
+    # Status polls left "polling" by a restarted or dead worker are picked up again.
+    publish_jobs.start_resumer(fetch_publish_status)
+    if migrate_publish_log:
+        await migrate_publish_log()
+    if record_clicks:
+        clicks.start_flusher(record_clicks)
+    if add_post_listener:
+        add_post_listener(clicks.remember_destination)
+    if start_history_compactor:
+        start_history_compactor()
+
+    steps = WARMUP_STEPS if STARTUP_WARMUP == "all" else [s.strip() for s in STARTUP_WARMUP.split(",") if s.strip()]
+    warmup_task = None
+    if steps and STARTUP_WARMUP_BLOCKING:
+        await warm_up(steps)
+    elif steps:
+        warmup_task = asyncio.create_task(warm_up(steps))
+    STARTUP["ready_ms"] = round((time.perf_counter() - PROCESS_STARTED) * 1000, 1)
+
+    yield
+
+    if warmup_task and not warmup_task.done():
+        warmup_task.cancel()
+    await publish_queue.stop_scheduler()
+    await publish_jobs.stop_resumer()
+    if record_clicks:
+        await clicks.stop_flusher(record_clicks)
+    if stop_history_compactor:
+        await stop_history_compactor()
+    if aclose_shared_client:
+        await aclose_shared_client()
+
+
+tracing.install_logging()
+app = FastAPI(redirect_slashes=False, lifespan=lifespan)
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(TracingMiddleware)
 
 FILES_DIR = "files"
 os.makedirs(FILES_DIR, exist_ok=True)
-app.mount("/files", StaticFiles(directory=FILES_DIR), name="files")
 
 PUBLIC_BASE_URL = os.environ.get("PUBLIC_BASE_URL")
 TIKTOK_CLIENT_KEY = os.environ.get("TIKTOK_CLIENT_KEY")
 TIKTOK_CLIENT_SECRET = os.environ.get("TIKTOK_CLIENT_SECRET")
 TIKTOK_REDIRECT_URI = os.environ.get("TIKTOK_REDIRECT_URI")
 DEFAULT_SCOPE = "user.info.basic,video.upload,video.publish"
+# Overridable so load tests can point the app at loadtest/fake_api.py.
+TIKTOK_API_BASE = os.environ.get("TIKTOK_API_BASE", "https://open.tiktokapis.com").rstrip("/")
 TOKENS_PATH = os.environ.get("TOKENS_PATH", "tokens.json")
 TOKEN_SKEW_SECONDS = 120
-USED_CODES = {}
 USED_CODES_TTL_SECONDS = 10 * 60
+# TikTok FILE_UPLOAD: chunks must be 5-64 MB, files below one chunk go whole,
+# and the last chunk absorbs the remainder.
+TIKTOK_MIN_CHUNK_SIZE = 5 * 1024 * 1024
+TIKTOK_MAX_CHUNK_SIZE = 64 * 1024 * 1024
+TIKTOK_CHUNK_SIZE = int(os.environ.get("TIKTOK_CHUNK_SIZE", str(10 * 1024 * 1024)))
 
 
 def require_env(value: Optional[str], name: str):
@@ -54,22 +227,25 @@ def require_env(value: Optional[str], name: str):
 
 
 def load_tokens():
-    if not os.path.exists(TOKENS_PATH):
-        return None
-    with open(TOKENS_PATH, "r", encoding="utf-8") as f:
-        return json.load(f)
+    # ملف تالف (انقطاع أثناء الكتابة) → آخر نسخة احتياطية سليمة بدل فقدان refresh_token
+    return load_json(TOKENS_PATH, lambda: None, validate=lambda d: isinstance(d, dict))
 
 
 def save_tokens(tokens: dict):
-    with open(TOKENS_PATH, "w", encoding="utf-8") as f:
-        json.dump(tokens, f, ensure_ascii=False, indent=2)
+    atomic_write_json(TOKENS_PATH, tokens)
 
 
-def cleanup_used_codes():
-    now = time.time()
-    expired = [k for k, ts in USED_CODES.items() if (now - ts) > USED_CODES_TTL_SECONDS]
-    for k in expired:
-        USED_CODES.pop(k, None)
+def tiktok_account() -> str:
+    # Every publish goes out with the single tokens.json account, so the daily quota is keyed on it.
+    return (load_tokens() or {}).get("open_id") or "default"
+
+
+async def record_quota_use(publish_id: str):
+    try:
+        await publish_queue.record_publish(await asyncio.to_thread(tiktok_account), publish_id)
+    except Exception:
+        # The post is already out; a failed quota write must not turn it into an error response.
+        pass
 
 
 def token_expired(tokens: dict) -> bool:
@@ -140,16 +316,19 @@ async def refresh_access_token():
         "refresh_token": tokens["refresh_token"],
     }
 
-    async with httpx.AsyncClient(timeout=30) as client:
-        r = await client.post(
-            "https://open.tiktokapis.com/v2/oauth/token/",
-            data=data,
-            headers={"Content-Type": "application/x-www-form-urlencoded"},
-        )
+    with tracing.span("token_refresh"):
+        async with httpx.AsyncClient(timeout=30, event_hooks=HTTPX_EVENT_HOOKS) as client:
+            r = await client.post(
+                f"{TIKTOK_API_BASE}/v2/oauth/token/",
+                data=data,
+                headers={"Content-Type": "application/x-www-form-urlencoded"},
+            )
 
     body = safe_json(r)
     if r.status_code != 200 or not body.get("access_token"):
+        instrumentation.TOKEN_REFRESH.inc(result="failed")
         return None, JSONResponse({"ok": False, "token_response": body}, status_code=r.status_code)
+    instrumentation.TOKEN_REFRESH.inc(result="ok")
 
     new_tokens = {
         **tokens,
@@ -162,17 +341,32 @@ async def refresh_access_token():
 
 
 async def get_valid_access_token():
-    tokens = load_tokens()
-    if not tokens or not tokens.get("access_token"):
-        return None, JSONResponse(
-            {"ok": False, "error": "Not authorized yet. Visit /tiktok/login"},
-            status_code=400,
-        )
-    if token_expired(tokens):
-        tokens, err = await refresh_access_token()
-        if err:
-            return None, err
-    return tokens["access_token"], None
+    with tracing.span("token") as span:
+        tokens = load_tokens()
+        if not tokens or not tokens.get("access_token"):
+            return None, JSONResponse(
+                {"ok": False, "error": "Not authorized yet. Visit /tiktok/login"},
+                status_code=400,
+            )
+        if token_expired(tokens):
+            span.set(refreshed=True)
+            tokens, err = await refresh_access_token()
+            if err:
+                return None, err
+        return tokens["access_token"], None
+
+
+def with_timings(result, payload: dict):
+    """
+    payload["timings"] = true يضيف تفصيل مراحل الطلب (tracing.timings) إلى الاستجابة
+    """
+    if not payload.get("timings"):
+        return result
+    if isinstance(result, dict):
+        return {**result, "timings": tracing.timings()}
+    if isinstance(result, JSONResponse):
+        return JSONResponse({**json.loads(result.body), "timings": tracing.timings()}, status_code=result.status_code)
+    return result
 
 
 @app.get("/health")
@@ -181,6 +375,58 @@ def health():
     return {"ok": True}
 
 
+@app.get("/ready")
+@app.get("/ready/")
+def ready():
+    return {"ok": STARTUP["ready_ms"] is not None, **STARTUP}
+
+
+def collect_gauges():
+    depth = instrumentation.QUEUE_DEPTH
+    depth.set(sum(1 for job in publish_queue.load_queue()["jobs"] if job.get("status") in ("pending", "running")), queue="publish")
+    depth.set(clicks.pending(), queue="clicks")
+    depth.set(sum(1 for job in publish_jobs.JOBS.values() if job.get("state") == "polling"), queue="publish_status_poll")
+    for path in (TOKENS_PATH, publish_queue.PUBLISH_QUEUE_PATH, idempotency.IDEMPOTENCY_PATH, upload_sessions.UPLOAD_SESSIONS_PATH):
+        try:
+            instrumentation.DB_FILE_BYTES.set(os.path.getsize(path), file=os.path.basename(str(path)))
+        except OSError:
+            pass
+
+
+@app.get("/metrics")
+def prometheus_metrics():
+    collect_gauges()
+    return PlainTextResponse(instrumentation.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.api_route("/files/{name:path}", methods=["GET", "HEAD"])
+async def files(request: Request, name: str):
+    return serve_file(request, FILES_DIR, name)
+
+
+@app.get("/files-stats")
+def files_stats():
+    return {"ok": True, **download_stats()}
+
+
+@app.get("/r/{post_id}")
+@app.head("/r/{post_id}")
+async def click_redirect(request: Request, post_id: str):
+    if get_post_by_id is None:
+        return JSONResponse({"ok": False, "error": "tracker_not_available"}, status_code=501)
+    destination = await clicks.resolve_destination(post_id, get_post_by_id)
+    if not destination:
+        return JSONResponse({"ok": False, "error": "Unknown post"}, status_code=404)
+    if request.method == "GET":
+        clicks.record_click(post_id, request.headers)
+    return RedirectResponse(destination, status_code=302, headers={"Cache-Control": "no-store"})
+
+
+@app.get("/clicks-stats")
+def clicks_stats():
+    return {"ok": True, **clicks.stats()}
+
+
 @app.get("/post")
 @app.get("/post/")
 def post_page():
@@ -198,25 +444,35 @@ def extract(payload: dict):
 
     file_id = str(uuid.uuid4())
     outtmpl = os.path.join(FILES_DIR, f"{file_id}.%(ext)s")
-    cmd = ["yt-dlp", "-f", "bv*+ba/best", "--merge-output-format", "mp4", "-o", outtmpl, url]
-    try:
-        subprocess.check_call(cmd)
-    except subprocess.CalledProcessError as e:
-        return JSONResponse({"ok": False, "error": "extract_failed", "detail": str(e)}, status_code=400)
-
-    final_path = os.path.join(FILES_DIR, f"{file_id}.mp4")
-    if not os.path.exists(final_path):
-        return JSONResponse({"ok": False, "error": "output_not_found"}, status_code=500)
+    cmd = ["yt-dlp", *transcode.ytdlp_format_args(payload.get("format")), "--merge-output-format", "mp4", "-o", outtmpl, url]
+    started = time.perf_counter()
+    with tracing.span("download", tool="yt-dlp") as span:
+        try:
+            subprocess.check_call(cmd)
+        except subprocess.CalledProcessError as e:
+            instrumentation.YTDLP_SECONDS.observe(time.perf_counter() - started, status="failed")
+            span.fail(str(e))
+            return with_timings(JSONResponse({"ok": False, "error": "extract_failed", "detail": str(e)}, status_code=400), payload)
+
+        final_path = os.path.join(FILES_DIR, f"{file_id}.mp4")
+        if not os.path.exists(final_path):
+            instrumentation.YTDLP_SECONDS.observe(time.perf_counter() - started, status="no_output")
+            span.fail("output_not_found")
+            return with_timings(JSONResponse({"ok": False, "error": "output_not_found"}, status_code=500), payload)
+        size = os.path.getsize(final_path)
+        span.set(bytes=size)
+    instrumentation.YTDLP_SECONDS.observe(time.perf_counter() - started, status="ok")
+    instrumentation.YTDLP_BYTES.observe(size)
     if not PUBLIC_BASE_URL:
         return JSONResponse({"ok": False, "error": "Missing PUBLIC_BASE_URL"}, status_code=500)
 
-    return {
+    return with_timings({
         "ok": True,
         "file_id": file_id,
         "fileId": file_id,
         "file_url": f"{PUBLIC_BASE_URL}/files/{file_id}.mp4",
         "fileUrl": f"{PUBLIC_BASE_URL}/files/{file_id}.mp4",
-    }
+    }, payload)
 
 
 @app.get("/tiktok/login")
@@ -266,10 +522,8 @@ async def tiktok_callback(
     if not cookie_state or state != cookie_state:
         return JSONResponse({"ok": False, "error": "Invalid state", "state": state}, status_code=400)
 
-    cleanup_used_codes()
-    if code in USED_CODES:
+    if not await shared_state.claim_once(f"oauth_code:{code}", USED_CODES_TTL_SECONDS):
         return JSONResponse({"ok": False, "error": "Code already used"}, status_code=400)
-    USED_CODES[code] = time.time()
 
     client_key, err = require_env(TIKTOK_CLIENT_KEY, "TIKTOK_CLIENT_KEY")
     if err:
@@ -289,9 +543,9 @@ async def tiktok_callback(
         "redirect_uri": redirect_uri,
     }
 
-    async with httpx.AsyncClient(timeout=30) as client:
+    async with httpx.AsyncClient(timeout=30, event_hooks=HTTPX_EVENT_HOOKS) as client:
         r = await client.post(
-            "https://open.tiktokapis.com/v2/oauth/token/",
+            f"{TIKTOK_API_BASE}/v2/oauth/token/",
             data=data,
             headers={"Content-Type": "application/x-www-form-urlencoded"},
         )
@@ -332,9 +586,9 @@ async def tiktok_userinfo():
     if err:
         return err
 
-    async with httpx.AsyncClient(timeout=20) as client:
+    async with httpx.AsyncClient(timeout=20, event_hooks=HTTPX_EVENT_HOOKS) as client:
         r = await client.get(
-            "https://open.tiktokapis.com/v2/user/info/",
+            f"{TIKTOK_API_BASE}/v2/user/info/",
             params={"fields": "open_id,display_name,avatar_url"},
             headers={"Authorization": f"Bearer {access_token}"},
         )
@@ -351,54 +605,121 @@ async def tiktok_userinfo():
     )
 
 
-@app.post("/tiktok/publish")
-@app.post("/tiktok/publish/")
-async def tiktok_publish(payload: dict):
+async def fetch_publish_status(publish_id: str):
     access_token, err = await get_valid_access_token()
     if err:
-        return err
+        return None, err
 
-    file_id = payload.get("file_id") or payload.get("fileId")
-    filepath = payload.get("filepath") or payload.get("filePath")
-    if file_id and not filepath:
-        filepath = os.path.join(FILES_DIR, f"{file_id}.mp4")
-    if not filepath or not os.path.exists(filepath):
-        return JSONResponse(
-            {"ok": False, "error": "Missing filepath or file not found", "file_id": file_id, "filepath": filepath},
-            status_code=400,
-        )
+    with tracing.span("status_fetch", publish_id=publish_id) as span:
+        async with httpx.AsyncClient(timeout=30, event_hooks=HTTPX_EVENT_HOOKS) as client:
+            r = await client.post(
+                f"{TIKTOK_API_BASE}/v2/post/publish/status/fetch/",
+                headers={
+                    "Authorization": f"Bearer {access_token}",
+                    "Content-Type": "application/json; charset=UTF-8",
+                },
+                json={"publish_id": publish_id},
+            )
+        body = safe_json(r)
+        span.set(status=(body.get("data") or {}).get("status"), http_status=r.status_code)
+    return r.status_code, body
+
+
+def chunk_plan(video_size: int):
+    chunk_size = max(TIKTOK_MIN_CHUNK_SIZE, min(TIKTOK_CHUNK_SIZE, TIKTOK_MAX_CHUNK_SIZE))
+    if video_size <= chunk_size:
+        return video_size, 1
+    return chunk_size, video_size // chunk_size
+
+
+def build_video_post_info(payload: dict) -> dict:
+    return {
+        "title": payload.get("title", "Posted via API"),
+        "privacy_level": normalize_privacy(payload.get("privacy_level"), "SELF_ONLY"),
+        "disable_comment": bool(payload.get("disable_comment", False)),
+        "disable_duet": bool(payload.get("disable_duet", False)),
+        "disable_stitch": bool(payload.get("disable_stitch", False)),
+        "brand_content_toggle": bool(payload.get("brand_content_toggle", False)),
+        "brand_organic_toggle": bool(payload.get("brand_organic_toggle", False)),
+    }
 
-    title = payload.get("title", "Posted via API")
-    privacy_level = normalize_privacy(payload.get("privacy_level"), "SELF_ONLY")
-    video_size = os.path.getsize(filepath)
 
+async def upload_video_chunks(upload_url: str, fileobj, video_size: int, chunk_size: int, total_chunk_count: int, start_chunk: int = 0, on_chunk=None):
+    last_r = None
+    upload_started, uploaded = time.perf_counter(), 0
+    async with httpx.AsyncClient(timeout=None, event_hooks=HTTPX_EVENT_HOOKS) as client:
+        for index in range(start_chunk, total_chunk_count):
+            first = index * chunk_size
+            last = video_size - 1 if index == total_chunk_count - 1 else first + chunk_size - 1
+            fileobj.seek(first)
+            chunk = await asyncio.to_thread(fileobj.read, last - first + 1)
+            chunk_started = time.perf_counter()
+            try:
+                with tracing.span("upload_chunk", index=index, bytes=len(chunk)):
+                    last_r = await client.put(
+                        upload_url,
+                        content=chunk,
+                        headers={
+                            "Content-Type": "video/mp4",
+                            "Content-Range": f"bytes {first}-{last}/{video_size}",
+                            "Content-Length": str(len(chunk)),
+                        },
+                    )
+            except httpx.HTTPError as e:
+                instrumentation.record_http_error(httpx.URL(upload_url), e)
+                return None, JSONResponse(
+                    {"ok": False, "step": "upload", "chunk": index, "error": str(e) or type(e).__name__},
+                    status_code=502,
+                )
+            instrumentation.UPLOAD_CHUNK_SECONDS.observe(time.perf_counter() - chunk_started, status=last_r.status_code)
+            if last_r.status_code not in (200, 201, 204, 206):
+                return last_r, JSONResponse(
+                    {"ok": False, "step": "upload", "chunk": index, "status_code": last_r.status_code, "text": last_r.text[:1000]},
+                    status_code=400,
+                )
+            instrumentation.UPLOAD_BYTES.inc(len(chunk))
+            uploaded += len(chunk)
+            if on_chunk and await asyncio.to_thread(on_chunk, index, first, last) is False:
+                # A resume took the session over after our lease lapsed; it owns the remaining chunks now.
+                return last_r, JSONResponse(
+                    {"ok": False, "step": "upload", "chunk": index, "error": "upload_lease_lost"},
+                    status_code=409,
+                )
+    elapsed = time.perf_counter() - upload_started
+    if uploaded and elapsed > 0:
+        instrumentation.UPLOAD_THROUGHPUT.observe(uploaded / elapsed)
+    return last_r, None
+
+
+async def publish_video_source(
+    access_token: str,
+    payload: dict,
+    fileobj,
+    video_size: int,
+    filepath: Optional[str] = None,
+    idempotency_key: Optional[str] = None,
+):
+    chunk_size, total_chunk_count = chunk_plan(video_size)
     init_body = {
-        "post_info": {
-            "title": title,
-            "privacy_level": privacy_level,
-            "disable_comment": bool(payload.get("disable_comment", False)),
-            "disable_duet": bool(payload.get("disable_duet", False)),
-            "disable_stitch": bool(payload.get("disable_stitch", False)),
-            "brand_content_toggle": bool(payload.get("brand_content_toggle", False)),
-            "brand_organic_toggle": bool(payload.get("brand_organic_toggle", False)),
-        },
+        "post_info": build_video_post_info(payload),
         "source_info": {
             "source": "FILE_UPLOAD",
             "video_size": video_size,
-            "chunk_size": video_size,
-            "total_chunk_count": 1,
+            "chunk_size": chunk_size,
+            "total_chunk_count": total_chunk_count,
         },
     }
 
-    async with httpx.AsyncClient(timeout=60) as client:
-        init_r = await client.post(
-            "https://open.tiktokapis.com/v2/post/publish/video/init/",
-            headers={
-                "Authorization": f"Bearer {access_token}",
-                "Content-Type": "application/json; charset=UTF-8",
-            },
-            json=init_body,
-        )
+    with tracing.span("init", media="video", bytes=video_size, chunks=total_chunk_count):
+        async with httpx.AsyncClient(timeout=60, event_hooks=HTTPX_EVENT_HOOKS) as client:
+            init_r = await client.post(
+                f"{TIKTOK_API_BASE}/v2/post/publish/video/init/",
+                headers={
+                    "Authorization": f"Bearer {access_token}",
+                    "Content-Type": "application/json; charset=UTF-8",
+                },
+                json=init_body,
+            )
 
     init_json = safe_json(init_r)
     data = init_json.get("data") or {}
@@ -408,41 +729,187 @@ async def tiktok_publish(payload: dict):
     publish_id = data["publish_id"]
     upload_url = data["upload_url"]
 
-    with open(filepath, "rb") as f:
-        video_bytes = f.read()
+    # Only file-backed uploads can be resumed; a streamed spool is gone after a restart.
+    on_chunk, lease_id = None, None
+    if filepath:
+        session = await asyncio.to_thread(
+            upload_sessions.create_session,
+            publish_id, upload_url, filepath, video_size, chunk_size, total_chunk_count, payload, idempotency_key,
+        )
+        lease_id = session["lease_id"]
+        on_chunk = lambda index, first, last: upload_sessions.ack_chunk(publish_id, index, first, last, lease_id)
+
+    with tracing.span("upload", bytes=video_size, chunks=total_chunk_count):
+        put_r, err = await upload_video_chunks(upload_url, fileobj, video_size, chunk_size, total_chunk_count, on_chunk=on_chunk)
+    if err:
+        if filepath:
+            await asyncio.to_thread(upload_sessions.mark, publish_id, "interrupted", json.loads(err.body), lease_id)
+            return JSONResponse({**json.loads(err.body), "publish_id": publish_id, "resumable": True}, status_code=err.status_code)
+        return err
+
+    return await finish_video_publish(publish_id, payload, put_r, total_chunk_count, init_json)
 
-    put_headers = {
-        "Content-Type": "video/mp4",
-        "Content-Range": f"bytes 0-{video_size - 1}/{video_size}",
-        "Content-Length": str(video_size),
+
+async def finish_video_publish(publish_id: str, payload: dict, put_r, total_chunk_count: int, init_json: Optional[dict] = None):
+    await record_quota_use(publish_id)
+    job = publish_jobs.start_job(publish_id, "video", fetch_publish_status, payload)
+    return {
+        "ok": True,
+        "publish_id": publish_id,
+        "init": init_json,
+        "upload_http_status": put_r.status_code if put_r is not None else None,
+        "chunks": total_chunk_count,
+        "job": job,
+        "events_url": f"/tiktok/jobs/{publish_id}/events",
     }
 
-    async with httpx.AsyncClient(timeout=None) as client:
-        put_r = await client.put(upload_url, content=video_bytes, headers=put_headers)
 
-    if put_r.status_code not in (200, 201, 204):
-        return JSONResponse({"ok": False, "step": "upload", "status_code": put_r.status_code, "text": put_r.text[:1000]}, status_code=400)
+@app.post("/tiktok/publish/resume")
+@app.post("/tiktok/publish/resume/")
+async def tiktok_publish_resume(payload: dict):
+    publish_id = payload.get("publish_id") or payload.get("publishId")
+    if not publish_id:
+        return JSONResponse({"ok": False, "error": "Missing publish_id"}, status_code=400)
+
+    # Claimed under the store lock: a concurrent resume, or the original upload still
+    # holding a fresh lease, gets 409 instead of sending the same chunks twice.
+    session, problem = await asyncio.to_thread(upload_sessions.claim, publish_id)
+    if problem:
+        if problem == "upload_session_not_found":
+            status_code = 404
+        else:
+            status_code = 410 if problem in ("upload_url_expired", "file_missing", "file_changed") else 409
+        return JSONResponse({"ok": False, "error": problem, "publish_id": publish_id}, status_code=status_code)
+
+    lease_id = session["lease_id"]
+    with open(session["filepath"], "rb") as f:
+        put_r, err = await upload_video_chunks(
+            session["upload_url"],
+            f,
+            session["video_size"],
+            session["chunk_size"],
+            session["total_chunk_count"],
+            start_chunk=int(session.get("next_chunk") or 0),
+            on_chunk=lambda index, first, last: upload_sessions.ack_chunk(publish_id, index, first, last, lease_id),
+        )
+    if err:
+        await asyncio.to_thread(upload_sessions.mark, publish_id, "interrupted", json.loads(err.body), lease_id)
+        return JSONResponse({**json.loads(err.body), "publish_id": publish_id, "resumable": True}, status_code=err.status_code)
+
+    result = await finish_video_publish(publish_id, session.get("payload") or {}, put_r, session["total_chunk_count"])
+    result = {**result, "resumed_from_chunk": int(session.get("next_chunk") or 0)}
+    key = session.get("idempotency_key")
+    if key:
+        # A retried /tiktok/publish with the original key now replays this result instead of publishing again.
+        result["idempotency_key"] = key
+        await idempotency.store_result(key, result)
+    return result
+
+
+@app.get("/tiktok/uploads")
+@app.get("/tiktok/uploads/")
+def tiktok_uploads(include_done: bool = False):
+    sessions = upload_sessions.list_sessions(include_done)
+    return {"ok": True, "count": len(sessions), "uploads": sessions}
+
+
+def resolve_idempotency_key(payload: dict, header_value: Optional[str]):
+    return idempotency.client_key(header_value or payload.get("idempotency_key"))
 
-    async with httpx.AsyncClient(timeout=30) as client:
-        status_r = await client.post(
-            "https://open.tiktokapis.com/v2/post/publish/status/fetch/",
-            headers={
-                "Authorization": f"Bearer {access_token}",
-                "Content-Type": "application/json; charset=UTF-8",
-            },
-            json={"publish_id": publish_id},
+
+@app.post("/tiktok/publish")
+@app.post("/tiktok/publish/")
+async def tiktok_publish(payload: dict, idempotency_key: Optional[str] = Header(None)):
+    file_id = payload.get("file_id") or payload.get("fileId")
+    filepath = payload.get("filepath") or payload.get("filePath")
+    if file_id and not filepath:
+        filepath = os.path.join(FILES_DIR, f"{file_id}.mp4")
+    if not filepath or not os.path.exists(filepath):
+        return JSONResponse(
+            {"ok": False, "error": "Missing filepath or file not found", "file_id": file_id, "filepath": filepath},
+            status_code=400,
         )
 
-    return {"ok": True, "publish_id": publish_id, "init": init_json, "upload_http_status": put_r.status_code, "status": safe_json(status_r)}
+    profile = transcode.resolve_profile(payload.get("transcode"))
+
+    async def publish():
+        access_token, err = await get_valid_access_token()
+        if err:
+            return err
+        upload_path, transcode_info = filepath, None
+        if profile:
+            with tracing.span("transcode", profile=profile):
+                transcode_info = await transcode.ensure_profile(filepath, profile)
+            upload_path = transcode_info["path"]
+        video_size = os.path.getsize(upload_path)
+        with open(upload_path, "rb") as f:
+            result = await publish_video_source(access_token, payload, f, video_size, filepath=upload_path, idempotency_key=key)
+        if transcode_info and isinstance(result, dict):
+            result["transcode"] = transcode_info
+        return result
+
+    key = resolve_idempotency_key(payload, idempotency_key)
+    if not key and not payload.get("allow_duplicate"):
+        key = await idempotency.video_key(filepath, payload.get("title", "Posted via API"))
+    return with_timings(await idempotency.run_once(key, publish), payload)
+
+
+@app.post("/tiktok/publish_deal")
+@app.post("/tiktok/publish_deal/")
+async def tiktok_publish_deal(payload: dict, idempotency_key: Optional[str] = Header(None)):
+    """
+    يولّد فيديو الصفقة (أو carousel) ويرفعه مباشرة دون كتابة ملف في FILES_DIR
+    """
+    video_generator = await load_optional_module("video_generator")
+    if video_generator is None or video_generator.missing_dependencies():
+        missing = list(video_generator.missing_dependencies()) if video_generator else None
+        return JSONResponse({"ok": False, "error": "video_generator_not_available", "missing": missing}, status_code=501)
+
+    deal = payload.get("deal")
+    items = payload.get("items") or payload.get("deals") or payload.get("images")
+    if not items and not isinstance(deal, dict):
+        return JSONResponse({"ok": False, "error": "Missing deal or items"}, status_code=400)
+
+    if "title" not in payload and isinstance(deal, dict):
+        payload = {**payload, "title": str(deal.get("title") or deal.get("product_title") or "")[:150]}
+
+    async def publish():
+        access_token, err = await get_valid_access_token()
+        if err:
+            return err
+
+        with tracing.span("render", slides=len(items) if items else 1):
+            if items:
+                stream, video_size = await asyncio.to_thread(
+                    video_generator.open_carousel_video_stream,
+                    items,
+                    float(payload.get("slide_duration", 4.0)),
+                    payload.get("transition", "fade"),
+                    float(payload.get("transition_duration", 0.6)),
+                    bool(payload.get("ken_burns", True)),
+                )
+            else:
+                stream, video_size = await asyncio.to_thread(video_generator.open_deal_video_stream, deal, float(payload.get("duration", 5.0)))
+
+        if stream is None:
+            return JSONResponse({"ok": False, "step": "render", "error": "render_failed"}, status_code=400)
+
+        with stream:
+            return await publish_video_source(access_token, payload, stream, video_size)
+
+    key = resolve_idempotency_key(payload, idempotency_key)
+    if not key and not payload.get("allow_duplicate"):
+        render_input = {
+            k: payload.get(k)
+            for k in ("deal", "items", "deals", "images", "duration", "slide_duration", "transition", "transition_duration", "ken_burns")
+        }
+        key = idempotency.deal_key(render_input, payload.get("title", "Posted via API"))
+    return with_timings(await idempotency.run_once(key, publish), payload)
 
 
 @app.post("/tiktok/publish_photo")
 @app.post("/tiktok/publish_photo/")
-async def tiktok_publish_photo(payload: dict):
-    access_token, err = await get_valid_access_token()
-    if err:
-        return err
-
+async def tiktok_publish_photo(payload: dict, idempotency_key: Optional[str] = Header(None)):
     if payload.get("post_info") or payload.get("source_info"):
         post_info = payload.get("post_info") or {}
         source_info = payload.get("source_info") or {}
@@ -466,6 +933,21 @@ async def tiktok_publish_photo(payload: dict):
     if not photo_images:
         return JSONResponse({"ok": False, "error": "Missing photo_images"}, status_code=400)
 
+    key = resolve_idempotency_key(payload, idempotency_key)
+    if not key and not payload.get("allow_duplicate"):
+        key = idempotency.photo_key(photo_images, title)
+    result = await idempotency.run_once(
+        key,
+        lambda: init_photo_post(payload, title, description, privacy_level, photo_images, photo_cover_index, post_mode),
+    )
+    return with_timings(result, payload)
+
+
+async def init_photo_post(payload: dict, title, description, privacy_level, photo_images, photo_cover_index, post_mode):
+    access_token, err = await get_valid_access_token()
+    if err:
+        return err
+
     init_body = {
         "media_type": "PHOTO",
         "post_mode": post_mode,
@@ -483,15 +965,16 @@ async def tiktok_publish_photo(payload: dict):
         },
     }
 
-    async with httpx.AsyncClient(timeout=60) as client:
-        init_r = await client.post(
-            "https://open.tiktokapis.com/v2/post/publish/content/init/",
-            headers={
-                "Authorization": f"Bearer {access_token}",
-                "Content-Type": "application/json; charset=UTF-8",
-            },
-            json=init_body,
-        )
+    with tracing.span("init", media="photo", images=len(photo_images)):
+        async with httpx.AsyncClient(timeout=60, event_hooks=HTTPX_EVENT_HOOKS) as client:
+            init_r = await client.post(
+                f"{TIKTOK_API_BASE}/v2/post/publish/content/init/",
+                headers={
+                    "Authorization": f"Bearer {access_token}",
+                    "Content-Type": "application/json; charset=UTF-8",
+                },
+                json=init_body,
+            )
 
     init_json = safe_json(init_r)
     data = init_json.get("data") or {}
@@ -499,41 +982,97 @@ async def tiktok_publish_photo(payload: dict):
         return JSONResponse({"ok": False, "step": "init", "response": init_json, "status_code": init_r.status_code}, status_code=400)
 
     publish_id = data["publish_id"]
-    async with httpx.AsyncClient(timeout=30) as client:
-        status_r = await client.post(
-            "https://open.tiktokapis.com/v2/post/publish/status/fetch/",
-            headers={
-                "Authorization": f"Bearer {access_token}",
-                "Content-Type": "application/json; charset=UTF-8",
-            },
-            json={"publish_id": publish_id},
-        )
+    await record_quota_use(publish_id)
+    job = publish_jobs.start_job(publish_id, "photo", fetch_publish_status, payload)
+    return {
+        "ok": True,
+        "publish_id": publish_id,
+        "init": init_json,
+        "job": job,
+        "events_url": f"/tiktok/jobs/{publish_id}/events",
+    }
 
-    return {"ok": True, "publish_id": publish_id, "init": init_json, "status": safe_json(status_r)}
+
+async def run_queued_publish(kind: str, payload: dict):
+    key = payload.get("idempotency_key")
+    if kind == "photo":
+        resp = await tiktok_publish_photo(payload, idempotency_key=key)
+    else:
+        resp = await tiktok_publish(payload, idempotency_key=key)
+    if isinstance(resp, dict):
+        return bool(resp.get("ok")), resp
+    return False, safe_json_body(resp)
+
+
+def safe_json_body(resp):
+    try:
+        return json.loads(resp.body)
+    except Exception:
+        return {"status_code": getattr(resp, "status_code", None)}
+
+
+@app.post("/tiktok/publish/bulk")
+@app.post("/tiktok/publish/bulk/")
+async def tiktok_publish_bulk(payload: dict):
+    items = payload.get("jobs") or payload.get("items")
+    if not isinstance(items, list) or not items:
+        return JSONResponse({"ok": False, "error": "Missing jobs"}, status_code=400)
+    created, errors = await publish_queue.enqueue(items)
+    status_code = 200 if created else 400
+    return JSONResponse({"ok": bool(created), "queued": created, "errors": errors}, status_code=status_code)
+
+
+@app.get("/tiktok/queue")
+@app.get("/tiktok/queue/")
+def tiktok_queue(status: Optional[str] = None):
+    jobs = publish_queue.list_jobs(status)
+    return {"ok": True, "count": len(jobs), "jobs": jobs}
+
+
+@app.post("/tiktok/queue/{job_id}/cancel")
+async def tiktok_queue_cancel(job_id: str):
+    job = await publish_queue.cancel(job_id)
+    if not job:
+        return JSONResponse({"ok": False, "error": "job_not_found"}, status_code=404)
+    if job["status"] != "cancelled":
+        return JSONResponse({"ok": False, "error": "job_not_pending", "job": job}, status_code=409)
+    return {"ok": True, "job": job}
 
 
 @app.post("/tiktok/status")
 @app.post("/tiktok/status/")
 async def tiktok_status(payload: dict):
-    access_token, err = await get_valid_access_token()
-    if err:
-        return err
-
     publish_id = payload.get("publish_id") or payload.get("publishId")
     if not publish_id:
         return JSONResponse({"ok": False, "error": "Missing publish_id"}, status_code=400)
 
-    async with httpx.AsyncClient(timeout=30) as client:
-        r = await client.post(
-            "https://open.tiktokapis.com/v2/post/publish/status/fetch/",
-            headers={
-                "Authorization": f"Bearer {access_token}",
-                "Content-Type": "application/json; charset=UTF-8",
-            },
-            json={"publish_id": publish_id},
-        )
+    job = await publish_jobs.get_job(publish_id)
+    if job and not payload.get("refresh"):
+        return JSONResponse({"ok": True, "response": job.get("last_response"), "job": job, "status_code": 200})
+
+    status_code, body = await fetch_publish_status(publish_id)
+    if status_code is None:
+        return body
+    return JSONResponse({"ok": True, "response": body, "status_code": status_code})
 
-    return JSONResponse({"ok": True, "response": safe_json(r), "status_code": r.status_code})
+
+@app.get("/tiktok/jobs/{job_id}")
+async def tiktok_job(job_id: str):
+    job = await publish_jobs.get_job(job_id)
+    if not job:
+        return JSONResponse({"ok": False, "error": "job_not_found"}, status_code=404)
+    return {"ok": True, "job": job}
+
+
+@app.get("/tiktok/jobs/{job_id}/events")
+async def tiktok_job_events(job_id: str):
+    if not await publish_jobs.get_job(job_id):
+        return JSONResponse({"ok": False, "error": "job_not_found"}, status_code=404)
+    return StreamingResponse(
+        publish_jobs.sse_events(job_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 @app.post("/track-publish")
@@ -566,7 +1105,10 @@ async def sync_metrics_endpoint(request: Request):
     try:
         synced = await sync_metrics_for_post(platform, platform_post_id)
         if synced:
-            return JSONResponse({"ok": True, "updated": 1, "metrics": synced.get("metrics", {}), "record": synced})
+            return with_timings(
+                JSONResponse({"ok": True, "updated": 1, "metrics": synced.get("metrics", {}), "record": synced}),
+                body,
+            )
         return JSONResponse({"ok": False, "error": "post_not_found"}, status_code=404)
     except Exception as e:
         return JSONResponse({"ok": False, "error": str(e)}, status_code=500)
@@ -582,13 +1124,183 @@ async def get_metrics(platform: str, platform_post_id: str):
     return JSONResponse({"ok": True, "record": post})
 
 
+def encode_json(obj) -> bytes:
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj)
+        except TypeError:
+            # orjson rejects non-str keys and ints beyond 64 bits; the stdlib does not.
+            pass
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
 @app.get("/metrics/all")
-async def get_all_metrics():
-    if run_sync_all is None or get_all_posts is None:
+async def get_all_metrics(
+    request: Request,
+    format: str = "json",
+    include: str = "",
+    fields: str = "",
+    sync: bool = True,
+    chunk_size: int = 500,
+):
+    """
+    بث السجلات دفعةً دفعة (مصفوفة JSON أو NDJSON) بدل بناء القائمة كاملة في الذاكرة
+    history وraw_publish_response تُحذف افتراضيًا: include=history,raw_publish_response أو include=all
+    """
+    if run_sync_all is None or iter_posts is None:
+        return JSONResponse({"ok": False, "error": "tracker_not_available"}, status_code=501)
+    count = await run_sync_all() if sync else 0
+
+    included = set(HEAVY_POST_FIELDS) if include.strip() == "all" else {f.strip() for f in include.split(",") if f.strip()}
+    exclude = tuple(f for f in HEAVY_POST_FIELDS if f not in included)
+    columns = [f.strip() for f in fields.split(",") if f.strip()] or None
+    ndjson = format == "ndjson" or "application/x-ndjson" in (request.headers.get("accept") or "")
+    chunks = iter_posts(chunk_size=max(1, min(chunk_size, 5000)), fields=columns, exclude=exclude)
+
+    async def body():
+        total = 0
+        if not ndjson:
+            yield b'{"ok":true,"updated_count":' + str(count).encode() + b',"records":['
+        for chunk in chunks:
+            encoded = [encode_json(row) for row in chunk]
+            if ndjson:
+                yield b"\n".join(encoded) + b"\n"
+            else:
+                yield (b"," if total else b"") + b",".join(encoded)
+            total += len(chunk)
+            # Give other requests the loop between chunks.
+            await asyncio.sleep(0)
+        if not ndjson:
+            yield b'],"count":' + str(total).encode() + b"}"
+
+    return StreamingResponse(
+        body(),
+        media_type="application/x-ndjson" if ndjson else "application/json",
+        headers={"X-Updated-Count": str(count)},
+    )
+
+
+@app.get("/recommendations/best-slot")
+@app.get("/recommendations/best-slot/")
+async def best_slot_endpoint(platform: str = "", category: str = "", within_hours: int = 168):
+    """
+    أفضل خانة نشر قادمة لفئة على منصة، من الخريطة المسبقة الحساب
+    """
+    if heatmap is None:
+        return JSONResponse({"ok": False, "error": "tracker_not_available"}, status_code=501)
+    if not platform.strip():
+        return JSONResponse({"ok": False, "error": "Missing platform"}, status_code=400)
+    slot = heatmap.best_slot(platform, category or None, within_hours=within_hours)
+    if slot is None:
+        return JSONResponse({"ok": False, "error": "no_data", "platform": platform}, status_code=404)
+    return JSONResponse({"ok": True, "slot": slot})
+
+
+@app.get("/recommendations/heatmap")
+@app.get("/recommendations/heatmap/")
+async def heatmap_endpoint(platform: str = "", category: str = ""):
+    if heatmap is None:
         return JSONResponse({"ok": False, "error": "tracker_not_available"}, status_code=501)
-    count = await run_sync_all()
-    posts = get_all_posts()
-    return JSONResponse({"ok": True, "updated_count": count, "count": len(posts), "records": posts})
+    if not platform.strip():
+        return JSONResponse({"ok": False, "error": "Missing platform"}, status_code=400)
+    return JSONResponse({"ok": True, **heatmap.grid(platform, category or None)})
+
+
+# ─────────────────────────────────────────────
+# Media index
+# ─────────────────────────────────────────────
+@app.post("/media/index")
+@app.post("/media/index/")
+async def media_index_build(force: bool = False):
+    media_index = await load_optional_module("media_index")
+    if media_index is None:
+        return JSONResponse({"ok": False, "error": "media_index_not_available"}, status_code=501)
+    index = await asyncio.to_thread(media_index.build_index, force)
+    return {
+        "ok": True,
+        "assets": len(index["assets"]),
+        "duplicates": sum(1 for a in index["assets"].values() if a.get("duplicate_of")),
+        "sources": len(index["by_source"]),
+        "products": len(index["by_product"]),
+    }
+
+
+@app.get("/media/assets")
+@app.get("/media/assets/")
+async def media_assets(product_id: str = "", source: str = ""):
+    """
+    الأصول (بعد دمج المكررات) لمنتج أو لمعرّف صورة مصدر
+    """
+    media_index = await load_optional_module("media_index")
+    if media_index is None:
+        return JSONResponse({"ok": False, "error": "media_index_not_available"}, status_code=501)
+    if product_id.strip():
+        assets = await asyncio.to_thread(media_index.find_by_product, product_id.strip())
+    elif source.strip():
+        assets = await asyncio.to_thread(media_index.find_by_source, source.strip())
+    else:
+        return JSONResponse({"ok": False, "error": "Missing product_id or source"}, status_code=400)
+    return {"ok": True, "count": len(assets), "assets": assets}
+
+
+@app.api_route("/media/assets/{name}/{kind}", methods=["GET", "HEAD"])
+async def media_derivative(request: Request, name: str, kind: str):
+    """
+    kind: product (860×860) أو poster (1080×1920) أو thumb (WebP)؛ يُولَّد عند أول طلب ثم يُخدم من الذاكرة المؤقتة
+    """
+    media_index = await load_optional_module("media_index")
+    if media_index is None:
+        return JSONResponse({"ok": False, "error": "media_index_not_available"}, status_code=501)
+    if kind not in media_index.DERIVATIVE_PROFILES:
+        return JSONResponse({"ok": False, "error": "unknown_derivative", "kinds": sorted(media_index.DERIVATIVE_PROFILES)}, status_code=400)
+    path = await asyncio.to_thread(media_index.get_derivative, name, kind)
+    if not path:
+        return JSONResponse({"ok": False, "error": "asset_not_found"}, status_code=404)
+    root = str(media_index.MEDIA_DERIVATIVES_DIR)
+    return serve_file(request, root, os.path.relpath(path, root))
+
+
+# ─────────────────────────────────────────────
+# Analytics
+# ─────────────────────────────────────────────
+def analytics_days(days: int) -> int:
+    return max(1, min(days, 365))
+
+
+@app.get("/analytics/summary")
+@app.get("/analytics/summary/")
+async def analytics_summary(request: Request, days: int = 30):
+    if analytics_cache is None:
+        return JSONResponse({"ok": False, "error": "analytics_not_available"}, status_code=501)
+    entry = await analytics_cache.get(analytics.get_dashboard_summary, analytics.data_version, days=analytics_days(days))
+    return analytics_cache.respond(request, entry)
+
+
+@app.get("/analytics/recommendation")
+@app.get("/analytics/recommendation/")
+async def analytics_recommendation(request: Request, days: int = 30):
+    if analytics_cache is None:
+        return JSONResponse({"ok": False, "error": "analytics_not_available"}, status_code=501)
+    entry = await analytics_cache.get(analytics.generate_publishing_recommendation, analytics.data_version, days=analytics_days(days))
+    return analytics_cache.respond(request, entry)
+
+
+@app.get("/analytics/top-posts")
+@app.get("/analytics/top-posts/")
+async def analytics_top_posts(request: Request, limit: int = 5, platform: str = "", days: int = 0):
+    """
+    days=0 يعني كل الفترة
+    """
+    if analytics_cache is None:
+        return JSONResponse({"ok": False, "error": "analytics_not_available"}, status_code=501)
+    entry = await analytics_cache.get(
+        analytics.get_top_posts,
+        analytics.data_version,
+        limit=max(1, min(limit, 100)),
+        platform=platform.strip().lower() or None,
+        days=analytics_days(days) if days else None,
+    )
+    return analytics_cache.respond(request, entry)
 
 
 if __name__ == "__main__":
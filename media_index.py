@@ -0,0 +1,404 @@
+import os
+import io
+import re
+import json
+import time
+import uuid
+import hashlib
+import subprocess
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlparse
+
+from PIL import Image, ImageOps
+
+from persistence import atomic_write_json, load_json
+from shared_state import shared_lock_sync
+
+MEDIA_DIR = Path(os.environ.get("MEDIA_DIR", "tiktok-media"))
+MEDIA_INDEX_PATH = Path(os.environ.get("MEDIA_INDEX_PATH", "media_index.json"))
+MEDIA_DERIVATIVES_DIR = Path(os.environ.get("MEDIA_DERIVATIVES_DIR", "media_cache"))
+NEAR_DUPLICATE_DISTANCE = int(os.environ.get("MEDIA_NEAR_DUPLICATE_DISTANCE", "6"))
+FFMPEG_BIN = os.environ.get("FFMPEG_BIN", "ffmpeg")
+FFPROBE_BIN = os.environ.get("FFPROBE_BIN", "ffprobe")
+
+INDEX_SCHEMA_VERSION = 1
+DERIVATIVE_VERSION = "1"
+VIDEO_EXTS = {".mp4", ".mov", ".m4v", ".webm"}
+BACKGROUND_COLOR = "#0f0f23"
+
+DERIVATIVE_PROFILES = {
+    "product": {"size": (860, 860), "mode": "crop", "format": "JPEG", "ext": "jpg"},
+    "poster": {"size": (1080, 1920), "mode": "pad", "format": "JPEG", "ext": "jpg"},
+    "thumb": {"size": (320, 320), "mode": "contain", "format": "WEBP", "ext": "webp"},
+}
+
+_TIMESTAMP_PREFIX = re.compile(r"^\d{13}-?")
+
+_index_cache: Optional[Dict[str, Any]] = None
+_index_mtime_ns: Optional[int] = None
+
+
+def utc_now() -> str:
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+
+
+def default_index() -> Dict[str, Any]:
+    return {
+        "meta": {"schema_version": INDEX_SCHEMA_VERSION, "updated_at": utc_now()},
+        "assets": {},
+        "by_source": {},
+        "by_product": {},
+    }
+
+
+# ─────────────────────────────────────────────
+# Fingerprints
+# ─────────────────────────────────────────────
+def source_key(name: str) -> str:
+    """
+    1769724072599S65c5...Y.webp.JPG -> S65c5...Y
+    (معرّف صورة المصدر بدون طابع الوقت والامتدادات)
+    """
+    stem = _TIMESTAMP_PREFIX.sub("", name)
+    while True:
+        base, ext = os.path.splitext(stem)
+        if not ext or len(ext) > 5:
+            return stem
+        stem = base
+
+
+def url_source_key(url: str) -> str:
+    """
+    https://ae01.alicdn.com/kf/S65c5...Y.jpg_960x960q75.jpg_.webp -> S65c5...Y
+    نفس معرّف source_key للنسخ المحفوظة في MEDIA_DIR
+    """
+    name = os.path.basename(urlparse(str(url or "")).path)
+    return _TIMESTAMP_PREFIX.sub("", name).split(".", 1)[0]
+
+
+def content_hash(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def dhash(img: Image.Image, hash_size: int = 8) -> str:
+    gray = img.convert("L").resize((hash_size + 1, hash_size), Image.LANCZOS)
+    px = list(gray.getdata())
+    bits = 0
+    for row in range(hash_size):
+        for col in range(hash_size):
+            left = px[row * (hash_size + 1) + col]
+            right = px[row * (hash_size + 1) + col + 1]
+            bits = (bits << 1) | (1 if left > right else 0)
+    return f"{bits:0{hash_size * hash_size // 4}x}"
+
+
+def hamming(a: str, b: str) -> int:
+    return bin(int(a, 16) ^ int(b, 16)).count("1")
+
+
+def probe_video(path: Path) -> Dict[str, Any]:
+    cmd = [
+        FFPROBE_BIN, "-v", "error", "-select_streams", "v:0",
+        "-show_entries", "stream=width,height,codec_name:format=duration",
+        "-of", "json", str(path),
+    ]
+    try:
+        data = json.loads(subprocess.run(cmd, check=True, capture_output=True).stdout or b"{}")
+    except Exception:
+        return {}
+    stream = (data.get("streams") or [{}])[0]
+    return {
+        "width": stream.get("width"),
+        "height": stream.get("height"),
+        "codec": stream.get("codec_name"),
+        "duration": float((data.get("format") or {}).get("duration") or 0) or None,
+    }
+
+
+def video_frame(path: Path) -> Optional[Image.Image]:
+    cmd = [FFMPEG_BIN, "-v", "error", "-i", str(path), "-frames:v", "1", "-f", "image2pipe", "-vcodec", "png", "pipe:1"]
+    try:
+        out = subprocess.run(cmd, check=True, capture_output=True).stdout
+        return Image.open(io.BytesIO(out)).convert("RGB")
+    except Exception:
+        return None
+
+
+def open_source_image(path: Path, kind: str) -> Optional[Image.Image]:
+    if kind == "video":
+        return video_frame(path)
+    try:
+        with Image.open(path) as img:
+            return ImageOps.exif_transpose(img).convert("RGB")
+    except Exception:
+        return None
+
+
+def describe_asset(path: Path) -> Dict[str, Any]:
+    st = path.stat()
+    entry: Dict[str, Any] = {
+        "name": path.name,
+        "size": st.st_size,
+        "mtime_ns": st.st_mtime_ns,
+        "source_key": source_key(path.name),
+        "sha256": content_hash(path),
+        "kind": None,
+        "format": None,
+        "width": None,
+        "height": None,
+        "phash": None,
+    }
+
+    # امتدادات الملفات هنا غير موثوقة (webp باسم .JPG)، نعتمد على المحتوى
+    try:
+        with Image.open(path) as img:
+            entry["kind"] = "image"
+            entry["format"] = (img.format or "").lower()
+            entry["width"], entry["height"] = ImageOps.exif_transpose(img).size
+            entry["phash"] = dhash(img)
+            return entry
+    except Exception:
+        pass
+
+    info = probe_video(path)
+    if info.get("width"):
+        entry["kind"] = "video"
+        entry["format"] = info.get("codec")
+        entry["width"] = info.get("width")
+        entry["height"] = info.get("height")
+        entry["duration"] = info.get("duration")
+        frame = video_frame(path)
+        if frame is not None:
+            entry["phash"] = dhash(frame)
+    elif path.suffix.lower() in VIDEO_EXTS:
+        entry["kind"] = "video"
+    else:
+        entry["kind"] = "unknown"
+    return entry
+
+
+# ─────────────────────────────────────────────
+# Index
+# ─────────────────────────────────────────────
+def load_index() -> Dict[str, Any]:
+    global _index_cache, _index_mtime_ns
+    try:
+        mtime_ns = MEDIA_INDEX_PATH.stat().st_mtime_ns
+    except OSError:
+        return default_index()
+    if _index_cache is not None and _index_mtime_ns == mtime_ns:
+        return _index_cache
+    data = load_json(
+        MEDIA_INDEX_PATH,
+        default_index,
+        validate=lambda d: isinstance(d, dict) and isinstance(d.get("assets"), dict),
+    )
+    mtime_ns = MEDIA_INDEX_PATH.stat().st_mtime_ns if MEDIA_INDEX_PATH.exists() else None
+    data.setdefault("by_source", {})
+    data.setdefault("by_product", {})
+    _index_cache, _index_mtime_ns = data, mtime_ns
+    return data
+
+
+def save_index(index: Dict[str, Any]) -> None:
+    global _index_cache, _index_mtime_ns
+    index.setdefault("meta", {})["updated_at"] = utc_now()
+    atomic_write_json(MEDIA_INDEX_PATH, index)
+    _index_cache, _index_mtime_ns = index, MEDIA_INDEX_PATH.stat().st_mtime_ns
+
+
+def _mark_duplicates(assets: Dict[str, Dict[str, Any]]) -> None:
+    canonical_by_sha: Dict[str, str] = {}
+    canonical_images: List[Dict[str, Any]] = []
+
+    # الأقدم (حسب طابع الوقت في الاسم) هو النسخة الأصلية
+    for name in sorted(assets):
+        entry = assets[name]
+        entry.pop("duplicate_of", None)
+        entry.pop("duplicate_kind", None)
+
+        original = canonical_by_sha.get(entry["sha256"])
+        if original:
+            entry["duplicate_of"] = original
+            entry["duplicate_kind"] = "exact"
+            continue
+        canonical_by_sha[entry["sha256"]] = name
+
+        if entry.get("phash") and entry.get("kind") == "image":
+            for other in canonical_images:
+                if hamming(entry["phash"], other["phash"]) <= NEAR_DUPLICATE_DISTANCE:
+                    entry["duplicate_of"] = other["name"]
+                    entry["duplicate_kind"] = "near"
+                    break
+            else:
+                canonical_images.append(entry)
+
+
+def _rebuild_lookups(index: Dict[str, Any]) -> None:
+    by_source: Dict[str, List[str]] = {}
+    for name, entry in sorted(index["assets"].items()):
+        by_source.setdefault(entry.get("source_key") or name, []).append(name)
+    index["by_source"] = by_source
+
+    by_product = index.get("by_product") or {}
+    for product_id, names in list(by_product.items()):
+        kept = [n for n in names if n in index["assets"]]
+        if kept:
+            by_product[product_id] = kept
+        else:
+            by_product.pop(product_id, None)
+    index["by_product"] = by_product
+
+
+def build_index(force: bool = False) -> Dict[str, Any]:
+    with shared_lock_sync("media_index"):
+        return _build_index(force)
+
+
+def _build_index(force: bool) -> Dict[str, Any]:
+    index = default_index() if force else load_index()
+    old_assets = index.get("assets", {})
+    assets: Dict[str, Dict[str, Any]] = {}
+
+    if MEDIA_DIR.is_dir():
+        for path in sorted(MEDIA_DIR.iterdir()):
+            if not path.is_file() or path.name.startswith("."):
+                continue
+            st = path.stat()
+            prev = old_assets.get(path.name)
+            if prev and prev.get("size") == st.st_size and prev.get("mtime_ns") == st.st_mtime_ns:
+                assets[path.name] = prev
+            else:
+                assets[path.name] = describe_asset(path)
+
+    _mark_duplicates(assets)
+    if force:
+        # Product tags come from deal data, not from the files, so a full rescan keeps them.
+        index["by_product"] = load_index().get("by_product") or {}
+    index["assets"] = assets
+    _rebuild_lookups(index)
+    save_index(index)
+    return index
+
+
+def get_asset(name: str) -> Optional[Dict[str, Any]]:
+    return load_index()["assets"].get(name)
+
+
+def canonical_asset(name: str) -> Optional[Dict[str, Any]]:
+    assets = load_index()["assets"]
+    entry = assets.get(name)
+    seen = set()
+    while entry and entry.get("duplicate_of") and entry["name"] not in seen:
+        seen.add(entry["name"])
+        entry = assets.get(entry["duplicate_of"]) or entry
+    return entry
+
+
+def _unique_canonicals(names: List[str]) -> List[Dict[str, Any]]:
+    out, seen = [], set()
+    for name in names:
+        entry = canonical_asset(name)
+        if entry and entry["name"] not in seen:
+            seen.add(entry["name"])
+            out.append(entry)
+    return out
+
+
+def find_by_source(key: str) -> List[Dict[str, Any]]:
+    return _unique_canonicals(load_index()["by_source"].get(key, []))
+
+
+def find_by_product(product_id: str) -> List[Dict[str, Any]]:
+    return _unique_canonicals(load_index()["by_product"].get(str(product_id), []))
+
+
+def tag_asset(name: str, product_id: str) -> bool:
+    with shared_lock_sync("media_index"):
+        index = load_index()
+        if name not in index["assets"]:
+            return False
+        names = index["by_product"].setdefault(str(product_id), [])
+        if name not in names:
+            names.append(name)
+            save_index(index)
+        return True
+
+
+def match_product_image(image_url: str, product_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """
+    النسخة المحلية (الأصلية بعد دمج المكررات) لصورة منتج الصفقة، بمعرّف الصورة في الرابط
+    كل تطابق يربط الأصل بـ product_id فتصبح find_by_product فورية للصفقات التالية
+    """
+    key = url_source_key(image_url)
+    if not key:
+        return None
+    entry = next((e for e in find_by_source(key) if e.get("kind") == "image"), None)
+    if entry and product_id and entry["name"] not in load_index()["by_product"].get(str(product_id), []):
+        tag_asset(entry["name"], str(product_id))
+    return entry
+
+
+def find_similar(path: str, max_distance: int = NEAR_DUPLICATE_DISTANCE) -> List[Dict[str, Any]]:
+    img = open_source_image(Path(path), "image")
+    if img is None:
+        return []
+    target = dhash(img)
+    matches = []
+    for entry in load_index()["assets"].values():
+        if entry.get("phash") and not entry.get("duplicate_of"):
+            distance = hamming(target, entry["phash"])
+            if distance <= max_distance:
+                matches.append({**entry, "distance": distance})
+    return sorted(matches, key=lambda x: x["distance"])
+
+
+# ─────────────────────────────────────────────
+# Derivatives
+# ─────────────────────────────────────────────
+def _render_derivative(img: Image.Image, profile: Dict[str, Any]) -> Image.Image:
+    size = profile["size"]
+    if profile["mode"] == "crop":
+        return ImageOps.fit(img, size, Image.LANCZOS)
+    if profile["mode"] == "pad":
+        canvas = Image.new("RGB", size, BACKGROUND_COLOR)
+        fitted = ImageOps.contain(img, size, Image.LANCZOS)
+        canvas.paste(fitted, ((size[0] - fitted.width) // 2, (size[1] - fitted.height) // 2))
+        return canvas
+    out = img.copy()
+    out.thumbnail(size, Image.LANCZOS)
+    return out
+
+
+def get_derivative(name: str, kind: str) -> Optional[str]:
+    profile = DERIVATIVE_PROFILES.get(kind)
+    entry = canonical_asset(name)
+    if not profile or not entry or not entry.get("sha256"):
+        return None
+
+    sha = entry["sha256"]
+    out_path = MEDIA_DERIVATIVES_DIR / sha[:2] / f"{sha}_{kind}_v{DERIVATIVE_VERSION}.{profile['ext']}"
+    if out_path.exists():
+        return str(out_path)
+
+    img = open_source_image(MEDIA_DIR / entry["name"], entry.get("kind") or "image")
+    if img is None:
+        return None
+
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = out_path.with_name(f"{out_path.name}.{os.getpid()}.{uuid.uuid4().hex[:8]}.tmp")
+    _render_derivative(img, profile).save(tmp_path, format=profile["format"], quality=88)
+    os.replace(tmp_path, out_path)
+    return str(out_path)
+
+
+if __name__ == "__main__":
+    import sys
+    idx = build_index(force="--force" in sys.argv)
+    dupes = sum(1 for a in idx["assets"].values() if a.get("duplicate_of"))
+    print(json.dumps({"assets": len(idx["assets"]), "duplicates": dupes, "sources": len(idx["by_source"])}))
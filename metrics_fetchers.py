@@ -0,0 +1,465 @@
+import os
+import json
+import time
+import asyncio
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from instrumentation import HTTPX_EVENT_HOOKS
+from persistence import load_json
+
+TELEGRAM_BOT_TOKEN = os.environ.get("TELEGRAM_BOT_TOKEN", "").strip()
+# TOKENS_PATH is what main.py writes; TOKENSPATH is the old tracker.py spelling.
+TIKTOK_ACCESS_TOKEN_PATH = os.environ.get("TOKENS_PATH") or os.environ.get("TOKENSPATH") or "tokens.json"
+DEFAULT_CHANNEL_ID = (
+    os.environ.get("CHANNEL_ID")
+    or os.environ.get("TELEGRAM_CHANNEL_ID")
+    or os.environ.get("CHANNEL_USERNAME")
+    or ""
+).strip()
+
+METRICS_HTTP_TIMEOUT = float(os.environ.get("METRICS_HTTP_TIMEOUT", "20"))
+METRICS_HTTP_MAX_CONNECTIONS = int(os.environ.get("METRICS_HTTP_MAX_CONNECTIONS", "20"))
+
+TIKTOK_API_BASE = os.environ.get("TIKTOK_API_BASE", "https://open.tiktokapis.com").rstrip("/")
+TIKTOK_VIDEO_QUERY_URL = f"{TIKTOK_API_BASE}/v2/video/query/"
+# video/query accepts at most 20 ids per call.
+TIKTOK_QUERY_BATCH = 20
+TIKTOK_RATE_PER_SECOND = float(os.environ.get("TIKTOK_METRICS_RATE", "5"))
+TELEGRAM_API_BASE = os.environ.get("TELEGRAM_API_BASE", "https://api.telegram.org").rstrip("/")
+TELEGRAM_SYNC_BATCH = int(os.environ.get("TELEGRAM_SYNC_BATCH", "25"))
+TELEGRAM_RATE_PER_SECOND = float(os.environ.get("TELEGRAM_METRICS_RATE", "20"))
+
+# Graph API (Facebook pages + Instagram business media). A batch request takes up to 50 sub-requests.
+GRAPH_API_BASE = os.environ.get("GRAPH_API_BASE", "https://graph.facebook.com/v19.0").rstrip("/")
+GRAPH_BATCH_LIMIT = 50
+GRAPH_RATE_PER_SECOND = float(os.environ.get("GRAPH_METRICS_RATE", "3"))
+FACEBOOK_PAGE_ACCESS_TOKEN = os.environ.get("FACEBOOK_PAGE_ACCESS_TOKEN", "").strip()
+INSTAGRAM_ACCESS_TOKEN = (os.environ.get("INSTAGRAM_ACCESS_TOKEN") or FACEBOOK_PAGE_ACCESS_TOKEN).strip()
+
+TIKTOK_VIDEO_FIELDS = ["id", "view_count", "like_count", "comment_count", "share_count", "reach_user_count"]
+# publish results have carried both forms over time.
+TIKTOK_VIDEO_ID_PREFIXES = ("v.pub_url/", "p_pub_url~v2.")
+
+
+# ─────────────────────────────────────────────
+# Shared client & rate limiters
+# ─────────────────────────────────────────────
+class RateLimiter:
+    """
+    دلو رموز: rate طلب/ثانية مع سماح بدفعة burst — مشترك بين كل دفعات المنصة
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+
+    async def acquire(self) -> None:
+        if self.rate <= 0:
+            return
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+_limiters: Dict[str, RateLimiter] = {}
+_client: Optional[httpx.AsyncClient] = None
+_client_loop = None
+
+
+def rate_limiter(name: str, rate: float, burst: int = 1) -> RateLimiter:
+    limiter = _limiters.get(name)
+    if limiter is None:
+        limiter = _limiters[name] = RateLimiter(rate, burst)
+    return limiter
+
+
+def shared_client() -> httpx.AsyncClient:
+    """
+    عميل httpx واحد لكل حلقة أحداث: اتصالات keep-alive مشتركة بين كل الـ fetchers
+    """
+    global _client, _client_loop
+    loop = asyncio.get_running_loop()
+    if _client is None or _client.is_closed or _client_loop is not loop:
+        _client = httpx.AsyncClient(
+            timeout=METRICS_HTTP_TIMEOUT,
+            event_hooks=HTTPX_EVENT_HOOKS,
+            limits=httpx.Limits(
+                max_connections=METRICS_HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=METRICS_HTTP_MAX_CONNECTIONS,
+            ),
+        )
+        _client_loop = loop
+    return _client
+
+
+async def aclose_shared_client() -> None:
+    global _client
+    if _client is not None and not _client.is_closed and _client_loop is asyncio.get_running_loop():
+        await _client.aclose()
+    _client = None
+
+
+# ─────────────────────────────────────────────
+# Helpers
+# ─────────────────────────────────────────────
+def load_tiktok_token() -> str:
+    data = load_json(Path(TIKTOK_ACCESS_TOKEN_PATH), dict, validate=lambda d: isinstance(d, dict))
+    return (data.get("access_token") or "").strip()
+
+
+def parse_tiktok_video_id(platform_post_id: Any) -> str:
+    value = str(platform_post_id or "").strip()
+    for prefix in TIKTOK_VIDEO_ID_PREFIXES:
+        value = value.replace(prefix, "")
+    return value.split("?")[0].split("!")[0].strip()
+
+
+def count_reactions(reactions_obj: Optional[dict]) -> Optional[int]:
+    if not reactions_obj:
+        return None
+    total = 0
+    for r in reactions_obj.get("results", []) or []:
+        total += int(r.get("count", 0) or 0)
+    return total or None
+
+
+# ─────────────────────────────────────────────
+# Fetchers
+# ─────────────────────────────────────────────
+class MetricsFetcher(ABC):
+    """
+    fetch_batch(rows) يرجع قائمة مقاييس بنفس ترتيب rows
+    batch_size = أقصى عدد منشورات يُمرَّر في دفعة واحدة
+    """
+
+    platform = ""
+    source = ""
+    batch_size = 1
+
+    def __init__(self, limiter: RateLimiter):
+        self.limiter = limiter
+
+    def error(self, message: str, **extra) -> Dict[str, Any]:
+        return {"metrics_source": self.source, "metrics_error": message, **extra}
+
+    @abstractmethod
+    async def fetch_batch(self, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        ...
+
+
+class TikTokFetcher(MetricsFetcher):
+    platform = "tiktok"
+    source = "tiktok_api"
+    batch_size = TIKTOK_QUERY_BATCH
+
+    async def fetch_batch(self, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        token = load_tiktok_token()
+        video_ids = [parse_tiktok_video_id(row.get("platform_post_id")) for row in rows]
+        if not token:
+            return [self.error("missing_token_or_post_id") for _ in rows]
+
+        wanted = sorted({vid for vid in video_ids if vid})
+        found: Dict[str, Dict[str, Any]] = {}
+        api_error = None
+        if wanted:
+            await self.limiter.acquire()
+            try:
+                r = await shared_client().post(
+                    TIKTOK_VIDEO_QUERY_URL,
+                    headers={
+                        "Authorization": f"Bearer {token}",
+                        "Content-Type": "application/json; charset=UTF-8",
+                    },
+                    json={
+                        "filters": {"video_ids": wanted},
+                        "fields": TIKTOK_VIDEO_FIELDS,
+                        "max_count": len(wanted),
+                    },
+                )
+                data = r.json() or {}
+            except Exception as e:
+                return [self.error(str(e)) for _ in rows]
+            for v in (data.get("data") or {}).get("videos") or []:
+                found[str(v.get("id"))] = v
+            api_error = (data.get("error") or {}).get("code")
+            if api_error == "ok":
+                api_error = None
+
+        out = []
+        for vid in video_ids:
+            if not vid:
+                out.append(self.error("invalid_video_id"))
+                continue
+            v = found.get(vid)
+            if v is None:
+                out.append(self.error("video_not_found", api_error=api_error) if api_error else self.error("video_not_found"))
+                continue
+            out.append({
+                "views": v.get("view_count"),
+                "likes": v.get("like_count"),
+                "comments": v.get("comment_count"),
+                "shares": v.get("share_count"),
+                "reach": v.get("reach_user_count"),
+                "video_id": v.get("id") or vid,
+                "metrics_source": self.source,
+            })
+        return out
+
+
+class TelegramFetcher(MetricsFetcher):
+    """
+    Bot API لا يعطي مشاهدات رسالة مباشرة: forwardMessage للبوت ثم قراءة views ثم الحذف
+    getMe وgetChatMemberCount يُطلبان مرة واحدة لكل دفعة لا لكل رسالة
+    """
+
+    platform = "telegram"
+    source = "telegram_bot"
+    batch_size = TELEGRAM_SYNC_BATCH
+
+    def __init__(self, limiter: RateLimiter):
+        super().__init__(limiter)
+        self._bot_id = None
+
+    async def _call(self, method: str, **kwargs) -> Dict[str, Any]:
+        await self.limiter.acquire()
+        r = await shared_client().post(f"{TELEGRAM_API_BASE}/bot{TELEGRAM_BOT_TOKEN}/{method}", json=kwargs)
+        return r.json() or {}
+
+    async def _bot(self):
+        if self._bot_id is None:
+            me = await self._call("getMe")
+            self._bot_id = (me.get("result") or {}).get("id")
+        return self._bot_id
+
+    async def _one(self, bot_id, channel_id: str, message_id: Any, members: Optional[int]) -> Dict[str, Any]:
+        result: Dict[str, Any] = {"metrics_source": self.source}
+        if members is not None:
+            result["channel_members"] = members
+        if not message_id:
+            return {**result, "metrics_error": "missing_token_or_message_id"}
+        if not (bot_id and channel_id):
+            return result
+        try:
+            fw_data = await self._call(
+                "forwardMessage",
+                chat_id=bot_id,
+                from_chat_id=channel_id,
+                message_id=int(message_id),
+                disable_notification=True,
+            )
+            if not fw_data.get("ok"):
+                return {**result, "metrics_error": fw_data.get("description") or "forward_failed"}
+            msg = fw_data.get("result") or {}
+            result["views"] = msg.get("views")
+            result["forwards"] = msg.get("forwards")
+            result["reactions"] = count_reactions(msg.get("reactions"))
+            forwarded_id = msg.get("message_id")
+            if forwarded_id:
+                try:
+                    await self._call("deleteMessage", chat_id=bot_id, message_id=forwarded_id)
+                except Exception:
+                    pass
+            return result
+        except Exception as e:
+            return {**result, "metrics_error": str(e)}
+
+    async def fetch_batch(self, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        if not TELEGRAM_BOT_TOKEN:
+            return [self.error("missing_token_or_message_id") for _ in rows]
+        try:
+            bot_id = await self._bot()
+        except Exception as e:
+            return [self.error(str(e)) for _ in rows]
+
+        channels = {row.get("channel_id") or DEFAULT_CHANNEL_ID for row in rows} - {""}
+        members: Dict[str, Optional[int]] = {}
+        for channel_id in channels:
+            try:
+                mc = await self._call("getChatMemberCount", chat_id=channel_id)
+                members[channel_id] = mc.get("result") if mc.get("ok") else None
+            except Exception:
+                members[channel_id] = None
+
+        return list(await asyncio.gather(*(
+            self._one(
+                bot_id,
+                row.get("channel_id") or DEFAULT_CHANNEL_ID,
+                row.get("platform_post_id"),
+                members.get(row.get("channel_id") or DEFAULT_CHANNEL_ID),
+            )
+            for row in rows
+        )))
+
+
+def _insight_values(body: Dict[str, Any]) -> Dict[str, Any]:
+    out = {}
+    for item in ((body.get("insights") or {}).get("data") or []):
+        if "total_value" in item:
+            out[item.get("name")] = (item.get("total_value") or {}).get("value")
+        else:
+            values = item.get("values") or [{}]
+            out[item.get("name")] = values[-1].get("value")
+    return out
+
+
+def _summary_count(body: Dict[str, Any], edge: str) -> Optional[int]:
+    return ((body.get(edge) or {}).get("summary") or {}).get("total_count")
+
+
+class GraphBatchFetcher(MetricsFetcher):
+    """
+    طلب batch واحد لكل 50 منشورًا، وكل طلب فرعي يجلب العدادات والـ insights
+    معًا عبر field expansion بدل طلب لكل مقياس
+    """
+
+    batch_size = GRAPH_BATCH_LIMIT
+    fields = ""
+
+    @abstractmethod
+    def token(self) -> str:
+        ...
+
+    @abstractmethod
+    def parse(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        ...
+
+    async def fetch_batch(self, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        token = self.token()
+        if not token:
+            return [self.error("missing_token_or_post_id") for _ in rows]
+
+        post_ids = [str(row.get("platform_post_id") or "").strip() for row in rows]
+        requests = [
+            {"method": "GET", "relative_url": f"{post_id}?fields={self.fields}"}
+            for post_id in post_ids if post_id
+        ]
+        responses: List[Any] = []
+        if requests:
+            await self.limiter.acquire()
+            try:
+                r = await shared_client().post(
+                    f"{GRAPH_API_BASE}/",
+                    data={
+                        "access_token": token,
+                        "include_headers": "false",
+                        "batch": json.dumps(requests, separators=(",", ":")),
+                    },
+                )
+                data = r.json()
+            except Exception as e:
+                return [self.error(str(e)) for _ in rows]
+            if isinstance(data, dict):
+                message = (data.get("error") or {}).get("message") or "graph_batch_failed"
+                return [self.error(message) for _ in rows]
+            responses = list(data or [])
+
+        out = []
+        it = iter(responses)
+        for post_id in post_ids:
+            if not post_id:
+                out.append(self.error("invalid_post_id"))
+                continue
+            item = next(it, None)
+            # null = the sub-request timed out inside Graph's batch
+            if not item:
+                out.append(self.error("batch_item_timeout"))
+                continue
+            try:
+                body = json.loads(item.get("body") or "{}")
+            except ValueError:
+                body = {}
+            if int(item.get("code") or 0) != 200 or "error" in body:
+                out.append(self.error((body.get("error") or {}).get("message") or f"http_{item.get('code')}"))
+                continue
+            out.append({**self.parse(body), "metrics_source": self.source})
+        return out
+
+
+class FacebookFetcher(GraphBatchFetcher):
+    platform = "facebook"
+    source = "facebook_graph"
+    fields = (
+        "shares,"
+        "reactions.summary(total_count).limit(0),"
+        "comments.summary(total_count).limit(0),"
+        "insights.metric(post_impressions,post_impressions_unique,post_clicks)"
+    )
+
+    def token(self) -> str:
+        return FACEBOOK_PAGE_ACCESS_TOKEN
+
+    def parse(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        insights = _insight_values(body)
+        return {
+            "impressions": insights.get("post_impressions"),
+            "reach": insights.get("post_impressions_unique"),
+            "clicks": insights.get("post_clicks"),
+            "reactions": _summary_count(body, "reactions"),
+            "comments": _summary_count(body, "comments"),
+            "shares": (body.get("shares") or {}).get("count"),
+        }
+
+
+class InstagramFetcher(GraphBatchFetcher):
+    platform = "instagram"
+    source = "instagram_graph"
+    fields = "like_count,comments_count,insights.metric(impressions,reach,saved,shares)"
+
+    def token(self) -> str:
+        return INSTAGRAM_ACCESS_TOKEN
+
+    def parse(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        insights = _insight_values(body)
+        return {
+            "impressions": insights.get("impressions"),
+            "reach": insights.get("reach"),
+            "saved": insights.get("saved"),
+            "shares": insights.get("shares"),
+            "likes": body.get("like_count"),
+            "comments": body.get("comments_count"),
+        }
+
+
+# ─────────────────────────────────────────────
+# Registry
+# ─────────────────────────────────────────────
+FETCHERS: Dict[str, MetricsFetcher] = {}
+
+
+def register_fetcher(fetcher: MetricsFetcher) -> MetricsFetcher:
+    FETCHERS[fetcher.platform] = fetcher
+    return fetcher
+
+
+def get_fetcher(platform: str) -> Optional[MetricsFetcher]:
+    return FETCHERS.get((platform or "").strip().lower())
+
+
+def registered_platforms() -> List[str]:
+    return sorted(FETCHERS)
+
+
+register_fetcher(TikTokFetcher(rate_limiter("tiktok", TIKTOK_RATE_PER_SECOND, burst=2)))
+register_fetcher(TelegramFetcher(rate_limiter("telegram", TELEGRAM_RATE_PER_SECOND, burst=5)))
+# Facebook and Instagram count against the same app-level Graph quota.
+register_fetcher(FacebookFetcher(rate_limiter("graph", GRAPH_RATE_PER_SECOND, burst=2)))
+register_fetcher(InstagramFetcher(rate_limiter("graph", GRAPH_RATE_PER_SECOND, burst=2)))
+
+
+async def fetch_tiktok_metrics(platform_post_id: str) -> Dict[str, Any]:
+    return (await FETCHERS["tiktok"].fetch_batch([{"platform_post_id": platform_post_id}]))[0]
+
+
+async def fetch_telegram_metrics(channel_id: str, message_id: str) -> Dict[str, Any]:
+    return (await FETCHERS["telegram"].fetch_batch([{"channel_id": channel_id, "platform_post_id": message_id}]))[0]
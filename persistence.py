@@ -0,0 +1,177 @@
+import os
+import json
+import time
+from pathlib import Path
+from typing import Any, Callable, Iterator, List, Optional, Tuple, Union
+
+PERSIST_BACKUPS = int(os.environ.get("PERSIST_BACKUPS", "2"))
+PERSIST_FSYNC = os.environ.get("PERSIST_FSYNC", "1").strip() not in ("0", "false", "no")
+
+PathLike = Union[str, Path]
+
+
+def _fsync_dir(path: Path) -> None:
+    if not PERSIST_FSYNC or os.name != "posix":
+        return
+    try:
+        fd = os.open(str(path.parent or Path(".")), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def backup_paths(path: PathLike) -> List[Path]:
+    path = Path(path)
+    return [path.with_name(f"{path.name}.bak.{i}") for i in range(1, PERSIST_BACKUPS + 1)]
+
+
+def _rotate_backups(path: Path) -> None:
+    """
+    .bak.1 = النسخة السابقة مباشرة، .bak.N الأقدم — روابط صلبة فلا نسخ للبيانات
+    """
+    backups = backup_paths(path)
+    if not backups or not path.exists():
+        return
+    for older, newer in zip(reversed(backups[1:]), reversed(backups[:-1])):
+        if newer.exists():
+            os.replace(newer, older)
+    try:
+        if backups[0].exists():
+            backups[0].unlink()
+        os.link(path, backups[0])
+    except OSError:
+        pass
+
+
+def atomic_write_text(path: PathLike, text: str, backup: bool = True) -> None:
+    """
+    كتابة إلى ملف مؤقت في نفس المجلد ثم fsync ثم rename — لا يبقى الملف نصف مكتوب أبدًا
+    """
+    path = Path(path)
+    if path.parent and str(path.parent) not in ("", "."):
+        path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+        f.flush()
+        if PERSIST_FSYNC:
+            os.fsync(f.fileno())
+    if backup:
+        _rotate_backups(path)
+    os.replace(tmp, path)
+    _fsync_dir(path)
+
+
+def atomic_write_json(path: PathLike, data: Any, backup: bool = True, indent: Optional[int] = 2) -> None:
+    atomic_write_text(path, json.dumps(data, ensure_ascii=False, indent=indent), backup=backup)
+
+
+def _read_json(path: Path) -> Tuple[bool, Any]:
+    try:
+        return True, json.loads(path.read_text(encoding="utf-8"))
+    except FileNotFoundError:
+        return False, None
+    except Exception:
+        return False, ...
+
+
+def load_json(path: PathLike, default: Callable[[], Any], validate: Optional[Callable[[Any], bool]] = None) -> Any:
+    """
+    يقرأ الملف، وعند التلف يرجع لأحدث نسخة احتياطية سليمة
+    الملف التالف يُنقل جانبًا (.corrupt.<ts>) بدل استبداله بقاعدة فارغة
+    """
+    path = Path(path)
+    ok, data = _read_json(path)
+    if ok and (validate is None or validate(data)):
+        return data
+    if not ok and data is None:
+        return default()
+
+    aside = path.with_name(f"{path.name}.corrupt.{int(time.time())}")
+    for candidate in backup_paths(path):
+        b_ok, b_data = _read_json(candidate)
+        if b_ok and (validate is None or validate(b_data)):
+            os.replace(path, aside)
+            atomic_write_json(path, b_data, backup=False)
+            return b_data
+
+    os.replace(path, aside)
+    return default()
+
+
+# ─────────────────────────────────────────────
+# Journal
+# ─────────────────────────────────────────────
+class JsonJournal:
+    """
+    سجل إلحاق (NDJSON) للتحديثات الصغيرة: كل تحديث سطر، والدمج في اللقطة الكاملة دوري
+    كل سطر محاط بـ "\\n" كي لا يلتصق سطر جديد بسطر مقطوع بعد انهيار
+    """
+
+    def __init__(self, path: PathLike, compact_every: int = 500):
+        self.path = Path(path)
+        self.compact_every = compact_every
+
+    def append(self, entry: Any) -> int:
+        return self.append_many([entry])
+
+    def append_many(self, entries: List[Any]) -> int:
+        # fsync واحد للدفعة كلها
+        data = "".join(
+            "\n" + json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n"
+            for entry in entries
+        )
+        with open(self.path, "ab") as f:
+            f.write(data.encode("utf-8"))
+            f.flush()
+            if PERSIST_FSYNC:
+                os.fsync(f.fileno())
+            return f.tell()
+
+    def read_from(self, offset: int = 0) -> Tuple[List[Any], int]:
+        try:
+            with open(self.path, "rb") as f:
+                size = os.fstat(f.fileno()).st_size
+                if offset > size:
+                    offset = 0
+                f.seek(offset)
+                raw = f.read()
+        except FileNotFoundError:
+            return [], 0
+        # سطر أخير بلا "\n" قد يكون قيد الكتابة من عملية أخرى: لا نتجاوزه
+        raw = raw[: raw.rfind(b"\n") + 1]
+        entries = []
+        for line in raw.split(b"\n"):
+            if not line.strip():
+                continue
+            try:
+                entries.append(json.loads(line))
+            except Exception:
+                continue
+        return entries, offset + len(raw)
+
+    def entries(self) -> Iterator[Any]:
+        return iter(self.read_from(0)[0])
+
+    def size(self) -> int:
+        try:
+            return self.path.stat().st_size
+        except OSError:
+            return 0
+
+    def needs_compaction(self, appended_since_compact: int) -> bool:
+        return appended_since_compact >= self.compact_every
+
+    def truncate(self) -> None:
+        try:
+            with open(self.path, "w", encoding="utf-8") as f:
+                f.flush()
+                if PERSIST_FSYNC:
+                    os.fsync(f.fileno())
+        except OSError:
+            pass
@@ -0,0 +1,386 @@
+import os
+import json
+import time
+import socket
+import asyncio
+import calendar
+import ipaddress
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+import httpx
+
+import shared_state
+import tracing
+
+try:
+    from tracker import track_publish
+except Exception:
+    track_publish = None
+
+POLL_INITIAL_DELAY = float(os.environ.get("PUBLISH_POLL_INITIAL_DELAY", "2"))
+POLL_MAX_DELAY = float(os.environ.get("PUBLISH_POLL_MAX_DELAY", "60"))
+POLL_TIMEOUT_SECONDS = float(os.environ.get("PUBLISH_POLL_TIMEOUT", str(30 * 60)))
+JOBS_MAX = int(os.environ.get("PUBLISH_JOBS_MAX", "1000"))
+SHARED_JOB_TTL_SECONDS = 24 * 3600
+# The polling worker renews this lease every poll; a "polling" job whose lease lapsed
+# (worker restarted or died) is picked up again by the next resume pass on any worker.
+JOB_LEASE_SECONDS = POLL_MAX_DELAY * 3
+WORKER_ID = f"{os.uname().nodename}:{os.getpid()}"
+# Comma list of hosts webhook_url may point at; empty = any https host with only public addresses.
+WEBHOOK_ALLOWED_HOSTS = {h.strip().lower() for h in os.environ.get("PUBLISH_WEBHOOK_ALLOWED_HOSTS", "").split(",") if h.strip()}
+
+# SEND_TO_USER_INBOX is final for MEDIA_UPLOAD / inbox posts: the user finishes
+# the post inside the TikTok app and no further status change is reported.
+TERMINAL_STATUSES = {"PUBLISH_COMPLETE", "FAILED", "SEND_TO_USER_INBOX"}
+
+FetchStatus = Callable[[str], Awaitable[Tuple[Optional[int], Dict[str, Any]]]]
+
+JOBS: Dict[str, Dict[str, Any]] = {}
+_subscribers: Dict[str, List[asyncio.Queue]] = {}
+_tasks: Dict[str, asyncio.Task] = {}
+# Latest unshared snapshot per job and the single task writing them, so writes land in order.
+_share_pending: Dict[str, str] = {}
+_share_writers: Dict[str, asyncio.Task] = {}
+_resumer: Optional[asyncio.Task] = None
+
+
+def utc_now() -> str:
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+
+
+def job_snapshot(job: Dict[str, Any]) -> Dict[str, Any]:
+    return {k: v for k, v in job.items() if not k.startswith("_")}
+
+
+async def get_job(job_id: str) -> Optional[Dict[str, Any]]:
+    job = JOBS.get(job_id)
+    if job:
+        return job_snapshot(job)
+    # الوظيفة تعمل في worker آخر: نقرأ آخر لقطة من المخزن المشترك
+    raw = await shared_state.get(f"publish_job:{job_id}")
+    return job_snapshot(json.loads(raw)) if raw else None
+
+
+async def _share_writer(job_id: str) -> None:
+    try:
+        while job_id in _share_pending:
+            raw = _share_pending.pop(job_id)
+            try:
+                await asyncio.to_thread(shared_state.put_sync, f"publish_job:{job_id}", raw, SHARED_JOB_TTL_SECONDS)
+            except Exception:
+                pass
+    finally:
+        _share_writers.pop(job_id, None)
+
+
+def _share(job: Dict[str, Any]) -> None:
+    """
+    كاتب واحد لكل وظيفة يكتب أحدث لقطة فقط: لقطة "polling" قديمة لا تكتب فوق "done"
+    """
+    job_id = job["job_id"]
+    # _track rides along so a worker that resumes the poll can still call track_publish.
+    _share_pending[job_id] = json.dumps({**job_snapshot(job), "_track": job.get("_track") or {}}, ensure_ascii=False)
+    if job_id not in _share_writers:
+        _share_writers[job_id] = asyncio.create_task(_share_writer(job_id))
+
+
+def is_terminal(job: Dict[str, Any]) -> bool:
+    return job.get("state") in ("done", "failed", "timeout")
+
+
+def _prune_jobs() -> None:
+    if len(JOBS) <= JOBS_MAX:
+        return
+    finished = [jid for jid, j in JOBS.items() if is_terminal(j)]
+    for jid in finished[: len(JOBS) - JOBS_MAX]:
+        JOBS.pop(jid, None)
+        _subscribers.pop(jid, None)
+
+
+def _notify(job: Dict[str, Any]) -> None:
+    _share(job)
+    snap = job_snapshot(job)
+    for q in _subscribers.get(job["job_id"], []):
+        q.put_nowait(snap)
+
+
+def subscribe(job_id: str) -> asyncio.Queue:
+    q: asyncio.Queue = asyncio.Queue()
+    _subscribers.setdefault(job_id, []).append(q)
+    job = JOBS.get(job_id)
+    if job:
+        q.put_nowait(job_snapshot(job))
+    return q
+
+
+def unsubscribe(job_id: str, q: asyncio.Queue) -> None:
+    subs = _subscribers.get(job_id) or []
+    if q in subs:
+        subs.remove(q)
+    if not subs:
+        _subscribers.pop(job_id, None)
+
+
+async def _remote_events(job_id: str):
+    last = None
+    # The owning worker gives up after POLL_TIMEOUT_SECONDS; one more poll interval covers its final write.
+    deadline = time.monotonic() + POLL_TIMEOUT_SECONDS + POLL_MAX_DELAY
+    while True:
+        snap = await get_job(job_id)
+        if snap is None:
+            yield f"event: error\ndata: {json.dumps({'error': 'job_not_found', 'job_id': job_id})}\n\n"
+            return
+        if time.monotonic() >= deadline:
+            yield f"event: error\ndata: {json.dumps({'error': 'stream_timeout', 'job_id': job_id})}\n\n"
+            return
+        if snap != last:
+            last = snap
+            yield f"event: status\ndata: {json.dumps(snap, ensure_ascii=False)}\n\n"
+            if is_terminal(snap):
+                return
+        else:
+            yield ": keepalive\n\n"
+        await asyncio.sleep(2)
+
+
+async def sse_events(job_id: str):
+    if job_id not in JOBS:
+        async for event in _remote_events(job_id):
+            yield event
+        return
+
+    q = subscribe(job_id)
+    try:
+        while True:
+            try:
+                snap = await asyncio.wait_for(q.get(), timeout=15)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            yield f"event: status\ndata: {json.dumps(snap, ensure_ascii=False)}\n\n"
+            if is_terminal(snap):
+                return
+    finally:
+        unsubscribe(job_id, q)
+
+
+def _post_ids(body: Dict[str, Any]) -> List[str]:
+    data = (body or {}).get("data") or {}
+    ids = data.get("publicaly_available_post_id") or data.get("publicly_available_post_id") or []
+    return [str(i) for i in ids if i]
+
+
+async def _track_result(job: Dict[str, Any]) -> None:
+    meta = job.get("_track") or {}
+    if job["state"] != "done":
+        return
+    if track_publish is None:
+        job["tracking"] = "tracker_not_available"
+        return
+    if not meta.get("product_id"):
+        job["tracking"] = "skipped_missing_product_id"
+        return
+    post_ids = job.get("post_ids") or []
+    try:
+        saved = await track_publish({
+            **meta,
+            "platform": "tiktok",
+            "platform_post_id": post_ids[0] if post_ids else job["publish_id"],
+            "publish_status": "published",
+            "raw_publish_response": job.get("last_response") or {},
+        })
+        job["tracking"] = "tracked"
+        job["tracked_id"] = saved.get("id")
+    except Exception as e:
+        job["tracking"] = f"error:{e}"
+
+
+async def webhook_problem(url: str) -> Optional[str]:
+    """
+    None إن كان webhook_url آمنًا للإرسال: https إلى مضيف مسموح أو عام فقط
+    (لا loopback ولا شبكات خاصة ولا link-local مثل 169.254.169.254)
+    """
+    parsed = urlparse(str(url))
+    if parsed.scheme != "https" or not parsed.hostname:
+        return "webhook_must_be_https"
+    host = parsed.hostname.lower()
+    if WEBHOOK_ALLOWED_HOSTS:
+        return None if host in WEBHOOK_ALLOWED_HOSTS else "webhook_host_not_allowed"
+    try:
+        infos = await asyncio.get_running_loop().getaddrinfo(host, parsed.port or 443, type=socket.SOCK_STREAM)
+    except (OSError, UnicodeError):
+        return "webhook_host_unresolvable"
+    for info in infos:
+        ip = ipaddress.ip_address(info[4][0].split("%")[0])
+        if not ip.is_global or ip.is_multicast:
+            return "webhook_host_not_public"
+    return None
+
+
+async def _send_webhook(job: Dict[str, Any]) -> None:
+    url = job.get("webhook_url")
+    if not url:
+        return
+    problem = await webhook_problem(url)
+    if problem:
+        job["webhook_status"] = f"rejected:{problem}"
+        return
+    try:
+        # A redirect could point at an internal host that the check above never saw.
+        async with httpx.AsyncClient(timeout=15, follow_redirects=False) as client:
+            r = await client.post(url, json={"event": "publish_job_finished", "job": job_snapshot(job)})
+        job["webhook_status"] = r.status_code
+    except Exception as e:
+        job["webhook_status"] = f"error:{e}"
+
+
+async def _renew_lease(job_id: str) -> None:
+    try:
+        await asyncio.to_thread(shared_state.put_sync, f"publish_job_lease:{job_id}", WORKER_ID, JOB_LEASE_SECONDS)
+    except Exception:
+        pass
+
+
+async def _poll(job: Dict[str, Any], fetch_status: FetchStatus, timeout: float = POLL_TIMEOUT_SECONDS) -> None:
+    delay = POLL_INITIAL_DELAY
+    deadline = time.monotonic() + timeout
+    while True:
+        await _renew_lease(job["job_id"])
+        await asyncio.sleep(delay)
+        job["attempts"] += 1
+        try:
+            status_code, body = await fetch_status(job["publish_id"])
+        except Exception as e:
+            status_code, body = None, {"error": str(e)}
+        if not isinstance(body, dict):
+            body = {"error": "status_fetch_failed"}
+
+        data = body.get("data") or {}
+        job["last_response"] = body
+        job["updated_at"] = utc_now()
+        if status_code == 200 and data.get("status"):
+            changed = data["status"] != job.get("tiktok_status")
+            job["tiktok_status"] = data["status"]
+            if data.get("fail_reason"):
+                job["fail_reason"] = data["fail_reason"]
+            if data["status"] in TERMINAL_STATUSES:
+                job["post_ids"] = _post_ids(body)
+                job["state"] = "failed" if data["status"] == "FAILED" else "done"
+                break
+            if changed:
+                _notify(job)
+                delay = POLL_INITIAL_DELAY
+                continue
+
+        if time.monotonic() >= deadline:
+            job["state"] = "timeout"
+            break
+        delay = min(delay * 2, POLL_MAX_DELAY)
+
+    job["finished_at"] = utc_now()
+    await _track_result(job)
+    await _send_webhook(job)
+    _notify(job)
+
+
+async def _traced_poll(job: Dict[str, Any], fetch_status: FetchStatus, timeout: float = POLL_TIMEOUT_SECONDS) -> None:
+    with tracing.span("publish_status_poll", publish_id=job["publish_id"], media_kind=job["kind"]) as span:
+        await _poll(job, fetch_status, timeout)
+        span.set(state=job.get("state"), attempts=job.get("attempts"))
+
+
+def _start_poll(job: Dict[str, Any], fetch_status: FetchStatus, timeout: float = POLL_TIMEOUT_SECONDS) -> None:
+    publish_id = job["job_id"]
+    # The poll outlives the request, so it runs as its own trace instead of under the request span.
+    _tasks[publish_id] = asyncio.create_task(_traced_poll(job, fetch_status, timeout), context=tracing.detached_context())
+    _tasks[publish_id].add_done_callback(lambda _t, jid=publish_id: _tasks.pop(jid, None))
+
+
+def start_job(publish_id: str, kind: str, fetch_status: FetchStatus, payload: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    يسجل عملية نشر ويبدأ متابعة status/fetch في الخلفية حتى حالة نهائية
+    """
+    payload = payload or {}
+    job = {
+        "job_id": publish_id,
+        "publish_id": publish_id,
+        "kind": kind,
+        "state": "polling",
+        "tiktok_status": None,
+        "post_ids": [],
+        "attempts": 0,
+        "created_at": utc_now(),
+        "updated_at": utc_now(),
+        "webhook_url": payload.get("webhook_url"),
+        "_track": {
+            k: payload.get(k)
+            for k in ("product_id", "category", "country", "short_title", "source_mode", "tracked_url", "destination_url")
+            if payload.get(k)
+        },
+    }
+    JOBS[publish_id] = job
+    _share(job)
+    _prune_jobs()
+    _start_poll(job, fetch_status)
+    return job_snapshot(job)
+
+
+def _orphaned_jobs() -> List[Dict[str, Any]]:
+    out = []
+    for _, raw in shared_state.items_sync("publish_job:"):
+        try:
+            job = json.loads(raw)
+        except ValueError:
+            continue
+        if job.get("state") != "polling" or job.get("job_id") in JOBS:
+            continue
+        # set-if-absent: exactly one worker takes over a job whose lease lapsed
+        if shared_state.claim_once_sync(f"publish_job_lease:{job['job_id']}", JOB_LEASE_SECONDS):
+            out.append(job)
+    return out
+
+
+async def resume_jobs(fetch_status: FetchStatus) -> int:
+    """
+    يستأنف متابعة الوظائف التي بقيت "polling" في المخزن المشترك بعد إعادة تشغيل أو موت العامل المالك
+    """
+    resumed = 0
+    for snap in await asyncio.to_thread(_orphaned_jobs):
+        try:
+            started = calendar.timegm(time.strptime(snap.get("created_at") or "", "%Y-%m-%dT%H:%M:%SZ"))
+        except ValueError:
+            started = time.time()
+        job = {**snap, "_track": snap.get("_track") or {}}
+        JOBS[job["job_id"]] = job
+        # Past the original deadline it still gets one last status check before timing out.
+        _start_poll(job, fetch_status, max(started + POLL_TIMEOUT_SECONDS - time.time(), POLL_INITIAL_DELAY))
+        resumed += 1
+    _prune_jobs()
+    return resumed
+
+
+async def _resume_loop(fetch_status: FetchStatus) -> None:
+    while True:
+        try:
+            await resume_jobs(fetch_status)
+        except Exception:
+            pass
+        await asyncio.sleep(JOB_LEASE_SECONDS)
+
+
+def start_resumer(fetch_status: FetchStatus) -> None:
+    global _resumer
+    if _resumer is None or _resumer.done():
+        _resumer = asyncio.create_task(_resume_loop(fetch_status))
+
+
+async def stop_resumer() -> None:
+    global _resumer
+    if _resumer is not None:
+        _resumer.cancel()
+        try:
+            await _resumer
+        except (asyncio.CancelledError, Exception):
+            pass
+        _resumer = None
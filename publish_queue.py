@@ -0,0 +1,359 @@
+import os
+import time
+import uuid
+import asyncio
+import calendar
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from persistence import atomic_write_json, load_json
+from shared_state import shared_lock
+
+PUBLISH_QUEUE_PATH = Path(os.environ.get("PUBLISH_QUEUE_PATH", "publish_queue.json"))
+PUBLISH_QUEUE_CONCURRENCY = int(os.environ.get("PUBLISH_QUEUE_CONCURRENCY", "2"))
+PUBLISH_QUEUE_TICK_SECONDS = float(os.environ.get("PUBLISH_QUEUE_TICK_SECONDS", "5"))
+PUBLISH_QUEUE_MAX_ATTEMPTS = int(os.environ.get("PUBLISH_QUEUE_MAX_ATTEMPTS", "3"))
+PUBLISH_QUEUE_SPACING_SECONDS = int(os.environ.get("PUBLISH_QUEUE_SPACING_SECONDS", str(10 * 60)))
+# TikTok caps direct posts per creator per day; keep a margin under it.
+TIKTOK_DAILY_POST_QUOTA = int(os.environ.get("TIKTOK_DAILY_POST_QUOTA", "15"))
+QUOTA_WINDOW_SECONDS = 24 * 3600
+# Finished jobs are dropped after this long; the file is rewritten on every tick, so it must stay bounded.
+PUBLISH_QUEUE_KEEP_SECONDS = int(os.environ.get("PUBLISH_QUEUE_KEEP_SECONDS", str(24 * 3600)))
+# A running job whose lease is not refreshed (worker died) goes back to pending.
+PUBLISH_QUEUE_LEASE_SECONDS = float(os.environ.get("PUBLISH_QUEUE_LEASE_SECONDS", "120"))
+WORKER_ID = f"{os.uname().nodename}:{os.getpid()}"
+DEFAULT_BEST_HOUR_UTC = 18
+FINISHED_STATUSES = ("done", "failed", "cancelled")
+
+QUEUE_SCHEMA_VERSION = 1
+
+# (kind, payload) -> (ok, result)
+Runner = Callable[[str, Dict[str, Any]], Awaitable[Tuple[bool, Dict[str, Any]]]]
+# () -> the account publishes actually go to (tokens.json open_id)
+AccountFn = Callable[[], str]
+
+_wakeup: Optional[asyncio.Event] = None
+_scheduler_task: Optional[asyncio.Task] = None
+_running: Dict[str, asyncio.Task] = {}
+
+
+def queue_lock():
+    return shared_lock("publish_queue")
+
+
+def utc_now() -> str:
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+
+
+def iso_from_ts(ts: float) -> str:
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(ts))
+
+
+def parse_publish_at(value: Any) -> Optional[float]:
+    if value in (None, ""):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    text = str(value).strip().replace("Z", "")
+    for fmt in ("%Y-%m-%dT%H:%M:%S", "%Y-%m-%dT%H:%M", "%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M"):
+        try:
+            return float(calendar.timegm(time.strptime(text, fmt)))
+        except ValueError:
+            continue
+    raise ValueError(f"Invalid publish_at: {value}")
+
+
+# ─────────────────────────────────────────────
+# Storage
+# ─────────────────────────────────────────────
+def default_queue() -> Dict[str, Any]:
+    return {"meta": {"schema_version": QUEUE_SCHEMA_VERSION, "updated_at": utc_now()}, "jobs": [], "published": []}
+
+
+def load_queue() -> Dict[str, Any]:
+    return load_json(
+        PUBLISH_QUEUE_PATH,
+        default_queue,
+        validate=lambda d: isinstance(d, dict) and isinstance(d.get("jobs"), list),
+    )
+
+
+def _finished_ts(job: Dict[str, Any]) -> float:
+    if job.get("finished_ts"):
+        return float(job["finished_ts"])
+    try:
+        return parse_publish_at(job.get("updated_at")) or 0.0
+    except ValueError:
+        return 0.0
+
+
+def save_queue(queue: Dict[str, Any]) -> None:
+    now = time.time()
+    queue["jobs"] = [
+        j for j in queue["jobs"]
+        if j.get("status") not in FINISHED_STATUSES or now - _finished_ts(j) < PUBLISH_QUEUE_KEEP_SECONDS
+    ]
+    queue["published"] = [p for p in queue.get("published") or [] if now - float(p.get("ts") or 0) < QUOTA_WINDOW_SECONDS]
+    queue.setdefault("meta", {})["updated_at"] = utc_now()
+    atomic_write_json(PUBLISH_QUEUE_PATH, queue)
+
+
+def find_job(queue: Dict[str, Any], job_id: str) -> Optional[Dict[str, Any]]:
+    for job in queue["jobs"]:
+        if job.get("id") == job_id:
+            return job
+    return None
+
+
+# ─────────────────────────────────────────────
+# Scheduling
+# ─────────────────────────────────────────────
+def best_posting_hour(platform: str = "tiktok") -> int:
+    try:
+        from analytics import analyze_best_posting_hours
+        hours = analyze_best_posting_hours(platform=platform)
+        if hours:
+            return int(hours[0]["hour"])
+    except Exception:
+        pass
+    return DEFAULT_BEST_HOUR_UTC
+
+
+def next_slot_at_hour(hour: int, now: Optional[float] = None) -> float:
+    now = time.time() if now is None else now
+    day_start = now - (now % 86400)
+    slot = day_start + hour * 3600
+    return slot if slot > now else slot + 86400
+
+
+def detect_kind(payload: Dict[str, Any]) -> Optional[str]:
+    if payload.get("kind") in ("video", "photo"):
+        return payload["kind"]
+    if payload.get("file_id") or payload.get("fileId") or payload.get("filepath") or payload.get("filePath"):
+        return "video"
+    if payload.get("photo_url") or payload.get("photo_images") or payload.get("url") or payload.get("source_info"):
+        return "photo"
+    return None
+
+
+def quota_next_free(queue: Dict[str, Any], account: str, now: float) -> Optional[float]:
+    """
+    None إذا بقي رصيد نشر للحساب خلال آخر 24 ساعة، وإلا وقت تحرر أقدم خانة
+    """
+    # "published" holds every post, direct or queued; running jobs reserve a slot until theirs lands.
+    # A job that already published but has not finished yet counts twice for a moment, which only errs early.
+    recent = [
+        float(p["ts"])
+        for p in queue.get("published") or []
+        if p.get("account") == account and now - float(p.get("ts") or 0) < QUOTA_WINDOW_SECONDS
+    ]
+    recent += [j["started_ts"] for j in queue["jobs"] if j.get("status") == "running" and j.get("started_ts")]
+    recent.sort()
+    if len(recent) < TIKTOK_DAILY_POST_QUOTA:
+        return None
+    return recent[len(recent) - TIKTOK_DAILY_POST_QUOTA] + QUOTA_WINDOW_SECONDS
+
+
+async def record_publish(account: str, publish_id: str) -> None:
+    """
+    يُستدعى بعد كل نشر ناجح، مباشر أو من الطابور، ليُحسب في رصيد الحساب الفعلي
+    """
+    async with queue_lock():
+        queue = load_queue()
+        queue.setdefault("published", []).append({"account": account, "publish_id": publish_id, "ts": time.time()})
+        save_queue(queue)
+
+
+async def enqueue(items: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    now = time.time()
+    created, errors = [], []
+    default_slot = None
+    defaulted = 0
+
+    for i, payload in enumerate(items):
+        if not isinstance(payload, dict):
+            errors.append({"index": i, "error": "job must be an object"})
+            continue
+        kind = detect_kind(payload)
+        if not kind:
+            errors.append({"index": i, "error": "Missing file_id/filepath or photo_url"})
+            continue
+        try:
+            publish_ts = parse_publish_at(payload.get("publish_at"))
+        except ValueError as e:
+            errors.append({"index": i, "error": str(e)})
+            continue
+        if publish_ts is None:
+            if default_slot is None:
+                # A full analytics pass; it must not block the event loop.
+                default_slot = next_slot_at_hour(await asyncio.to_thread(best_posting_hour, "tiktok"), now)
+            publish_ts = default_slot + defaulted * PUBLISH_QUEUE_SPACING_SECONDS
+            defaulted += 1
+
+        job_id = str(uuid.uuid4())
+        job_payload = {k: v for k, v in payload.items() if k not in ("publish_at", "kind", "account")}
+        # يضمن ألا تنشئ إعادة تشغيل المهمة بعد انقطاع منشورًا مكررًا
+        job_payload.setdefault("idempotency_key", f"queue:{job_id}")
+        created.append({
+            "id": job_id,
+            "kind": kind,
+            "payload": job_payload,
+            "publish_at": iso_from_ts(publish_ts),
+            "publish_ts": publish_ts,
+            "status": "pending",
+            "attempts": 0,
+            "created_at": utc_now(),
+            "updated_at": utc_now(),
+        })
+
+    if created:
+        async with queue_lock():
+            queue = load_queue()
+            queue["jobs"].extend(created)
+            save_queue(queue)
+        wake()
+    return created, errors
+
+
+async def cancel(job_id: str) -> Optional[Dict[str, Any]]:
+    async with queue_lock():
+        queue = load_queue()
+        job = find_job(queue, job_id)
+        if not job or job["status"] != "pending":
+            return job
+        job["status"] = "cancelled"
+        job["finished_ts"] = time.time()
+        job["updated_at"] = utc_now()
+        save_queue(queue)
+        return job
+
+
+def list_jobs(status: Optional[str] = None) -> List[Dict[str, Any]]:
+    jobs = load_queue()["jobs"]
+    if status:
+        jobs = [j for j in jobs if j.get("status") == status]
+    return jobs
+
+
+async def _run_job(job_id: str, runner: Runner) -> None:
+    async with queue_lock():
+        queue = load_queue()
+        job = find_job(queue, job_id)
+        if not job or job["status"] != "running" or job.get("worker") != WORKER_ID:
+            return
+        kind, payload = job["kind"], dict(job["payload"])
+
+    try:
+        ok, result = await runner(kind, payload)
+    except Exception as e:
+        ok, result = False, {"error": str(e)}
+
+    async with queue_lock():
+        queue = load_queue()
+        job = find_job(queue, job_id)
+        if not job:
+            return
+        job["attempts"] = int(job.get("attempts") or 0) + 1
+        job["updated_at"] = utc_now()
+        if ok:
+            job["status"] = "done"
+            job["finished_ts"] = time.time()
+            job["publish_id"] = result.get("publish_id")
+            job["result"] = {"publish_id": result.get("publish_id"), "job": result.get("job")}
+            job.pop("error", None)
+        elif job["attempts"] >= PUBLISH_QUEUE_MAX_ATTEMPTS:
+            job["status"] = "failed"
+            job["finished_ts"] = time.time()
+            job["error"] = result
+        else:
+            job["status"] = "pending"
+            job["started_ts"] = None
+            job["error"] = result
+            job["publish_ts"] = time.time() + 60 * (2 ** job["attempts"])
+            job["publish_at"] = iso_from_ts(job["publish_ts"])
+        save_queue(queue)
+
+
+async def _dispatch_due(runner: Runner, account: AccountFn) -> None:
+    current_account = await asyncio.to_thread(account)
+    now = time.time()
+    async with queue_lock():
+        queue = load_queue()
+        changed = False
+
+        for job in queue["jobs"]:
+            if job.get("status") != "running":
+                continue
+            if job.get("id") in _running:
+                job["lease_until"] = now + PUBLISH_QUEUE_LEASE_SECONDS
+                changed = True
+            elif float(job.get("lease_until") or 0) < now:
+                job["status"] = "pending"
+                job["started_ts"] = None
+                job["worker"] = None
+                job["updated_at"] = utc_now()
+                changed = True
+
+        # التزامن محسوب على كل العمال معًا لأن الحالة في ملف مشترك
+        free = PUBLISH_QUEUE_CONCURRENCY - sum(1 for j in queue["jobs"] if j.get("status") == "running")
+        for job in sorted(queue["jobs"], key=lambda j: j.get("publish_ts") or 0):
+            if free <= 0:
+                break
+            if job.get("status") != "pending" or (job.get("publish_ts") or 0) > now:
+                continue
+            next_free = quota_next_free(queue, current_account, now)
+            if next_free is not None:
+                job["publish_ts"] = next_free
+                job["publish_at"] = iso_from_ts(next_free)
+                job["deferred_reason"] = "daily_quota"
+                changed = True
+                continue
+            job["status"] = "running"
+            job["started_ts"] = now
+            job["worker"] = WORKER_ID
+            job["lease_until"] = now + PUBLISH_QUEUE_LEASE_SECONDS
+            job["updated_at"] = utc_now()
+            changed = True
+            free -= 1
+            task = asyncio.create_task(_run_job(job["id"], runner))
+            _running[job["id"]] = task
+            task.add_done_callback(lambda _t, jid=job["id"]: (_running.pop(jid, None), wake()))
+        if changed:
+            save_queue(queue)
+
+
+def wake() -> None:
+    if _wakeup is not None:
+        _wakeup.set()
+
+
+async def _scheduler_loop(runner: Runner, account: AccountFn) -> None:
+    while True:
+        try:
+            await _dispatch_due(runner, account)
+        except Exception:
+            pass
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=PUBLISH_QUEUE_TICK_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+        _wakeup.clear()
+
+
+def start_scheduler(runner: Runner, account: AccountFn) -> None:
+    global _wakeup, _scheduler_task
+    if _scheduler_task and not _scheduler_task.done():
+        return
+    _wakeup = asyncio.Event()
+    _scheduler_task = asyncio.create_task(_scheduler_loop(runner, account))
+
+
+async def stop_scheduler() -> None:
+    global _scheduler_task
+    if _scheduler_task:
+        _scheduler_task.cancel()
+        try:
+            await _scheduler_task
+        except (asyncio.CancelledError, Exception):
+            pass
+        _scheduler_task = None
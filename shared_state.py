@@ -0,0 +1,353 @@
+import os
+import time
+import uuid
+import random
+import sqlite3
+import asyncio
+import logging
+import threading
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, Dict, List, Optional, Tuple
+
+# sqlite:///shared_state.db (default) | redis://host:6379/0
+STATE_BACKEND_URL = os.environ.get("STATE_BACKEND_URL", "sqlite:///shared_state.db").strip()
+STATE_KEY_PREFIX = os.environ.get("STATE_KEY_PREFIX", "ouinoual:")
+LOCK_TTL_SECONDS = float(os.environ.get("STATE_LOCK_TTL", "30"))
+LOCK_WAIT_SECONDS = float(os.environ.get("STATE_LOCK_WAIT", "60"))
+
+logger = logging.getLogger("ouinoual.state")
+
+
+class LockTimeout(Exception):
+    pass
+
+
+class LockLost(Exception):
+    """
+    انتهت مهلة القفل في المخزن المشترك أثناء الحمل ولم يُمدَّد، فقد يكون عامل آخر دخل معه
+    """
+
+
+# ─────────────────────────────────────────────
+# Backends
+# ─────────────────────────────────────────────
+class SQLiteStateBackend:
+    """
+    مخزن مفاتيح مع TTL في SQLite (WAL) — يعمل بين عدة عمليات uvicorn على نفس الجهاز
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)"
+        )
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+        return conn
+
+    def set_nx(self, key: str, value: str, ttl: Optional[float]) -> bool:
+        now = time.time()
+        expires_at = now + ttl if ttl else None
+        cur = self._conn().execute(
+            "INSERT INTO kv (key, value, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at "
+            "WHERE kv.expires_at IS NOT NULL AND kv.expires_at <= ?",
+            (key, value, expires_at, now),
+        )
+        return cur.rowcount == 1
+
+    def set(self, key: str, value: str, ttl: Optional[float] = None) -> None:
+        expires_at = time.time() + ttl if ttl else None
+        self._conn().execute(
+            "INSERT INTO kv (key, value, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at",
+            (key, value, expires_at),
+        )
+
+    def get(self, key: str) -> Optional[str]:
+        row = self._conn().execute(
+            "SELECT value FROM kv WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (key, time.time()),
+        ).fetchone()
+        return row[0] if row else None
+
+    def delete(self, key: str) -> None:
+        self._conn().execute("DELETE FROM kv WHERE key = ?", (key,))
+
+    def items(self, prefix: str) -> List[Tuple[str, str]]:
+        rows = self._conn().execute(
+            "SELECT key, value FROM kv WHERE key >= ? AND key < ? AND (expires_at IS NULL OR expires_at > ?)",
+            (prefix, prefix + "\uffff", time.time()),
+        ).fetchall()
+        return [(key, value) for key, value in rows]
+
+    def delete_if(self, key: str, value: str) -> bool:
+        cur = self._conn().execute("DELETE FROM kv WHERE key = ? AND value = ?", (key, value))
+        return cur.rowcount == 1
+
+    def expire_if(self, key: str, value: str, ttl: float) -> bool:
+        cur = self._conn().execute(
+            "UPDATE kv SET expires_at = ? WHERE key = ? AND value = ?",
+            (time.time() + ttl, key, value),
+        )
+        return cur.rowcount == 1
+
+    def purge_expired(self) -> int:
+        cur = self._conn().execute("DELETE FROM kv WHERE expires_at IS NOT NULL AND expires_at <= ?", (time.time(),))
+        return cur.rowcount
+
+
+class RedisStateBackend:
+    """
+    يقبل أي عميل بواجهة redis-py (redis.Redis أو fakeredis.FakeRedis للاختبار المحلي)
+    """
+
+    def __init__(self, client: Any):
+        self.client = client
+
+    def set_nx(self, key: str, value: str, ttl: Optional[float]) -> bool:
+        px = int(ttl * 1000) if ttl else None
+        return bool(self.client.set(key, value, nx=True, px=px))
+
+    def set(self, key: str, value: str, ttl: Optional[float] = None) -> None:
+        px = int(ttl * 1000) if ttl else None
+        self.client.set(key, value, px=px)
+
+    def get(self, key: str) -> Optional[str]:
+        value = self.client.get(key)
+        if isinstance(value, bytes):
+            return value.decode("utf-8")
+        return value
+
+    def delete(self, key: str) -> None:
+        self.client.delete(key)
+
+    def items(self, prefix: str) -> List[Tuple[str, str]]:
+        out = []
+        for key in self.client.scan_iter(match=prefix + "*"):
+            key = key.decode("utf-8") if isinstance(key, bytes) else key
+            value = self.get(key)
+            if value is not None:
+                out.append((key, value))
+        return out
+
+    def _compare_and(self, key: str, value: str, action) -> bool:
+        # WATCH/MULTI instead of a Lua script so stand-ins without EVAL work too.
+        with self.client.pipeline() as pipe:
+            try:
+                pipe.watch(key)
+                current = pipe.get(key)
+                if isinstance(current, bytes):
+                    current = current.decode("utf-8")
+                if current != value:
+                    pipe.unwatch()
+                    return False
+                pipe.multi()
+                action(pipe)
+                pipe.execute()
+                return True
+            except Exception:
+                return False
+
+    def delete_if(self, key: str, value: str) -> bool:
+        return self._compare_and(key, value, lambda pipe: pipe.delete(key))
+
+    def expire_if(self, key: str, value: str, ttl: float) -> bool:
+        return self._compare_and(key, value, lambda pipe: pipe.pexpire(key, int(ttl * 1000)))
+
+    def purge_expired(self) -> int:
+        return 0
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def create_backend(url: str):
+    if url.startswith("redis://") or url.startswith("rediss://"):
+        import redis
+        return RedisStateBackend(redis.Redis.from_url(url))
+    if url.startswith("sqlite:///"):
+        return SQLiteStateBackend(url[len("sqlite:///"):] or "shared_state.db")
+    raise ValueError(f"Unsupported STATE_BACKEND_URL: {url}")
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = create_backend(STATE_BACKEND_URL)
+    return _backend
+
+
+def set_backend(backend) -> None:
+    global _backend
+    _backend = backend
+
+
+def _key(name: str) -> str:
+    return STATE_KEY_PREFIX + name
+
+
+# ─────────────────────────────────────────────
+# Key store
+# ─────────────────────────────────────────────
+def claim_once_sync(name: str, ttl: float) -> bool:
+    return get_backend().set_nx(_key(name), str(time.time()), ttl)
+
+
+async def claim_once(name: str, ttl: float) -> bool:
+    """
+    True لأول عملية تطالب بالمفتاح خلال ttl، وFalse لكل تكرار بعدها (في أي worker)
+    """
+    return await asyncio.to_thread(claim_once_sync, name, ttl)
+
+
+def put_sync(name: str, value: str, ttl: Optional[float] = None) -> None:
+    get_backend().set(_key(name), value, ttl)
+
+
+def get_sync(name: str) -> Optional[str]:
+    return get_backend().get(_key(name))
+
+
+def items_sync(prefix: str) -> List[Tuple[str, str]]:
+    """
+    كل المفاتيح السارية التي تبدأ بـ prefix: [(الاسم بدون STATE_KEY_PREFIX، القيمة)]
+    """
+    return [(key[len(STATE_KEY_PREFIX):], value) for key, value in get_backend().items(_key(prefix))]
+
+
+async def put(name: str, value: str, ttl: Optional[float] = None) -> None:
+    await asyncio.to_thread(put_sync, name, value, ttl)
+
+
+async def get(name: str) -> Optional[str]:
+    return await asyncio.to_thread(get_sync, name)
+
+
+# ─────────────────────────────────────────────
+# Locks
+# ─────────────────────────────────────────────
+# name -> [lock, holders + waiters]; an entry is dropped when its count returns to zero,
+# so per-key names (idempotency:<key>) do not accumulate for the life of the process.
+_local_locks: Dict[str, list] = {}
+_local_thread_locks: Dict[str, list] = {}
+_local_registry_guard = threading.Lock()
+
+
+@contextmanager
+def _local_lock(table: Dict[str, list], name: str, factory):
+    with _local_registry_guard:
+        entry = table.get(name)
+        if entry is None:
+            entry = table[name] = [factory(), 0]
+        entry[1] += 1
+    try:
+        yield entry[0]
+    finally:
+        with _local_registry_guard:
+            entry[1] -= 1
+            if entry[1] == 0 and table.get(name) is entry:
+                del table[name]
+
+
+def _acquire_sync(name: str, token: str, ttl: float, wait: float) -> bool:
+    backend = get_backend()
+    deadline = time.monotonic() + wait
+    delay = 0.005
+    while True:
+        if backend.set_nx(_key("lock:" + name), token, ttl):
+            return True
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(delay + random.random() * delay)
+        delay = min(delay * 2, 0.1)
+
+
+def _release_sync(name: str, token: str) -> None:
+    get_backend().delete_if(_key("lock:" + name), token)
+
+
+def _extend_sync(name: str, token: str, ttl: float) -> Optional[bool]:
+    # None = the backend could not be reached; the next beat retries before the TTL runs out.
+    try:
+        return get_backend().expire_if(_key("lock:" + name), token, ttl)
+    except Exception:
+        return None
+
+
+def _lock_lost(name: str, lost: list) -> None:
+    lost.append(True)
+    logger.error("shared lock %r expired while held; mutual exclusion is no longer guaranteed", name)
+
+
+def _heartbeat_thread(name: str, token: str, ttl: float, stop: threading.Event, lost: list) -> None:
+    while not stop.wait(ttl / 3):
+        if _extend_sync(name, token, ttl) is False:
+            _lock_lost(name, lost)
+            return
+
+
+async def _heartbeat(name: str, token: str, ttl: float, lost: list) -> None:
+    while True:
+        await asyncio.sleep(ttl / 3)
+        if await asyncio.to_thread(_extend_sync, name, token, ttl) is False:
+            _lock_lost(name, lost)
+            return
+
+
+@contextmanager
+def shared_lock_sync(name: str, ttl: float = LOCK_TTL_SECONDS, wait: float = LOCK_WAIT_SECONDS):
+    with _local_lock(_local_thread_locks, name, threading.Lock) as thread_lock, thread_lock:
+        token = uuid.uuid4().hex
+        if not _acquire_sync(name, token, ttl, wait):
+            raise LockTimeout(name)
+        stop, lost = threading.Event(), []
+        beat = threading.Thread(target=_heartbeat_thread, args=(name, token, ttl, stop, lost), daemon=True)
+        beat.start()
+        try:
+            yield token
+        finally:
+            stop.set()
+            beat.join()
+            _release_sync(name, token)
+        if lost:
+            raise LockLost(name)
+
+
+@asynccontextmanager
+async def shared_lock(name: str, ttl: float = LOCK_TTL_SECONDS, wait: float = LOCK_WAIT_SECONDS):
+    """
+    قفل عبر العمليات: asyncio.Lock داخل العملية + مفتاح NX بمهلة ttl في المخزن المشترك
+    نبضة كل ttl/3 تمدد المفتاح ما دام محمولًا، والمهلة تحرره تلقائيًا إن ماتت العملية الحاملة له
+    إن ضاع المفتاح رغم ذلك يُسجَّل خطأ ويرفع الخروج من القفل LockLost
+    """
+    with _local_lock(_local_locks, name, asyncio.Lock) as local:
+        async with local:
+            token = uuid.uuid4().hex
+            acquired = await asyncio.to_thread(_acquire_sync, name, token, ttl, wait)
+            if not acquired:
+                raise LockTimeout(name)
+            lost: list = []
+            beat = asyncio.create_task(_heartbeat(name, token, ttl, lost))
+            try:
+                yield token
+            finally:
+                beat.cancel()
+                await asyncio.to_thread(_release_sync, name, token)
+            if lost:
+                raise LockLost(name)
+
+
+async def extend_lock(name: str, token: str, ttl: float = LOCK_TTL_SECONDS) -> bool:
+    return await asyncio.to_thread(get_backend().expire_if, _key("lock:" + name), token, ttl)
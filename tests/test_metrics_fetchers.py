@@ -0,0 +1,178 @@
+import json
+import asyncio
+from urllib.parse import parse_qs
+
+import httpx
+import pytest
+
+import metrics_fetchers as mf
+
+
+def graph_item(body, code=200):
+    return {"code": code, "headers": [], "body": json.dumps(body)}
+
+
+def facebook_body(post_id, n):
+    return {
+        "id": post_id,
+        "shares": {"count": n},
+        "reactions": {"data": [], "summary": {"total_count": n * 10}},
+        "comments": {"data": [], "summary": {"total_count": n * 2}},
+        "insights": {"data": [
+            {"name": "post_impressions", "period": "lifetime", "values": [{"value": n * 1000}]},
+            {"name": "post_impressions_unique", "period": "lifetime", "values": [{"value": n * 800}]},
+            {"name": "post_clicks", "period": "lifetime", "values": [{"value": n * 7}]},
+        ]},
+    }
+
+
+def instagram_body(post_id, n):
+    return {
+        "id": post_id,
+        "like_count": n * 10,
+        "comments_count": n * 2,
+        "insights": {"data": [
+            {"name": "impressions", "total_value": {"value": n * 1000}},
+            {"name": "reach", "total_value": {"value": n * 800}},
+            {"name": "saved", "total_value": {"value": n * 3}},
+            {"name": "shares", "total_value": {"value": n}},
+        ]},
+    }
+
+
+class GraphMock:
+    """
+    Graph batch endpoint: answers every sub-request from `items` by post id, in request order
+    """
+
+    def __init__(self, items=None, status=200, top_level=None):
+        self.items = items or {}
+        self.status = status
+        self.top_level = top_level
+        self.batches = []
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        form = parse_qs(request.content.decode())
+        batch = json.loads(form["batch"][0])
+        self.batches.append({"token": form["access_token"][0], "batch": batch})
+        if self.top_level is not None:
+            return httpx.Response(self.status, json=self.top_level)
+        out = []
+        for sub in batch:
+            post_id = sub["relative_url"].split("?")[0]
+            out.append(self.items.get(post_id))
+        return httpx.Response(self.status, json=out)
+
+
+@pytest.fixture
+def graph(monkeypatch):
+    monkeypatch.setattr(mf, "FACEBOOK_PAGE_ACCESS_TOKEN", "fb-token")
+    monkeypatch.setattr(mf, "INSTAGRAM_ACCESS_TOKEN", "ig-token")
+
+    def install(mock):
+        client = httpx.AsyncClient(transport=httpx.MockTransport(mock))
+        monkeypatch.setattr(mf, "shared_client", lambda: client)
+        return mock
+
+    return install
+
+
+def run(fetcher_cls, rows):
+    return asyncio.run(fetcher_cls(mf.RateLimiter(0)).fetch_batch(rows))
+
+
+def rows(*post_ids):
+    return [{"platform_post_id": post_id} for post_id in post_ids]
+
+
+def test_facebook_results_follow_row_order(graph):
+    mock = graph(GraphMock({
+        "p1": graph_item(facebook_body("p1", 1)),
+        "p2": graph_item(facebook_body("p2", 2)),
+        "p3": graph_item(facebook_body("p3", 3)),
+    }))
+    out = run(mf.FacebookFetcher, rows("p3", "p1", "p2"))
+
+    assert [m["shares"] for m in out] == [3, 1, 2]
+    assert out[0] == {
+        "impressions": 3000,
+        "reach": 2400,
+        "clicks": 21,
+        "reactions": 30,
+        "comments": 6,
+        "shares": 3,
+        "metrics_source": "facebook_graph",
+    }
+    assert len(mock.batches) == 1
+    assert mock.batches[0]["token"] == "fb-token"
+    assert all("post_impressions" in sub["relative_url"] for sub in mock.batches[0]["batch"])
+
+
+def test_instagram_parses_its_own_fields(graph):
+    mock = graph(GraphMock({"m1": graph_item(instagram_body("m1", 2))}))
+    out = run(mf.InstagramFetcher, rows("m1"))
+
+    assert out == [{
+        "impressions": 2000,
+        "reach": 1600,
+        "saved": 6,
+        "shares": 2,
+        "likes": 20,
+        "comments": 4,
+        "metrics_source": "instagram_graph",
+    }]
+    assert mock.batches[0]["token"] == "ig-token"
+    assert "like_count" in mock.batches[0]["batch"][0]["relative_url"]
+    assert "post_impressions" not in mock.batches[0]["batch"][0]["relative_url"]
+
+
+def test_missing_ids_null_items_and_item_errors_stay_aligned(graph):
+    graph(GraphMock({
+        "p1": graph_item(facebook_body("p1", 1)),
+        # p2 -> null: the sub-request timed out inside the batch
+        "p3": graph_item({"error": {"message": "Unsupported get request", "code": 100}}, code=400),
+        "p4": graph_item({"error": {"message": "User request limit reached", "code": 17}}, code=429),
+        "p5": graph_item(facebook_body("p5", 5)),
+    }))
+    out = run(mf.FacebookFetcher, rows("p1", "", "p2", "p3", "p4", "p5"))
+
+    assert out[0]["shares"] == 1
+    assert out[1]["metrics_error"] == "invalid_post_id"
+    assert out[2]["metrics_error"] == "batch_item_timeout"
+    assert out[3]["metrics_error"] == "Unsupported get request"
+    assert out[4]["metrics_error"] == "User request limit reached"
+    assert out[5]["shares"] == 5
+    assert all(m["metrics_source"] == "facebook_graph" for m in out)
+
+
+def test_item_error_without_body_reports_http_code(graph):
+    graph(GraphMock({"p1": {"code": 500, "headers": [], "body": ""}}))
+    out = run(mf.FacebookFetcher, rows("p1"))
+    assert out[0]["metrics_error"] == "http_500"
+
+
+def test_rate_limited_batch_fails_every_row(graph):
+    graph(GraphMock(status=429, top_level={"error": {"message": "Application request limit reached", "code": 4}}))
+    out = run(mf.InstagramFetcher, rows("m1", "m2"))
+    assert [m["metrics_error"] for m in out] == ["Application request limit reached"] * 2
+
+
+def test_non_json_response_fails_every_row(graph):
+    graph(lambda request: httpx.Response(502, text="<html>Bad Gateway</html>"))
+    out = run(mf.FacebookFetcher, rows("p1", "p2"))
+    assert len(out) == 2
+    assert all(m.get("metrics_error") for m in out)
+
+
+def test_missing_token_skips_the_request(graph, monkeypatch):
+    mock = graph(GraphMock())
+    monkeypatch.setattr(mf, "FACEBOOK_PAGE_ACCESS_TOKEN", "")
+    out = run(mf.FacebookFetcher, rows("p1"))
+    assert out[0]["metrics_error"] == "missing_token_or_post_id"
+    assert mock.batches == []
+
+
+def test_fetchers_are_registered_for_both_platforms():
+    assert isinstance(mf.get_fetcher("facebook"), mf.FacebookFetcher)
+    assert isinstance(mf.get_fetcher("Instagram"), mf.InstagramFetcher)
+    assert mf.get_fetcher("facebook").batch_size == mf.GRAPH_BATCH_LIMIT
@@ -0,0 +1,98 @@
+import time
+import asyncio
+
+import pytest
+
+import shared_state
+from loadtest.fake_redis import FakeRedis
+
+
+@pytest.fixture
+def redis_backend():
+    previous = shared_state._backend
+    client = FakeRedis()
+    shared_state.set_backend(shared_state.RedisStateBackend(client))
+    yield client
+    shared_state.set_backend(previous)
+
+
+def lock_key(name):
+    return shared_state._key("lock:" + name)
+
+
+def test_put_get_and_ttl(redis_backend):
+    shared_state.put_sync("a", "1")
+    shared_state.put_sync("b", "2", ttl=0.05)
+    assert shared_state.get_sync("a") == "1"
+    assert shared_state.get_sync("b") == "2"
+    time.sleep(0.1)
+    assert shared_state.get_sync("b") is None
+
+
+def test_claim_once(redis_backend):
+    assert shared_state.claim_once_sync("event:1", 60)
+    assert not shared_state.claim_once_sync("event:1", 60)
+    assert shared_state.claim_once_sync("event:2", 60)
+
+
+def test_compare_and_delete_or_expire(redis_backend):
+    backend = shared_state.get_backend()
+    backend.set("k", "mine", 60)
+    assert not backend.delete_if("k", "theirs")
+    assert not backend.expire_if("k", "theirs", 1)
+    assert backend.expire_if("k", "mine", 120)
+    assert redis_backend.pttl("k") > 60_000
+    assert backend.delete_if("k", "mine")
+    assert backend.get("k") is None
+
+
+def test_items_by_prefix(redis_backend):
+    shared_state.put_sync("publish_job:1", "x")
+    shared_state.put_sync("publish_job:2", "y")
+    shared_state.put_sync("other:1", "z")
+    assert sorted(shared_state.items_sync("publish_job:")) == [("publish_job:1", "x"), ("publish_job:2", "y")]
+
+
+def test_acquire_is_exclusive_across_tokens(redis_backend):
+    assert shared_state._acquire_sync("res", "w1", 60, 0)
+    assert not shared_state._acquire_sync("res", "w2", 60, 0)
+    shared_state._release_sync("res", "w2")
+    assert shared_state.get_backend().get(lock_key("res")) == "w1"
+    shared_state._release_sync("res", "w1")
+    assert shared_state._acquire_sync("res", "w2", 60, 0)
+
+
+def test_async_lock_is_renewed_past_its_ttl(redis_backend):
+    async def main():
+        async with shared_state.shared_lock("long", ttl=0.3) as token:
+            await asyncio.sleep(1.0)
+            # Another worker (another token) still cannot take it.
+            assert not shared_state._acquire_sync("long", "other", 0.3, 0)
+            assert shared_state.get_backend().get(lock_key("long")) == token
+        assert shared_state.get_backend().get(lock_key("long")) is None
+
+    asyncio.run(main())
+
+
+def test_async_lock_reports_lost_ownership(redis_backend):
+    async def main():
+        async with shared_state.shared_lock("stolen", ttl=0.3):
+            # The key expired and another worker took it.
+            shared_state.get_backend().set(lock_key("stolen"), "other", 60)
+            await asyncio.sleep(0.3)
+
+    with pytest.raises(shared_state.LockLost):
+        asyncio.run(main())
+    # The other worker's lock is left alone.
+    assert shared_state.get_backend().get(lock_key("stolen")) == "other"
+
+
+def test_sync_lock_is_renewed_and_reports_loss(redis_backend):
+    with shared_state.shared_lock_sync("sync", ttl=0.3):
+        time.sleep(1.0)
+        assert not shared_state._acquire_sync("sync", "other", 0.3, 0)
+
+    with pytest.raises(shared_state.LockLost):
+        with shared_state.shared_lock_sync("sync", ttl=0.3):
+            shared_state.get_backend().delete(lock_key("sync"))
+            time.sleep(0.3)
@@ -0,0 +1,309 @@
+import os
+import json
+import time
+import random
+import asyncio
+import logging
+import contextvars
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+TRACE_EXPORT_DIR = os.environ.get("TRACE_EXPORT_DIR", "").strip()
+# Only traces at least this long are written/logged; 0 keeps every traced flow.
+TRACE_EXPORT_MIN_MS = float(os.environ.get("TRACE_EXPORT_MIN_MS", "0"))
+TRACE_SERVICE_NAME = os.environ.get("TRACE_SERVICE_NAME", "ouinoual")
+TRACE_MAX_SPANS = int(os.environ.get("TRACE_MAX_SPANS", "500"))
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+
+# OTLP enums
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+STATUS_UNSET = 0
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+logger = logging.getLogger("ouinoual.trace")
+
+_current: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("ouinoual_span", default=None)
+
+
+def _new_id(nbytes: int) -> str:
+    return f"{random.getrandbits(nbytes * 8):0{nbytes * 2}x}"
+
+
+class Trace:
+    def __init__(self, trace_id: Optional[str] = None):
+        self.trace_id = trace_id or _new_id(16)
+        self.spans: List["Span"] = []
+        self.dropped = 0
+
+    def add(self, span: "Span") -> None:
+        if len(self.spans) < TRACE_MAX_SPANS:
+            self.spans.append(span)
+        else:
+            self.dropped += 1
+
+
+class Span:
+    __slots__ = ("trace", "name", "span_id", "parent_id", "kind", "start_ns", "end_ns", "attributes", "status", "message")
+
+    def __init__(self, trace: Trace, name: str, parent_id: Optional[str] = None, *, kind: int = SPAN_KIND_INTERNAL, **attributes):
+        # "kind" is the OTLP SpanKind enum, not a free attribute name.
+        if not isinstance(kind, int) or isinstance(kind, bool):
+            raise TypeError(f"span kind must be an OTLP SpanKind int, got {kind!r}")
+        self.trace = trace
+        self.name = name
+        self.span_id = _new_id(8)
+        self.parent_id = parent_id
+        self.kind = kind
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.attributes: Dict[str, Any] = {k: v for k, v in attributes.items() if v is not None}
+        self.status = STATUS_UNSET
+        self.message = ""
+
+    def set(self, **attributes) -> None:
+        self.attributes.update({k: v for k, v in attributes.items() if v is not None})
+
+    def fail(self, message: str) -> None:
+        self.status = STATUS_ERROR
+        self.message = message[:500]
+
+    @property
+    def duration_ms(self) -> float:
+        end = self.end_ns if self.end_ns is not None else time.time_ns()
+        return (end - self.start_ns) / 1e6
+
+
+def current_span() -> Optional[Span]:
+    return _current.get()
+
+
+def current_trace_id() -> Optional[str]:
+    span = _current.get()
+    return span.trace.trace_id if span else None
+
+
+@contextmanager
+def span(name: str, **attributes) -> Iterator[Span]:
+    """
+    span فرعي للـ span النشط، أو جذر لتتبع جديد إن لم يوجد (مهام الخلفية مثلًا)
+    يعمل في الدوال المتزامنة وغير المتزامنة لأن الحالة في contextvars
+    """
+    parent = _current.get()
+    if parent is None:
+        with root_span(name, **attributes) as s:
+            yield s
+        return
+    s = Span(parent.trace, name, parent.span_id, **attributes)
+    parent.trace.add(s)
+    token = _current.set(s)
+    try:
+        yield s
+    except BaseException as e:
+        s.fail(str(e) or type(e).__name__)
+        raise
+    finally:
+        s.end_ns = time.time_ns()
+        _current.reset(token)
+
+
+@contextmanager
+def root_span(name: str, traceparent: Optional[str] = None, *, kind: int = SPAN_KIND_INTERNAL, **attributes) -> Iterator[Span]:
+    trace_id, parent_id = parse_traceparent(traceparent)
+    trace = Trace(trace_id)
+    s = Span(trace, name, parent_id, kind=kind, **attributes)
+    trace.add(s)
+    token = _current.set(s)
+    try:
+        yield s
+    except BaseException as e:
+        s.fail(str(e) or type(e).__name__)
+        raise
+    finally:
+        s.end_ns = time.time_ns()
+        # finish() logs while the root is still current, so the line carries its trace_id.
+        finish(s)
+        _current.reset(token)
+
+
+def parse_traceparent(value: Optional[str]):
+    """
+    W3C traceparent: 00-<trace_id 32 hex>-<parent_id 16 hex>-<flags>
+    """
+    parts = (value or "").strip().split("-")
+    if len(parts) == 4 and len(parts[1]) == 32 and len(parts[2]) == 16:
+        try:
+            int(parts[1], 16), int(parts[2], 16)
+        except ValueError:
+            return None, None
+        if parts[1] != "0" * 32:
+            return parts[1], parts[2]
+    return None, None
+
+
+def detached_context() -> contextvars.Context:
+    """
+    سياق بلا span نشط لمهام خلفية تعيش بعد انتهاء الطلب، فتبدأ تتبعًا خاصًا بها
+    """
+    ctx = contextvars.copy_context()
+    ctx.run(_current.set, None)
+    return ctx
+
+
+def timings(trace_span: Optional[Span] = None) -> Dict[str, Any]:
+    """
+    ملخص المراحل حتى الآن: المدة الإجمالية لكل اسم span (المراحل المتكررة كرفع الأجزاء تُجمع)
+    """
+    s = trace_span or _current.get()
+    if s is None:
+        return {}
+    root = s.trace.spans[0]
+    stages: Dict[str, float] = {}
+    counts: Dict[str, int] = {}
+    for child in s.trace.spans[1:]:
+        if child.end_ns is None:
+            continue
+        stages[child.name] = round(stages.get(child.name, 0.0) + child.duration_ms, 2)
+        counts[child.name] = counts.get(child.name, 0) + 1
+    out = {"trace_id": s.trace.trace_id, "total_ms": round(root.duration_ms, 2), "stages": stages}
+    repeated = {name: n for name, n in counts.items() if n > 1}
+    if repeated:
+        out["counts"] = repeated
+    return out
+
+
+# ─────────────────────────────────────────────
+# Export
+# ─────────────────────────────────────────────
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_attributes(attributes: Dict[str, Any]) -> List[Dict[str, Any]]:
+    return [{"key": k, "value": _otlp_value(v)} for k, v in attributes.items()]
+
+
+def to_otlp(trace: Trace) -> Dict[str, Any]:
+    """
+    صيغة OTLP/JSON (ExportTraceServiceRequest) — يقرؤها OTel Collector عبر filelog/otlpjsonfile
+    """
+    spans = []
+    for s in trace.spans:
+        item = {
+            "traceId": trace.trace_id,
+            "spanId": s.span_id,
+            "name": s.name,
+            "kind": s.kind,
+            "startTimeUnixNano": str(s.start_ns),
+            "endTimeUnixNano": str(s.end_ns or s.start_ns),
+            "attributes": _otlp_attributes(s.attributes),
+            "status": {"code": s.status, **({"message": s.message} if s.message else {})},
+        }
+        if s.parent_id:
+            item["parentSpanId"] = s.parent_id
+        spans.append(item)
+    return {"resourceSpans": [{
+        "resource": {"attributes": _otlp_attributes({"service.name": TRACE_SERVICE_NAME})},
+        "scopeSpans": [{"scope": {"name": "ouinoual.tracing"}, "spans": spans}],
+    }]}
+
+
+def _write_export(trace: Trace) -> None:
+    folder = Path(TRACE_EXPORT_DIR) / time.strftime("%Y%m%d", time.gmtime())
+    try:
+        folder.mkdir(parents=True, exist_ok=True)
+        # An incoming traceparent can reuse a trace_id across requests, so the root span id is part of the name.
+        (folder / f"{trace.trace_id}-{trace.spans[0].span_id}.json").write_text(json.dumps(to_otlp(trace), ensure_ascii=False), encoding="utf-8")
+    except OSError as e:
+        logger.warning("trace export failed: %s", e)
+
+
+def finish(root: Span) -> None:
+    trace = root.trace
+    # Request spans with no stages (health checks, static files) are not worth a line or a file.
+    if len(trace.spans) < 2 or root.duration_ms < TRACE_EXPORT_MIN_MS:
+        return
+    if logger.isEnabledFor(logging.INFO):
+        summary = timings(root)
+        stages = " ".join(f"{name}={ms}ms" for name, ms in summary["stages"].items())
+        logger.info("%s %.1fms %s", root.name, summary["total_ms"], stages)
+    if not TRACE_EXPORT_DIR:
+        return
+    try:
+        asyncio.get_running_loop().run_in_executor(None, _write_export, trace)
+    except RuntimeError:
+        _write_export(trace)
+
+
+# ─────────────────────────────────────────────
+# Logging
+# ─────────────────────────────────────────────
+_base_factory = logging.getLogRecordFactory()
+
+
+def _record_factory(*args, **kwargs) -> logging.LogRecord:
+    record = _base_factory(*args, **kwargs)
+    s = _current.get()
+    record.trace_id = s.trace.trace_id if s else "-"
+    record.span_id = s.span_id if s else "-"
+    return record
+
+
+def install_logging() -> None:
+    """
+    كل سجل (بما فيها سجلات uvicorn والمكتبات) يحمل trace_id/span_id للطلب الجاري
+    """
+    if logging.getLogRecordFactory() is not _record_factory:
+        logging.setLogRecordFactory(_record_factory)
+    app_logger = logging.getLogger("ouinoual")
+    if not app_logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s trace=%(trace_id)s %(message)s"))
+        app_logger.addHandler(handler)
+        app_logger.setLevel(LOG_LEVEL)
+        app_logger.propagate = False
+
+
+# ─────────────────────────────────────────────
+# ASGI middleware
+# ─────────────────────────────────────────────
+class TracingMiddleware:
+    """
+    span جذر لكل طلب HTTP (يحترم traceparent الوارد) ويعيد X-Trace-Id في الاستجابة
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        traceparent = headers.get(b"traceparent", b"").decode("latin-1")
+        with root_span(f"{scope.get('method', '')} {scope.get('path', '')}", traceparent=traceparent, kind=SPAN_KIND_SERVER) as s:
+            async def send_wrapper(message):
+                if message["type"] == "http.response.start":
+                    s.set(**{"http.status_code": message["status"]})
+                    if message["status"] >= 500:
+                        s.status = STATUS_ERROR
+                    message.setdefault("headers", [])
+                    message["headers"] = [*message["headers"], (b"x-trace-id", s.trace.trace_id.encode())]
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_wrapper)
+            finally:
+                route = scope.get("route")
+                if getattr(route, "path", None):
+                    s.name = f"{scope.get('method', '')} {route.path}"
+                    s.set(**{"http.route": route.path})
@@ -1,25 +1,48 @@
 import os
-import json
 import time
-import uuid
 import asyncio
+import threading
+import uuid
 from pathlib import Path
-from typing import Any, Dict, List, Optional
-
-import httpx
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+import tracing
+from instrumentation import DB_FILE_BYTES, DB_SECONDS, METRICS_SYNC_POSTS, QUEUE_DEPTH
+from metrics_fetchers import (
+    DEFAULT_CHANNEL_ID,
+    count_reactions,
+    fetch_telegram_metrics,
+    fetch_tiktok_metrics,
+    get_fetcher,
+    load_tiktok_token,
+    registered_platforms,
+)
+from persistence import JsonJournal, atomic_write_json, load_json
+from shared_state import shared_lock
 
 UNIFIED_DB_PATH = Path(os.environ.get("UNIFIED_DB_PATH", "unified_db.json"))
-TELEGRAM_BOT_TOKEN = os.environ.get("TELEGRAM_BOT_TOKEN", "").strip()
-TIKTOK_ACCESS_TOKEN_PATH = os.environ.get("TOKENSPATH", "tokens.json")
-DEFAULT_CHANNEL_ID = (
-    os.environ.get("CHANNEL_ID")
-    or os.environ.get("TELEGRAM_CHANNEL_ID")
-    or os.environ.get("CHANNEL_USERNAME")
-    or ""
-).strip()
+UNIFIED_DB_JOURNAL_PATH = Path(os.environ.get("UNIFIED_DB_JOURNAL_PATH", f"{UNIFIED_DB_PATH}.journal"))
+# Per-post updates are appended to the journal; the full snapshot is rewritten every N entries.
+UNIFIED_DB_COMPACT_EVERY = int(os.environ.get("UNIFIED_DB_COMPACT_EVERY", "200"))
+# Legacy metrics_tracker.py store; merged into unified_db.json by migrate_publish_log().
+PUBLISH_LOG_PATH = Path(os.environ.get("PUBLISH_DB", "publish_log.json"))
+# Bulky per-post fields left out of listings unless asked for.
+HEAVY_POST_FIELDS = ("raw_publish_response", "history")
+METRICS_SYNC_CONCURRENCY = int(os.environ.get("METRICS_SYNC_CONCURRENCY", "4"))
+# Raw click events kept in unified_db["clicks"]; per-post totals live on each post.
+CLICK_LOG_KEEP = int(os.environ.get("CLICK_LOG_KEEP", "50000"))
+# Per-post history retention: at most N entries, raw entries older than N days
+# are folded into row["history_summary"]. 0 disables either rule.
+HISTORY_MAX_EVENTS = int(os.environ.get("HISTORY_MAX_EVENTS", "200"))
+HISTORY_MAX_AGE_DAYS = float(os.environ.get("HISTORY_MAX_AGE_DAYS", "90"))
+HISTORY_COMPACT_INTERVAL = float(os.environ.get("HISTORY_COMPACT_INTERVAL", "3600"))
 
 DB_SCHEMA_VERSION = 1
-_db_lock = asyncio.Lock()
+
+
+def db_lock():
+    # Cross-process: every uvicorn worker serialises unified_db.json writes on the same key.
+    return shared_lock("tracker:unified_db")
 
 
 def utc_now() -> str:
@@ -56,18 +79,43 @@ def _normalize_posts_shape(rows: Any) -> List[Dict[str, Any]]:
     return out
 
 
-def load_db() -> Dict[str, Any]:
+_journal = JsonJournal(UNIFIED_DB_JOURNAL_PATH, compact_every=UNIFIED_DB_COMPACT_EVERY)
+_db_cache: Dict[str, Any] = {"db": None, "sig": None, "offset": 0, "entries": 0, "index": {}}
+_cache_lock = threading.RLock()
+# Called with every post row this process writes or replays from another worker's journal.
+_post_listeners: List[Callable[[Dict[str, Any]], None]] = []
+
+
+def add_post_listener(fn: Callable[[Dict[str, Any]], None]) -> None:
+    if fn not in _post_listeners:
+        _post_listeners.append(fn)
+
+
+def _notify_posts(rows) -> None:
+    for fn in _post_listeners:
+        for row in rows:
+            try:
+                fn(row)
+            except Exception:
+                pass
+
+
+def _snapshot_sig():
+    try:
+        st = UNIFIED_DB_PATH.stat()
+    except OSError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+def _read_snapshot() -> Dict[str, Any]:
     if not UNIFIED_DB_PATH.exists():
         db = default_db()
         save_db(db)
         return db
 
-    try:
-        data = json.loads(UNIFIED_DB_PATH.read_text(encoding="utf-8"))
-    except Exception:
-        data = default_db()
-        save_db(data)
-        return data
+    # تلف الملف → آخر نسخة احتياطية سليمة، ولا نستبدل البيانات بقاعدة فارغة بصمت
+    data = load_json(UNIFIED_DB_PATH, default_db, validate=lambda d: isinstance(d, (dict, list)))
 
     if isinstance(data, list):
         data = {
@@ -83,27 +131,131 @@ def load_db() -> Dict[str, Any]:
         save_db(data)
         return data
 
-    if not isinstance(data, dict):
-        data = default_db()
-        save_db(data)
-        return data
-
     data.setdefault("meta", {})
     data["meta"].setdefault("schema_version", DB_SCHEMA_VERSION)
     data["meta"].setdefault("created_at", utc_now())
-    data["meta"]["updated_at"] = utc_now()
     data["posts"] = _normalize_posts_shape(data.get("posts", []))
     data.setdefault("clicks", [])
     return data
 
 
+def _apply_entry(db: Dict[str, Any], index: Dict[str, int], entry: Dict[str, Any]) -> None:
+    # Entries from before the last compaction are already in the snapshot.
+    if entry.get("gen") != db["meta"].get("journal_gen"):
+        return
+    if entry.get("op") == "upsert_post":
+        row = entry.get("post") or {}
+        pos = index.get(row.get("id"))
+        if pos is None:
+            index[row.get("id")] = len(db["posts"])
+            db["posts"].append(row)
+        else:
+            db["posts"][pos] = row
+        _notify_posts((row,))
+    elif entry.get("op") == "append_clicks":
+        clicks = db.setdefault("clicks", [])
+        clicks.extend(entry.get("events") or [])
+        del clicks[:-CLICK_LOG_KEEP]
+
+
+def load_db() -> Dict[str, Any]:
+    """
+    اللقطة الكاملة + ما أُلحق في السجل بعدها؛ تُقرأ من الذاكرة ما لم يتغير الملف
+    """
+    # Readers in worker threads (analytics) must not replay the same journal tail twice.
+    with _cache_lock:
+        sig = _snapshot_sig()
+        if _db_cache["db"] is None or sig is None or sig != _db_cache["sig"]:
+            with DB_SECONDS.time(op="load_snapshot"):
+                db = _read_snapshot()
+            _db_cache.update({
+                "db": db,
+                "sig": _snapshot_sig(),
+                "offset": 0,
+                "entries": 0,
+                "index": {row["id"]: i for i, row in enumerate(db["posts"])},
+            })
+
+        db = _db_cache["db"]
+        entries, offset = _journal.read_from(_db_cache["offset"])
+        for entry in entries:
+            _apply_entry(db, _db_cache["index"], entry)
+        _db_cache["offset"] = offset
+        _db_cache["entries"] += len(entries)
+        return db
+
+
 def save_db(db: Dict[str, Any]) -> None:
     ensure_parent_dir(UNIFIED_DB_PATH)
     db.setdefault("meta", {})
     db["meta"].setdefault("schema_version", DB_SCHEMA_VERSION)
     db["meta"].setdefault("created_at", utc_now())
     db["meta"]["updated_at"] = utc_now()
-    UNIFIED_DB_PATH.write_text(json.dumps(db, ensure_ascii=False, indent=2), encoding="utf-8")
+    db["meta"]["journal_gen"] = uuid.uuid4().hex
+    with _cache_lock:
+        with DB_SECONDS.time(op="save_snapshot"):
+            atomic_write_json(UNIFIED_DB_PATH, db)
+            _journal.truncate()
+        _db_cache.update({
+            "db": db,
+            "sig": _snapshot_sig(),
+            "offset": 0,
+            "entries": 0,
+            "index": {row.get("id"): i for i, row in enumerate(db.get("posts", []))},
+        })
+    DB_FILE_BYTES.set(_db_cache["sig"][2] if _db_cache["sig"] else 0, file=UNIFIED_DB_PATH.name)
+
+
+def _journal_write(db: Dict[str, Any], entries: List[Dict[str, Any]]) -> bool:
+    # False = the journal was full (or db is not the cached copy) and a full snapshot was written instead.
+    # Called under _cache_lock: a load_db in another thread between the append and the offset
+    # update would replay these entries into the shared cache a second time.
+    if _db_cache["db"] is not db or _journal.needs_compaction(_db_cache["entries"] + len(entries)):
+        save_db(db)
+        return False
+    gen, at = db["meta"].get("journal_gen"), utc_now()
+    with DB_SECONDS.time(op="journal_append"):
+        _db_cache["offset"] = _journal.append_many([{**entry, "gen": gen, "at": at} for entry in entries])
+    DB_FILE_BYTES.set(_db_cache["offset"], file=UNIFIED_DB_JOURNAL_PATH.name)
+    _db_cache["entries"] += len(entries)
+    return True
+
+
+def save_post(db: Dict[str, Any], *rows: Dict[str, Any], extra: Optional[List[Dict[str, Any]]] = None) -> None:
+    """
+    حفظ تعديل منشور (أو دفعة منشورات) بأسطر في السجل بدل إعادة كتابة الملف كله
+    يُستدعى داخل db_lock بعد load_db
+    """
+    entries = list(extra or []) + [{"op": "upsert_post", "post": row} for row in rows]
+    _notify_posts(rows)
+    if not entries:
+        return
+    # The new ids must be indexed before a reader thread can see the appended journal entries.
+    with _cache_lock:
+        if not _journal_write(db, entries):
+            return
+        index = _db_cache["index"]
+        posts = db["posts"]
+        for row in rows:
+            if row.get("id") in index:
+                continue
+            # new rows are appended, so scan from the end
+            for i in range(len(posts) - 1, -1, -1):
+                if posts[i] is row:
+                    index[row.get("id")] = i
+                    break
+
+
+def _find_by_id(db: Dict[str, Any], post_id: str) -> Optional[Dict[str, Any]]:
+    posts = db.get("posts", [])
+    pos = _db_cache["index"].get(post_id) if db is _db_cache["db"] else None
+    if pos is None or pos >= len(posts) or posts[pos].get("id") != post_id:
+        return next((row for row in posts if row.get("id") == post_id), None)
+    return posts[pos]
+
+
+def get_post_by_id(post_id: str) -> Optional[Dict[str, Any]]:
+    return _find_by_id(load_db(), post_id)
 
 
 def load_posts() -> List[Dict[str, Any]]:
@@ -116,139 +268,20 @@ def save_posts(posts: List[Dict[str, Any]]) -> None:
     save_db(db)
 
 
-def load_tiktok_token() -> str:
-    p = Path(TIKTOK_ACCESS_TOKEN_PATH)
-    if not p.exists():
-        return ""
-    try:
-        data = json.loads(p.read_text(encoding="utf-8"))
-        return (data.get("access_token") or "").strip()
-    except Exception:
-        return ""
-
-
-def count_reactions(reactions_obj: Optional[dict]) -> Optional[int]:
-    if not reactions_obj:
-        return None
-    total = 0
-    for r in reactions_obj.get("results", []) or []:
-        total += int(r.get("count", 0) or 0)
-    return total or None
-
-
-async def fetch_tiktok_metrics(platform_post_id: str) -> Dict[str, Any]:
-    token = load_tiktok_token()
-    if not token or not platform_post_id:
-        return {"metrics_source": "tiktok_api", "metrics_error": "missing_token_or_post_id"}
-
-    video_id = platform_post_id.replace("v.pub_url/", "").split("?")[0].strip()
-    if not video_id:
-        return {"metrics_source": "tiktok_api", "metrics_error": "invalid_video_id"}
-
-    url = "https://open.tiktokapis.com/v2/video/query/"
-    body = {
-        "filters": {"video_ids": [video_id]},
-        "fields": ["id", "view_count", "like_count", "comment_count", "share_count", "reach_user_count"],
-        "max_count": 1,
-    }
-
-    try:
-        async with httpx.AsyncClient(timeout=20) as c:
-            r = await c.post(
-                url,
-                headers={
-                    "Authorization": f"Bearer {token}",
-                    "Content-Type": "application/json; charset=UTF-8",
-                },
-                json=body,
-            )
-            data = r.json()
-            videos = ((data or {}).get("data") or {}).get("videos") or []
-            if videos:
-                v = videos[0]
-                return {
-                    "views": v.get("view_count"),
-                    "likes": v.get("like_count"),
-                    "comments": v.get("comment_count"),
-                    "shares": v.get("share_count"),
-                    "reach": v.get("reach_user_count"),
-                    "video_id": v.get("id") or video_id,
-                    "metrics_source": "tiktok_api",
-                }
-            return {
-                "metrics_source": "tiktok_api",
-                "metrics_error": "video_not_found",
-                "api_response": data,
-            }
-    except Exception as e:
-        return {"metrics_source": "tiktok_api", "metrics_error": str(e)}
-
-
-async def fetch_telegram_metrics(channel_id: str, message_id: str) -> Dict[str, Any]:
-    if not TELEGRAM_BOT_TOKEN or not message_id:
-        return {"metrics_source": "telegram_bot", "metrics_error": "missing_token_or_message_id"}
-
-    base = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}"
-    result: Dict[str, Any] = {"metrics_source": "telegram_bot"}
-
-    try:
-        async with httpx.AsyncClient(timeout=20) as c:
-            if channel_id:
-                r = await c.get(f"{base}/getChatMemberCount", params={"chat_id": channel_id})
-                mc = r.json()
-                if mc.get("ok"):
-                    result["channel_members"] = mc.get("result")
-
-            me_r = await c.get(f"{base}/getMe")
-            me = me_r.json()
-            bot_id = ((me or {}).get("result") or {}).get("id")
-
-            if bot_id and channel_id:
-                fw = await c.post(
-                    f"{base}/forwardMessage",
-                    json={
-                        "chat_id": bot_id,
-                        "from_chat_id": channel_id,
-                        "message_id": int(message_id),
-                        "disable_notification": True,
-                    },
-                )
-                fw_data = fw.json()
-                if fw_data.get("ok"):
-                    msg = fw_data.get("result") or {}
-                    result["views"] = msg.get("views")
-                    result["forwards"] = msg.get("forwards")
-                    result["reactions"] = count_reactions(msg.get("reactions"))
-                    forwarded_id = msg.get("message_id")
-                    if forwarded_id:
-                        try:
-                            await c.post(
-                                f"{base}/deleteMessage",
-                                json={"chat_id": bot_id, "message_id": forwarded_id},
-                            )
-                        except Exception:
-                            pass
-                else:
-                    result["metrics_error"] = fw_data.get("description") or "forward_failed"
-
-            return result
-    except Exception as e:
-        result["metrics_error"] = str(e)
-        return result
-
-
 def compute_engagement_score(metrics: Dict[str, Any]) -> float:
-    views = float(metrics.get("views") or 0)
+    # Graph API posts report impressions rather than views.
+    views = float(metrics.get("views") or metrics.get("impressions") or 0)
     likes = float(metrics.get("likes") or 0)
     comments = float(metrics.get("comments") or 0)
     shares = float(metrics.get("shares") or 0)
     forwards = float(metrics.get("forwards") or 0)
     reactions = float(metrics.get("reactions") or 0)
+    link_clicks = float(metrics.get("link_clicks") or 0)
 
     if views <= 0:
         return 0.0
 
-    score = ((likes * 1.0) + (comments * 2.0) + (shares * 3.0) + (forwards * 2.0) + (reactions * 1.5)) / views * 100
+    score = ((likes * 1.0) + (comments * 2.0) + (shares * 3.0) + (forwards * 2.0) + (reactions * 1.5) + (link_clicks * 3.0)) / views * 100
     return round(score, 4)
 
 
@@ -289,6 +322,129 @@ def build_post_record(payload: Dict[str, Any]) -> Dict[str, Any]:
     }
 
 
+# ─────────────────────────────────────────────
+# History retention
+# ─────────────────────────────────────────────
+_HISTORY_META_KEYS = ("at", "first_at", "count")
+_history_compactor: Optional[asyncio.Task] = None
+
+
+def _same_event(a: Dict[str, Any], b: Dict[str, Any]) -> bool:
+    keys = (set(a) | set(b)) - set(_HISTORY_META_KEYS)
+    return all(a.get(k) == b.get(k) for k in keys)
+
+
+def _merge_run(last: Dict[str, Any], entry: Dict[str, Any]) -> None:
+    # run-length: one entry with count + first_at/at for consecutive identical events
+    last["first_at"] = last.get("first_at") or last.get("at")
+    last["count"] = int(last.get("count") or 1) + int(entry.get("count") or 1)
+    last["at"] = entry.get("at") or last.get("at")
+
+
+def append_history(row: Dict[str, Any], entry: Dict[str, Any]) -> None:
+    history = row.setdefault("history", [])
+    if history and _same_event(history[-1], entry):
+        _merge_run(history[-1], entry)
+        return
+    history.append(entry)
+    if HISTORY_MAX_EVENTS and len(history) > HISTORY_MAX_EVENTS:
+        compact_history(row)
+
+
+def _summarize(row: Dict[str, Any], dropped: List[Dict[str, Any]]) -> None:
+    if not dropped:
+        return
+    summary = row.setdefault("history_summary", {"events": 0, "by_event": {}, "first_at": None, "last_at": None})
+    for entry in dropped:
+        n = int(entry.get("count") or 1)
+        summary["events"] += n
+        summary["by_event"][entry.get("event") or "unknown"] = summary["by_event"].get(entry.get("event") or "unknown", 0) + n
+        first, last = entry.get("first_at") or entry.get("at"), entry.get("at")
+        if first and (summary["first_at"] is None or first < summary["first_at"]):
+            summary["first_at"] = first
+        if last and (summary["last_at"] is None or last > summary["last_at"]):
+            summary["last_at"] = last
+    summary["compacted_at"] = utc_now()
+
+
+def compact_history(row: Dict[str, Any], now: Optional[float] = None) -> bool:
+    """
+    1) دمج الأحداث المتتالية المتطابقة  2) طي ما هو أقدم من HISTORY_MAX_AGE_DAYS
+    3) الإبقاء على آخر HISTORY_MAX_EVENTS — المحذوف يُلخَّص في history_summary
+    أول حدث (إنشاء السجل) يبقى دائمًا
+    """
+    history = row.get("history")
+    if not isinstance(history, list) or len(history) < 2:
+        return False
+    before = len(history)
+
+    merged: List[Dict[str, Any]] = []
+    for entry in history:
+        if not isinstance(entry, dict):
+            continue
+        if merged and _same_event(merged[-1], entry):
+            _merge_run(merged[-1], entry)
+        else:
+            merged.append(entry)
+    head, rest = merged[:1], merged[1:]
+
+    dropped: List[Dict[str, Any]] = []
+    if HISTORY_MAX_AGE_DAYS:
+        cutoff = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime((now or time.time()) - HISTORY_MAX_AGE_DAYS * 86400))
+        dropped = [e for e in rest if str(e.get("at") or "") < cutoff]
+        rest = [e for e in rest if str(e.get("at") or "") >= cutoff]
+    if HISTORY_MAX_EVENTS and len(head) + len(rest) > HISTORY_MAX_EVENTS:
+        cut = len(head) + len(rest) - HISTORY_MAX_EVENTS
+        dropped += rest[:cut]
+        rest = rest[cut:]
+
+    _summarize(row, dropped)
+    row["history"] = head + rest
+    return len(row["history"]) != before or bool(dropped)
+
+
+async def compact_all_history() -> int:
+    """
+    مرور كامل على القاعدة: يُكتب snapshot جديد مرة واحدة إن تغيّر أي سجل
+    """
+    async with db_lock():
+        db = load_db()
+        with tracing.span("history_compaction") as span:
+            now = time.time()
+            changed = sum(1 for row in db.get("posts", []) if compact_history(row, now))
+            span.set(posts=changed)
+            if changed:
+                save_db(db)
+        return changed
+
+
+async def _history_compact_loop() -> None:
+    while True:
+        try:
+            await compact_all_history()
+        except Exception:
+            # A failed pass is retried on the next interval.
+            pass
+        await asyncio.sleep(HISTORY_COMPACT_INTERVAL)
+
+
+def start_history_compactor() -> None:
+    global _history_compactor
+    if HISTORY_COMPACT_INTERVAL > 0 and (_history_compactor is None or _history_compactor.done()):
+        _history_compactor = asyncio.create_task(_history_compact_loop())
+
+
+async def stop_history_compactor() -> None:
+    global _history_compactor
+    if _history_compactor is not None:
+        _history_compactor.cancel()
+        try:
+            await _history_compactor
+        except asyncio.CancelledError:
+            pass
+        _history_compactor = None
+
+
 def find_post(posts: List[Dict[str, Any]], platform: str, platform_post_id: str) -> Optional[Dict[str, Any]]:
     for row in posts:
         if row.get("platform") == platform and str(row.get("platform_post_id") or "") == str(platform_post_id or ""):
@@ -306,7 +462,7 @@ async def track_publish(payload: Dict[str, Any]) -> Dict[str, Any]:
     if not platform:
         raise ValueError("Missing platform")
 
-    async with _db_lock:
+    async with db_lock():
         db = load_db()
         posts = db.get("posts", [])
 
@@ -328,70 +484,103 @@ async def track_publish(payload: Dict[str, Any]) -> Dict[str, Any]:
                 "channel_id": payload.get("channel_id") or payload.get("channelid") or existing.get("channel_id") or DEFAULT_CHANNEL_ID,
                 "raw_publish_response": payload.get("raw_publish_response") or payload.get("rawpublishresponse") or existing.get("raw_publish_response") or {},
             })
-            existing.setdefault("history", []).append({
+            append_history(existing, {
                 "event": "publish_updated",
                 "at": utc_now(),
                 "status": existing.get("publish_status"),
             })
-            save_db(db)
+            save_post(db, existing)
             return existing
 
         item = build_post_record(payload)
         posts.append(item)
-        save_db(db)
+        save_post(db, item)
         return item
 
 
-async def sync_post_metrics(row: Dict[str, Any]) -> Dict[str, Any]:
-    platform = (row.get("platform") or "").strip().lower()
-    post_id = row.get("platform_post_id")
+# ─────────────────────────────────────────────
+# Sync
+# ─────────────────────────────────────────────
+async def fetch_metrics_batch(platform: str, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    fetcher = get_fetcher(platform)
+    if fetcher is None:
+        results = [
+            {"metrics_source": "not_supported_yet", "metrics_error": f"unsupported_platform:{platform}"}
+            for _ in rows
+        ]
+    else:
+        results = await fetcher.fetch_batch(rows)
     now = utc_now()
+    for metrics in results:
+        metrics["last_metrics_at"] = now
+    return results
 
-    if platform == "tiktok":
-        metrics = await fetch_tiktok_metrics(post_id)
-    elif platform == "telegram":
-        channel_id = row.get("channel_id") or DEFAULT_CHANNEL_ID
-        metrics = await fetch_telegram_metrics(channel_id, post_id)
-    else:
-        metrics = {"metrics_source": "not_supported_yet", "metrics_error": f"unsupported_platform:{platform}"}
 
-    metrics["last_metrics_at"] = now
-    return metrics
+async def sync_post_metrics(row: Dict[str, Any]) -> Dict[str, Any]:
+    platform = (row.get("platform") or "").strip().lower()
+    return (await fetch_metrics_batch(platform, [row]))[0]
 
 
-async def sync_metrics_for_post(platform: str, platform_post_id: str) -> Optional[Dict[str, Any]]:
-    async with _db_lock:
+async def apply_metrics(platform: str, updates: List[tuple]) -> List[Dict[str, Any]]:
+    """
+    updates = [(platform_post_id, fresh_metrics), ...] — قفل واحد وكتابة سجل واحدة للدفعة
+    """
+    async with db_lock():
         db = load_db()
-        posts = db.get("posts", [])
-        row = find_post(posts, platform, platform_post_id)
-        if not row:
-            return None
+        by_post_id = {
+            str(row.get("platform_post_id") or ""): row
+            for row in db.get("posts", [])
+            if row.get("platform") == platform
+        }
+        changed = []
+        for platform_post_id, fresh in updates:
+            row = by_post_id.get(str(platform_post_id or ""))
+            if not row:
+                continue
+            row["metrics"] = merge_metrics(row.get("metrics"), fresh)
+            append_history(row, {
+                "event": "metrics_synced",
+                "at": utc_now(),
+                "platform": platform,
+            })
+            changed.append(row)
+        save_post(db, *changed)
+        return changed
 
-    fresh = await sync_post_metrics(row)
 
-    async with _db_lock:
-        db = load_db()
-        posts = db.get("posts", [])
-        row = find_post(posts, platform, platform_post_id)
+async def sync_metrics_for_post(platform: str, platform_post_id: str) -> Optional[Dict[str, Any]]:
+    with tracing.span("sync_metrics_for_post", platform=platform):
+        with tracing.span("db_read"):
+            async with db_lock():
+                db = load_db()
+                posts = db.get("posts", [])
+                row = find_post(posts, platform, platform_post_id)
         if not row:
             return None
-        row["metrics"] = merge_metrics(row.get("metrics"), fresh)
-        row.setdefault("history", []).append({
-            "event": "metrics_synced",
-            "at": utc_now(),
-            "platform": platform,
-        })
-        save_db(db)
-        return row
+
+        with tracing.span("fetch", platform=platform) as span:
+            fresh = await sync_post_metrics(row)
+            if fresh.get("metrics_error"):
+                span.fail(str(fresh["metrics_error"]))
+        with tracing.span("db_write"):
+            changed = await apply_metrics(platform, [(platform_post_id, fresh)])
+        return changed[0] if changed else None
 
 
 async def run_sync_all(max_age_days: int = 7) -> int:
-    async with _db_lock:
+    """
+    منشورات آخر max_age_days لكل منصة لها fetcher مسجل
+    الدفعات تُجلب بالتوازي (METRICS_SYNC_CONCURRENCY) وتُكتب دفعةً دفعة
+    """
+    await migrate_publish_log()
+
+    async with db_lock():
         db = load_db()
         snapshot = list(db.get("posts", []))
 
     now_ts = time.time()
-    eligible = []
+    platforms = set(registered_platforms())
+    eligible: Dict[str, List[Dict[str, Any]]] = {}
     for row in snapshot:
         try:
             pub_ts = time.mktime(time.strptime(row.get("published_at", ""), "%Y-%m-%dT%H:%M:%SZ"))
@@ -399,18 +588,116 @@ async def run_sync_all(max_age_days: int = 7) -> int:
             continue
         if now_ts - pub_ts > max_age_days * 24 * 3600:
             continue
-        if (row.get("platform") or "") not in ("tiktok", "telegram"):
+        if (row.get("platform") or "") not in platforms:
             continue
         if not row.get("platform_post_id"):
             continue
-        eligible.append(row)
+        eligible.setdefault(row["platform"], []).append(row)
 
-    updated = 0
-    for row in eligible:
-        synced = await sync_metrics_for_post(row.get("platform"), row.get("platform_post_id"))
-        if synced:
-            updated += 1
-    return updated
+    sem = asyncio.Semaphore(METRICS_SYNC_CONCURRENCY)
+
+    async def sync_batch(platform: str, batch: List[Dict[str, Any]]) -> int:
+        try:
+            async with sem:
+                fresh = await fetch_metrics_batch(platform, batch)
+            changed = await apply_metrics(platform, [
+                (row.get("platform_post_id"), metrics) for row, metrics in zip(batch, fresh)
+            ])
+        finally:
+            QUEUE_DEPTH.inc(-len(batch), queue="metrics_sync")
+        METRICS_SYNC_POSTS.inc(len(changed), platform=platform)
+        return len(changed)
+
+    jobs = []
+    for platform, rows in eligible.items():
+        size = max(1, get_fetcher(platform).batch_size)
+        for i in range(0, len(rows), size):
+            jobs.append(sync_batch(platform, rows[i:i + size]))
+    QUEUE_DEPTH.inc(sum(len(rows) for rows in eligible.values()), queue="metrics_sync")
+    return sum(await asyncio.gather(*jobs))
+
+
+# ─────────────────────────────────────────────
+# Clicks
+# ─────────────────────────────────────────────
+async def record_clicks(events: List[Dict[str, Any]]) -> int:
+    """
+    events = [{"post_id", "at", "country", "agent"}, ...] من ذاكرة /r/
+    تُجمع في row["clicks"] وmetrics["link_clicks"]، وتُحفظ الأحداث الخام في db["clicks"]
+    """
+    if not events:
+        return 0
+    async with db_lock():
+        db = load_db()
+        by_id = {}
+        for event in events:
+            post_id = event.get("post_id")
+            row = by_id.get(post_id) or _find_by_id(db, post_id)
+            if not row:
+                continue
+            by_id[post_id] = row
+            stats = row.setdefault("clicks", {"total": 0, "by_country": {}, "by_agent": {}})
+            stats["total"] = int(stats.get("total") or 0) + 1
+            country = event.get("country") or "unknown"
+            agent = event.get("agent") or "unknown"
+            stats.setdefault("by_country", {})[country] = stats["by_country"].get(country, 0) + 1
+            stats.setdefault("by_agent", {})[agent] = stats["by_agent"].get(agent, 0) + 1
+            stats["last_at"] = max(stats.get("last_at") or "", event.get("at") or "")
+            row.setdefault("metrics", {})["link_clicks"] = stats["total"]
+
+        for row in by_id.values():
+            row["metrics"]["engagement_score"] = compute_engagement_score(row["metrics"])
+        clicks = db.setdefault("clicks", [])
+        clicks.extend(events)
+        del clicks[:-CLICK_LOG_KEEP]
+        save_post(db, *by_id.values(), extra=[{"op": "append_clicks", "events": events}])
+        return len(events)
+
+
+# ─────────────────────────────────────────────
+# Migration
+# ─────────────────────────────────────────────
+async def migrate_publish_log() -> int:
+    """
+    يدمج publish_log.json (مخزن metrics_tracker القديم) في unified_db.json مرة واحدة
+    ثم يعيد تسميته إلى .migrated — المنشور الموجود مسبقًا يكمل مقاييسه الناقصة فقط
+    """
+    if not PUBLISH_LOG_PATH.exists():
+        return 0
+    async with db_lock():
+        if not PUBLISH_LOG_PATH.exists():
+            return 0
+        legacy_rows = load_json(PUBLISH_LOG_PATH, list, validate=lambda d: isinstance(d, list))
+        db = load_db()
+        posts = db.setdefault("posts", [])
+        by_key = {(row.get("platform"), str(row.get("platform_post_id") or "")): row for row in posts}
+
+        merged = 0
+        touched = []
+        for legacy in legacy_rows:
+            if not isinstance(legacy, dict):
+                continue
+            platform = (legacy.get("platform") or "").strip().lower()
+            platform_post_id = legacy.get("platform_post_id") or legacy.get("platformpostid")
+            existing = by_key.get((platform, str(platform_post_id))) if platform_post_id else None
+            if existing:
+                metrics = existing.setdefault("metrics", {})
+                for key, value in (legacy.get("metrics") or {}).items():
+                    metrics.setdefault(key, value)
+            else:
+                row = build_post_record({**legacy, "platform": platform})
+                row["metrics"] = legacy.get("metrics") or {}
+                row["history"] = [{"event": "migrated_from_publish_log", "at": utc_now()}]
+                posts.append(row)
+                by_key[(platform, str(platform_post_id or ""))] = row
+            touched.append(existing or row)
+            merged += 1
+
+        db["meta"]["migrated_publish_log"] = {"at": utc_now(), "rows": merged, "source": str(PUBLISH_LOG_PATH)}
+        save_db(db)
+        _notify_posts(touched)
+        os.replace(PUBLISH_LOG_PATH, PUBLISH_LOG_PATH.with_name(PUBLISH_LOG_PATH.name + ".migrated"))
+        return merged
 
 
 def get_post(platform: str, platform_post_id: str) -> Optional[Dict[str, Any]]:
@@ -418,5 +705,59 @@ def get_post(platform: str, platform_post_id: str) -> Optional[Dict[str, Any]]:
     return find_post(posts, platform, platform_post_id)
 
 
-def get_all_posts() -> List[Dict[str, Any]]:
-    return load_posts()
+def project_post(row: Dict[str, Any], fields: Optional[List[str]] = None, exclude=HEAVY_POST_FIELDS) -> Dict[str, Any]:
+    if fields:
+        return {k: row[k] for k in fields if k in row}
+    return {k: v for k, v in row.items() if k not in exclude}
+
+
+def get_all_posts(include_heavy: bool = False) -> List[Dict[str, Any]]:
+    posts = load_posts()
+    if include_heavy:
+        return posts
+    return [project_post(row) for row in posts]
+
+
+def data_version() -> str:
+    """
+    يتغير مع كل كتابة من أي عامل (لقطة جديدة أو سطر في السجل) — دون قراءة القاعدة
+    """
+    sig = _snapshot_sig() or ("-",)
+    try:
+        journal = UNIFIED_DB_JOURNAL_PATH.stat().st_size
+    except OSError:
+        journal = 0
+    return "-".join(str(part) for part in (*sig, journal))
+
+
+def scan_posts(fields: List[str], since: Optional[str] = None, platform: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    """
+    استعلام قراءة فقط: الأعمدة المطلوبة فقط من كل سجل، بعد التصفية بالمنصة وبتاريخ النشر (since بصيغة utc_now)
+    القيم المتداخلة (metrics...) نسخ: المستدعي في thread وحلقة الأحداث تعدّل الأصل في مكانه
+    """
+    for row in load_posts():
+        if platform and row.get("platform") != platform:
+            continue
+        if since and str(row.get("published_at") or "") < since:
+            continue
+        yield {k: _detach(row[k]) for k in fields if k in row}
+
+
+def _detach(value: Any) -> Any:
+    # dict()/list() copy in one step under the GIL, so a concurrent in-place update cannot break the walk.
+    if isinstance(value, dict):
+        return {k: _detach(v) for k, v in dict(value).items()}
+    if isinstance(value, list):
+        return [_detach(v) for v in list(value)]
+    return value
+
+
+def iter_posts(chunk_size: int = 500, fields: Optional[List[str]] = None, exclude=HEAVY_POST_FIELDS) -> Iterator[List[Dict[str, Any]]]:
+    """
+    دفعات من السجلات المُسقطة مباشرة من اللقطة المحملة — لا نسخة كاملة من القاعدة
+    السجلات المضافة أثناء البث لا تُضمَّن (العدد يُثبَّت عند البدء)
+    """
+    posts = load_posts()
+    total = len(posts)
+    for start in range(0, total, chunk_size):
+        yield [project_post(row, fields, exclude) for row in posts[start:start + chunk_size]]
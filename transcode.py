@@ -0,0 +1,218 @@
+import os
+import json
+import time
+import uuid
+import struct
+import asyncio
+from typing import Any, Dict, Optional
+
+FFMPEG_BIN = os.environ.get("FFMPEG_BIN", "ffmpeg")
+FFPROBE_BIN = os.environ.get("FFPROBE_BIN", "ffprobe")
+TRANSCODE_WORKERS = int(os.environ.get("TRANSCODE_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+TRANSCODE_DEFAULT_PROFILE = os.environ.get("TRANSCODE_DEFAULT_PROFILE", "").strip()
+TRANSCODE_TIMEOUT_SECONDS = float(os.environ.get("TRANSCODE_TIMEOUT", "900"))
+
+# long_side/short_side: the box a portrait or landscape video must fit in.
+TRANSCODE_PROFILES: Dict[str, Dict[str, Any]] = {
+    "tiktok": {
+        "long_side": 1920,
+        "short_side": 1080,
+        "crf": 23,
+        "maxrate_kbps": 6000,
+        "preset": "veryfast",
+        "audio_kbps": 128,
+    },
+    "tiktok_small": {
+        "long_side": 1280,
+        "short_side": 720,
+        "crf": 26,
+        "maxrate_kbps": 3000,
+        "preset": "veryfast",
+        "audio_kbps": 96,
+    },
+}
+
+# yt-dlp: prefer H.264/AAC with the short side at most 1080 instead of the
+# largest 4K/VP9/AV1 rendition.
+YTDLP_FORMATS = {
+    "best": ["-f", "bv*+ba/best"],
+    "tiktok": ["-f", "bv*+ba/b", "-S", "res:1080,vcodec:h264,acodec:aac,br"],
+    "tiktok_small": ["-f", "bv*+ba/b", "-S", "res:720,vcodec:h264,acodec:aac,br"],
+}
+
+_workers: Optional[asyncio.Semaphore] = None
+
+
+def workers() -> asyncio.Semaphore:
+    global _workers
+    if _workers is None:
+        _workers = asyncio.Semaphore(TRANSCODE_WORKERS)
+    return _workers
+
+
+def ytdlp_format_args(name: Optional[str]):
+    return YTDLP_FORMATS.get((name or "best").strip().lower(), YTDLP_FORMATS["best"])
+
+
+def resolve_profile(value: Any) -> Optional[str]:
+    if value is True:
+        return TRANSCODE_DEFAULT_PROFILE or "tiktok"
+    if not value:
+        return TRANSCODE_DEFAULT_PROFILE or None
+    name = str(value).strip().lower()
+    return name if name in TRANSCODE_PROFILES else None
+
+
+def moov_before_mdat(path: str) -> bool:
+    """
+    فحص سريع لترتيب صناديق MP4 العلوية (faststart = moov قبل mdat)
+    """
+    try:
+        with open(path, "rb") as f:
+            while True:
+                header = f.read(8)
+                if len(header) < 8:
+                    return False
+                size, box = struct.unpack(">I4s", header)
+                if box == b"moov":
+                    return True
+                if box == b"mdat":
+                    return False
+                if size == 1:
+                    size = struct.unpack(">Q", f.read(8))[0]
+                    f.seek(size - 16, os.SEEK_CUR)
+                elif size < 8:
+                    return False
+                else:
+                    f.seek(size - 8, os.SEEK_CUR)
+    except OSError:
+        return False
+
+
+async def probe(path: str) -> Dict[str, Any]:
+    proc = await asyncio.create_subprocess_exec(
+        FFPROBE_BIN, "-v", "error",
+        "-show_entries", "stream=codec_type,codec_name,width,height,bit_rate:format=bit_rate,duration",
+        "-of", "json", path,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.DEVNULL,
+    )
+    out, _ = await proc.communicate()
+    if proc.returncode != 0:
+        return {}
+    data = json.loads(out or b"{}")
+    video = next((s for s in data.get("streams") or [] if s.get("codec_type") == "video"), {})
+    audio = next((s for s in data.get("streams") or [] if s.get("codec_type") == "audio"), {})
+    fmt = data.get("format") or {}
+    return {
+        "width": int(video.get("width") or 0),
+        "height": int(video.get("height") or 0),
+        "vcodec": video.get("codec_name"),
+        "acodec": audio.get("codec_name"),
+        "bit_rate": int(fmt.get("bit_rate") or video.get("bit_rate") or 0),
+        "duration": float(fmt.get("duration") or 0),
+    }
+
+
+def within_profile(info: Dict[str, Any], profile: Dict[str, Any], path: str) -> Optional[str]:
+    if not info.get("width"):
+        return None
+    long_side = max(info["width"], info["height"])
+    short_side = min(info["width"], info["height"])
+    if long_side > profile["long_side"] or short_side > profile["short_side"]:
+        return None
+    if info.get("vcodec") != "h264" or info.get("acodec") not in (None, "aac"):
+        return None
+    # 10% margin over the cap: audio and container overhead are included in format bit_rate.
+    if info.get("bit_rate") and info["bit_rate"] > (profile["maxrate_kbps"] + profile["audio_kbps"]) * 1000 * 1.1:
+        return None
+    if not moov_before_mdat(path):
+        return None
+    return "already_within_profile"
+
+
+def build_transcode_command(src: str, dst: str, info: Dict[str, Any], profile: Dict[str, Any]):
+    if info.get("width", 0) >= info.get("height", 0):
+        box_w, box_h = profile["long_side"], profile["short_side"]
+    else:
+        box_w, box_h = profile["short_side"], profile["long_side"]
+    scale = (
+        f"scale='min({box_w},iw)':'min({box_h},ih)'"
+        ":force_original_aspect_ratio=decrease:force_divisible_by=2"
+    )
+    return [
+        FFMPEG_BIN, "-y", "-loglevel", "error", "-i", src,
+        "-map", "0:v:0", "-map", "0:a:0?",
+        "-vf", scale,
+        "-c:v", "libx264", "-preset", profile["preset"], "-crf", str(profile["crf"]),
+        "-maxrate", f"{profile['maxrate_kbps']}k", "-bufsize", f"{profile['maxrate_kbps'] * 2}k",
+        "-pix_fmt", "yuv420p",
+        "-c:a", "aac", "-b:a", f"{profile['audio_kbps']}k",
+        "-movflags", "+faststart",
+        dst,
+    ]
+
+
+async def ensure_profile(path: str, profile_name: str) -> Dict[str, Any]:
+    """
+    يرجع {"path": ..., "transcoded": bool, ...}
+    عند فشل ffmpeg يُستعمل الملف الأصلي مع error
+    """
+    profile = TRANSCODE_PROFILES.get(profile_name)
+    original_size = os.path.getsize(path)
+    result: Dict[str, Any] = {"path": path, "profile": profile_name, "transcoded": False, "original_size": original_size}
+    if not profile:
+        result["error"] = f"unknown_profile:{profile_name}"
+        return result
+
+    stem, _ = os.path.splitext(path)
+    out_path = f"{stem}.{profile_name}.mp4"
+    if os.path.exists(out_path) and os.path.getmtime(out_path) >= os.path.getmtime(path):
+        return {**result, "path": out_path, "transcoded": True, "cached": True, "output_size": os.path.getsize(out_path)}
+
+    # A missing ffprobe/ffmpeg binary raises from create_subprocess_exec; publish the original instead.
+    try:
+        info = await probe(path)
+    except OSError as e:
+        return {**result, "error": f"ffprobe_unavailable:{e}"}
+    skip_reason = within_profile(info, profile, path)
+    if skip_reason:
+        return {**result, "skipped": skip_reason}
+
+    # Unique per call: two requests in one worker may transcode the same file at once.
+    tmp_path = f"{stem}.{profile_name}.{os.getpid()}.{uuid.uuid4().hex[:8]}.tmp.mp4"
+    started = time.perf_counter()
+    async with workers():
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                *build_transcode_command(path, tmp_path, info, profile),
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.PIPE,
+            )
+        except OSError as e:
+            return {**result, "error": f"ffmpeg_unavailable:{e}"}
+        try:
+            _, err = await asyncio.wait_for(proc.communicate(), timeout=TRANSCODE_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            proc.kill()
+            await proc.wait()
+            err = b"timeout"
+
+    if proc.returncode != 0 or not os.path.exists(tmp_path):
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return {**result, "error": (err or b"").decode("utf-8", "replace")[-500:] or "transcode_failed"}
+
+    output_size = os.path.getsize(tmp_path)
+    if output_size >= original_size:
+        os.remove(tmp_path)
+        return {**result, "skipped": "no_size_gain"}
+
+    os.replace(tmp_path, out_path)
+    return {
+        **result,
+        "path": out_path,
+        "transcoded": True,
+        "output_size": output_size,
+        "seconds": round(time.perf_counter() - started, 2),
+    }
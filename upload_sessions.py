@@ -0,0 +1,161 @@
+import os
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from persistence import atomic_write_json, load_json
+from shared_state import shared_lock_sync
+
+UPLOAD_SESSIONS_PATH = Path(os.environ.get("UPLOAD_SESSIONS_PATH", "upload_sessions.json"))
+# TikTok upload_url values stay valid for one hour after init.
+UPLOAD_URL_TTL_SECONDS = int(os.environ.get("UPLOAD_URL_TTL_SECONDS", "3600"))
+UPLOAD_SESSIONS_KEEP_SECONDS = 24 * 3600
+# An "uploading" session whose holder has not acked a chunk for this long may be taken over by a resume.
+UPLOAD_LEASE_SECONDS = float(os.environ.get("UPLOAD_LEASE_SECONDS", "300"))
+
+
+def utc_now() -> str:
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+
+
+def load_sessions() -> Dict[str, Dict[str, Any]]:
+    return load_json(UPLOAD_SESSIONS_PATH, dict, validate=lambda d: isinstance(d, dict))
+
+
+def save_sessions(sessions: Dict[str, Dict[str, Any]]) -> None:
+    cutoff = time.time() - UPLOAD_SESSIONS_KEEP_SECONDS
+    live = {k: v for k, v in sessions.items() if float(v.get("expires_ts") or 0) > cutoff}
+    atomic_write_json(UPLOAD_SESSIONS_PATH, live)
+
+
+def is_expired(session: Dict[str, Any]) -> bool:
+    return time.time() >= float(session.get("expires_ts") or 0)
+
+
+def create_session(
+    publish_id: str,
+    upload_url: str,
+    filepath: str,
+    video_size: int,
+    chunk_size: int,
+    total_chunk_count: int,
+    payload: Dict[str, Any],
+    idempotency_key: Optional[str] = None,
+) -> Dict[str, Any]:
+    st = os.stat(filepath)
+    session = {
+        "publish_id": publish_id,
+        "upload_url": upload_url,
+        "filepath": os.path.abspath(filepath),
+        "file_mtime_ns": st.st_mtime_ns,
+        "video_size": video_size,
+        "chunk_size": chunk_size,
+        "total_chunk_count": total_chunk_count,
+        "acked_ranges": [],
+        "next_chunk": 0,
+        "status": "uploading",
+        "lease_id": uuid.uuid4().hex,
+        "lease_until": time.time() + UPLOAD_LEASE_SECONDS,
+        "idempotency_key": idempotency_key,
+        "payload": {k: v for k, v in payload.items() if k not in ("filepath", "filePath")},
+        "created_at": utc_now(),
+        "updated_at": utc_now(),
+        "expires_ts": time.time() + UPLOAD_URL_TTL_SECONDS,
+    }
+    with shared_lock_sync("upload_sessions"):
+        sessions = load_sessions()
+        sessions[publish_id] = session
+        save_sessions(sessions)
+    return session
+
+
+def ack_chunk(publish_id: str, index: int, first: int, last: int, lease_id: Optional[str] = None) -> bool:
+    """
+    يسجل الجزء ويمدد الإيجار؛ False إن انتقل الإيجار إلى استئناف آخر فيجب على هذا الرافع التوقف
+    """
+    with shared_lock_sync("upload_sessions"):
+        sessions = load_sessions()
+        session = sessions.get(publish_id)
+        if not session:
+            return True
+        if lease_id and session.get("lease_id") != lease_id:
+            return False
+        session["acked_ranges"].append([first, last])
+        session["next_chunk"] = index + 1
+        session["updated_at"] = utc_now()
+        session["lease_until"] = time.time() + UPLOAD_LEASE_SECONDS
+        if session["next_chunk"] >= session["total_chunk_count"]:
+            session["status"] = "uploaded"
+        save_sessions(sessions)
+        return True
+
+
+def mark(publish_id: str, status: str, error: Optional[Dict[str, Any]] = None, lease_id: Optional[str] = None) -> None:
+    with shared_lock_sync("upload_sessions"):
+        sessions = load_sessions()
+        session = sessions.get(publish_id)
+        if not session or (lease_id and session.get("lease_id") != lease_id):
+            return
+        session["status"] = status
+        session["updated_at"] = utc_now()
+        if status != "uploading":
+            session["lease_until"] = 0
+        if error is not None:
+            session["error"] = error
+        save_sessions(sessions)
+
+
+def claim(publish_id: str) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    """
+    يحجز الجلسة للاستئناف ذرّيًا: (الجلسة مع lease_id جديد، None) أو (None/الجلسة، سبب الرفض)
+    جلسة "uploading" بإيجار سارٍ تعني أن رفعًا آخر جارٍ
+    """
+    with shared_lock_sync("upload_sessions"):
+        sessions = load_sessions()
+        session = sessions.get(publish_id)
+        if not session:
+            return None, "upload_session_not_found"
+        problem = resumable_problem(session)
+        if problem:
+            return session, problem
+        if session.get("status") == "uploading" and float(session.get("lease_until") or 0) > time.time():
+            return session, "upload_in_progress"
+        session["status"] = "uploading"
+        session["lease_id"] = uuid.uuid4().hex
+        session["lease_until"] = time.time() + UPLOAD_LEASE_SECONDS
+        session["updated_at"] = utc_now()
+        save_sessions(sessions)
+        return dict(session), None
+
+
+def get_session(publish_id: str) -> Optional[Dict[str, Any]]:
+    return load_sessions().get(publish_id)
+
+
+def resumable_problem(session: Dict[str, Any]) -> Optional[str]:
+    if session.get("status") == "uploaded":
+        return "already_uploaded"
+    if is_expired(session):
+        return "upload_url_expired"
+    path = session.get("filepath") or ""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return "file_missing"
+    if st.st_size != session.get("video_size") or st.st_mtime_ns != session.get("file_mtime_ns"):
+        return "file_changed"
+    return None
+
+
+def list_sessions(include_done: bool = False) -> List[Dict[str, Any]]:
+    out = []
+    for session in load_sessions().values():
+        if not include_done and session.get("status") == "uploaded":
+            continue
+        out.append({
+            **{k: v for k, v in session.items() if k != "upload_url"},
+            "expired": is_expired(session),
+            "uploaded_bytes": sum(last - first + 1 for first, last in session.get("acked_ranges") or []),
+        })
+    return out
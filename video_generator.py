@@ -1,13 +1,26 @@
 import os
+import json
+import uuid
+import shutil
+import hashlib
+import importlib.util
 import tempfile
+import subprocess
+from functools import lru_cache
 from pathlib import Path
 
-import arabic_reshaper
-import requests
-from bidi.algorithm import get_display
-from moviepy.editor import ImageClip
 from PIL import Image, ImageDraw, ImageFont, ImageOps
 
+try:
+    import media_index
+except Exception:
+    media_index = None
+
+# requests, arabic_reshaper/bidi and moviepy are imported on first use: moviepy.editor
+# alone takes seconds (and probes ffmpeg), and most renders never touch it.
+# The streaming renders need these; moviepy is only used by create_video_from_deal.
+RENDER_DEPENDENCIES = ("requests", "arabic_reshaper", "bidi")
+
 BASE_DIR = Path(__file__).resolve().parent
 FONTS_DIR = BASE_DIR / "assets" / "fonts"
 ARABIC_FONT_CANDIDATES = [
@@ -17,17 +30,78 @@ ARABIC_FONT_CANDIDATES = [
     FONTS_DIR / "Amiri-Regular.ttf",
 ]
 
+# Bump whenever the slide layout, colours or encoding settings change so that
+# previously cached renders are not reused for the new template.
+TEMPLATE_VERSION = "1"
+RENDER_CACHE_DIR = Path(os.environ.get("RENDER_CACHE_DIR", str(BASE_DIR / "render_cache")))
+SLIDE_SIZE = (1080, 1920)
+PRODUCT_BOX = (860, 860)
+VIDEO_FPS = 24
+FFMPEG_BIN = os.environ.get("FFMPEG_BIN", "ffmpeg")
+# Streaming mode keeps the encoded MP4 in memory up to this size, then spills
+# to an anonymous temp file instead of a named output_path.
+VIDEO_SPOOL_MAX_MEMORY = int(os.environ.get("VIDEO_SPOOL_MAX_MEMORY", str(64 * 1024 * 1024)))
+STREAM_MOVFLAGS = "frag_keyframe+empty_moov+default_base_moof"
+CAROUSEL_TRANSITIONS = {"fade", "fadeblack", "slideleft", "slideright", "slideup", "smoothleft", "circleopen", "dissolve"}
+
+
+def _source_meta_path(url) -> Path:
+    return RENDER_CACHE_DIR / "sources" / f"{_stable_hash({'url': url})}.json"
+
+
+def _save_source_meta(url, meta):
+    def write(path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        return True
 
-def download_image(url, output_path):
     try:
-        resp = requests.get(url, timeout=30)
-        if resp.status_code == 200:
-            with open(output_path, "wb") as f:
-                f.write(resp.content)
-            return True
-    except Exception:
+        _write_atomically(_source_meta_path(url), write)
+    except OSError:
         pass
-    return False
+
+
+def fetch_image(url, output_path, conditional=True):
+    """
+    (output_path إن نُزّلت الصورة الآن وإلا None، sha256 محتواها) — مفتاح الذاكرة المؤقتة هو المحتوى لا الرابط
+    طلب مشروط بـ ETag/Last-Modified آخر تنزيل: 304 أو تعذّر الطلب يعيد البصمة المعروفة دون تنزيل
+    """
+    import requests
+
+    try:
+        with open(_source_meta_path(url), encoding="utf-8") as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        meta = {}
+    known = meta.get("sha256")
+    headers = {}
+    if conditional and known:
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+
+    try:
+        resp = requests.get(url, timeout=30, headers=headers)
+    except Exception:
+        return None, known
+    if resp.status_code != 200:
+        return None, known if resp.status_code == 304 or resp.status_code >= 500 else None
+
+    sha = hashlib.sha256(resp.content).hexdigest()
+    try:
+        with open(output_path, "wb") as f:
+            f.write(resp.content)
+    except OSError:
+        return None, sha
+    fresh = {"sha256": sha, "etag": resp.headers.get("ETag"), "last_modified": resp.headers.get("Last-Modified")}
+    if fresh != meta:
+        _save_source_meta(url, fresh)
+    return output_path, sha
+
+
+def download_image(url, output_path):
+    return fetch_image(url, output_path, conditional=False)[0] is not None
 
 
 def reshape_arabic_text(text: str) -> str:
@@ -36,9 +110,13 @@ def reshape_arabic_text(text: str) -> str:
         return ""
     if not any("\u0600" <= ch <= "\u06FF" for ch in text):
         return text
+    import arabic_reshaper
+    from bidi.algorithm import get_display
+
     return get_display(arabic_reshaper.reshape(text))
 
 
+@lru_cache(maxsize=32)
 def load_font(size: int):
     for font_path in ARABIC_FONT_CANDIDATES:
         if font_path.exists():
@@ -46,6 +124,22 @@ def load_font(size: int):
     return ImageFont.load_default()
 
 
+@lru_cache(maxsize=1)
+def missing_dependencies() -> tuple:
+    # find_spec locates the package without importing it.
+    return tuple(name for name in RENDER_DEPENDENCIES if importlib.util.find_spec(name) is None)
+
+
+def warm_up(font_sizes=(46, 48, 52, 60)) -> dict:
+    """
+    يحمّل الخطوط ومكتبات النص العربي مسبقًا كي لا يدفع أول طلب ثمنها
+    """
+    for size in font_sizes:
+        load_font(size)
+    reshape_arabic_text("تجربة")
+    return {"fonts": load_font.cache_info().currsize}
+
+
 def draw_centered_text(draw, text, y, font, fill, width):
     text = reshape_arabic_text(text)
     bbox = draw.textbbox((0, 0), text, font=font)
@@ -53,48 +147,466 @@ def draw_centered_text(draw, text, y, font, fill, width):
     draw.text((x, y), text, fill=fill, font=font)
 
 
+# ─────────────────────────────────────────────
+# Render cache
+# ─────────────────────────────────────────────
+def deal_render_fields(deal):
+    return {
+        "image_url": deal.get("image_url") or deal.get("product_main_image_url") or deal.get("productMainImageUrl") or "",
+        "title": str(deal.get("title") or deal.get("product_title") or "")[:70],
+        "price": str(deal.get("new_price") or deal.get("sale_price") or ""),
+        "discount": str(deal.get("discount_pct") or deal.get("discount") or ""),
+    }
+
+
+@lru_cache(maxsize=32)
+def _file_digest(path: str, size: int, mtime_ns: int) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def fonts_fingerprint():
+    out = []
+    for font_path in ARABIC_FONT_CANDIDATES:
+        try:
+            st = font_path.stat()
+        except OSError:
+            continue
+        out.append([font_path.name, _file_digest(str(font_path), st.st_size, st.st_mtime_ns)])
+    return out
+
+
+def _stable_hash(obj) -> str:
+    raw = json.dumps(obj, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def render_cache_key(fields, duration, image_sha256) -> str:
+    return _stable_hash({
+        "template": TEMPLATE_VERSION,
+        "fields": fields,
+        "image_sha256": image_sha256,
+        "duration": float(duration),
+        "fps": VIDEO_FPS,
+        "fonts": fonts_fingerprint(),
+    })
+
+
+def product_layer_key(image_sha256) -> str:
+    return _stable_hash({"template": TEMPLATE_VERSION, "image_sha256": image_sha256, "size": SLIDE_SIZE})
+
+
+def _publish_cached(cached: Path, output_path):
+    """
+    output_path نسخة مستقلة عن مدخل الذاكرة المؤقتة: تعديلها في مكانها لا يفسد المدخل
+    دون output_path يُعاد مسار المدخل نفسه — للقراءة فقط
+    """
+    if not output_path:
+        return str(cached)
+    if os.path.abspath(output_path) == str(cached.resolve()):
+        return output_path
+
+    def copy(path):
+        shutil.copyfile(cached, path)
+        return True
+
+    # os.replace swaps the directory entry, so an older output that is still a hard link
+    # to a cache entry is detached rather than written through.
+    if not _write_atomically(Path(output_path), copy):
+        return None
+    return output_path
+
+
+def _write_atomically(final_path: Path, render) -> bool:
+    """
+    render(path) يكتب في اسم مؤقت بجوار final_path ثم os.replace على نفس نظام الملفات:
+    لا يرى cached.exists() أو os.link ملفًا ناقصًا، والانهيار يترك ملف .tmp لا مدخلًا مقطوعًا
+    """
+    final_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = final_path.with_name(f"{final_path.stem}.{os.getpid()}.{uuid.uuid4().hex[:8]}.tmp{final_path.suffix}")
+    try:
+        if not render(str(tmp)) or not tmp.exists():
+            return False
+        os.replace(tmp, final_path)
+        return True
+    finally:
+        try:
+            tmp.unlink()
+        except OSError:
+            pass
+
+
+def local_file_digest(path) -> str:
+    st = os.stat(path)
+    return _file_digest(str(path), st.st_size, st.st_mtime_ns)
+
+
+def local_product_image(image_url, product_id=None):
+    """
+    نسخة الصورة في tiktok-media (عبر media_index) بدل تنزيلها، ويُربط المنتج بها في الفهرس
+    """
+    if media_index is None:
+        return None
+    try:
+        entry = media_index.match_product_image(image_url, product_id)
+    except Exception:
+        return None
+    path = media_index.MEDIA_DIR / entry["name"] if entry else None
+    return str(path) if path and path.is_file() else None
+
+
+def resolve_deal_image(deal, tmpdir, name="product.jpg"):
+    """
+    (مسار محلي أو None، sha256) لصورة الصفقة: نسخة tiktok-media أولًا ثم fetch_image
+    يُستدعى قبل فحص الذاكرة المؤقتة حتى يُربط المنتج بالأصل في الفهرس
+    """
+    image_url = deal_render_fields(deal)["image_url"]
+    if not image_url:
+        return None, None
+    local = local_product_image(image_url, deal.get("product_id") or deal.get("productId"))
+    if local:
+        return local, local_file_digest(local)
+    return fetch_image(image_url, os.path.join(tmpdir, name))
+
+
+def build_product_layer(image_url, tmpdir, image):
+    image_path, image_sha256 = image
+    if not image_sha256:
+        return None
+    layer_path = RENDER_CACHE_DIR / "layers" / f"{product_layer_key(image_sha256)}.png"
+    if layer_path.exists():
+        try:
+            return Image.open(layer_path).convert("RGB")
+        except Exception:
+            pass
+
+    if image_path is None:
+        # 304 on a layer we no longer have: fetch the bytes and key the layer on what was fetched.
+        image_path, image_sha256 = fetch_image(
+            image_url, os.path.join(tmpdir, f"product_{uuid.uuid4().hex[:8]}.jpg"), conditional=False
+        )
+        if image_path is None:
+            return None
+        layer_path = RENDER_CACHE_DIR / "layers" / f"{product_layer_key(image_sha256)}.png"
+
+    width, height = SLIDE_SIZE
+    product_img = Image.open(image_path).convert("RGB")
+    product_img.thumbnail(PRODUCT_BOX)
+    product_img = ImageOps.contain(product_img, PRODUCT_BOX)
+
+    background = Image.new("RGB", (width, height), "#0f0f23")
+    draw = ImageDraw.Draw(background)
+
+    draw.rounded_rectangle(
+        (80, 80, width - 80, height - 80),
+        radius=42,
+        fill="#171735",
+        outline="#2b2b59",
+        width=3
+    )
+
+    background.paste(product_img, ((width - product_img.width) // 2, 170))
+
+    _write_atomically(layer_path, lambda path: background.save(path, format="PNG") or True)
+    return background
+
+
+def render_deal_slide(deal, slide_path, tmpdir, image=None):
+    """
+    image: ناتج resolve_deal_image إن حُسب مسبقًا (لمفتاح الفيديو) فلا تُطلب الصورة مرتين
+    """
+    fields = deal_render_fields(deal)
+    if not fields["image_url"]:
+        return False
+
+    if image is None:
+        image = resolve_deal_image(deal, tmpdir)
+    background = build_product_layer(fields["image_url"], tmpdir, image)
+    if background is None:
+        return False
+
+    width = SLIDE_SIZE[0]
+    draw = ImageDraw.Draw(background)
+    title, price, discount = fields["title"], fields["price"], fields["discount"]
+
+    draw_centered_text(draw, title, 1110, load_font(52), "white", width)
+    if price:
+        draw_centered_text(draw, price, 1280, load_font(60), "#00ff88", width)
+    if discount and discount not in {"0", "0.0", "None"}:
+        draw_centered_text(draw, f"خصم {discount}", 1435, load_font(48), "#ff6b6b", width)
+    draw_centered_text(draw, "رابط في البايو", 1640, load_font(46), "#ffd166", width)
+
+    background.save(slide_path, quality=95)
+    return True
+
+
 def create_video_from_deal(deal, output_path, duration=5.0):
+    fields = deal_render_fields(deal)
+    if not fields["image_url"]:
+        return None
+
     with tempfile.TemporaryDirectory() as tmpdir:
-        image_url = deal.get("image_url") or deal.get("product_main_image_url") or deal.get("productMainImageUrl")
-        if not image_url:
+        image = resolve_deal_image(deal, tmpdir)
+        if not image[1]:
             return None
+        cached = RENDER_CACHE_DIR / f"{render_cache_key(fields, duration, image[1])}.mp4"
+        if cached.exists():
+            return _publish_cached(cached, output_path)
 
-        image_path = os.path.join(tmpdir, "product.jpg")
-        if not download_image(image_url, image_path):
+        slide_path = os.path.join(tmpdir, "slide.jpg")
+        if not render_deal_slide(deal, slide_path, tmpdir, image):
             return None
 
-        width, height = 1080, 1920
-        product_img = Image.open(image_path).convert("RGB")
-        product_img.thumbnail((860, 860))
-        product_img = ImageOps.contain(product_img, (860, 860))
+        from moviepy.editor import ImageClip
+
+        def render(path):
+            clip = ImageClip(slide_path, duration=duration)
+            clip.write_videofile(path, fps=VIDEO_FPS, codec="libx264", audio=False, verbose=False, logger=None)
+            return True
+
+        if not _write_atomically(cached, render):
+            return None
+        return _publish_cached(cached, output_path)
 
-        background = Image.new("RGB", (width, height), "#0f0f23")
-        draw = ImageDraw.Draw(background)
 
-        draw.rounded_rectangle(
-            (80, 80, width - 80, height - 80),
-            radius=42,
-            fill="#171735",
-            outline="#2b2b59",
-            width=3
+# ─────────────────────────────────────────────
+# Carousel (single ffmpeg pass)
+# ─────────────────────────────────────────────
+def _resolve_carousel_image(item, index, tmpdir):
+    if isinstance(item, dict):
+        return resolve_deal_image(item, tmpdir, f"product_{index}.jpg")
+    src = str(item or "").strip()
+    if not src:
+        return None, None
+    if os.path.exists(src):
+        return src, local_file_digest(src)
+    return fetch_image(src, os.path.join(tmpdir, f"image_{index}"))
+
+
+def _carousel_item_key(item, image):
+    if isinstance(item, dict):
+        return {"deal": deal_render_fields(item), "image_sha256": image[1]}
+    return {"image": str(item), "image_sha256": image[1]}
+
+
+def _prepare_carousel_slide(item, index, tmpdir, image):
+    if isinstance(item, dict):
+        slide_path = os.path.join(tmpdir, f"slide_{index}.jpg")
+        return slide_path if render_deal_slide(item, slide_path, tmpdir, image) else None
+
+    src = str(item or "").strip()
+    if not src:
+        return None
+    if image[0]:
+        return image[0]
+    # 304 with the carousel no longer cached: the bytes are needed after all.
+    image_path = os.path.join(tmpdir, f"image_{index}")
+    return image_path if download_image(src, image_path) else None
+
+
+def build_carousel_filtergraph(count, slide_duration, transition="fade", transition_duration=0.6, ken_burns=True):
+    width, height = SLIDE_SIZE
+    frames = int(round(slide_duration * VIDEO_FPS))
+    chains = []
+    for i in range(count):
+        fit = (
+            f"[{i}:v]scale={width}:{height}:force_original_aspect_ratio=decrease,"
+            f"pad={width}:{height}:(ow-iw)/2:(oh-ih)/2:color=0x0f0f23,setsar=1"
         )
+        if ken_burns:
+            # Alternate zoom-in and zoom-out so consecutive slides do not feel identical.
+            zoom = "min(1+0.0009*on,1.12)" if i % 2 == 0 else "max(1.12-0.0009*on,1)"
+            motion = (
+                f",zoompan=z='{zoom}':x='iw/2-(iw/zoom/2)':y='ih/2-(ih/zoom/2)'"
+                f":d={frames}:s={width}x{height}:fps={VIDEO_FPS}"
+            )
+        else:
+            motion = f",fps={VIDEO_FPS},trim=duration={slide_duration}"
+        chains.append(f"{fit}{motion},format=yuv420p,settb=AVTB[v{i}]")
 
-        background.paste(product_img, ((width - product_img.width) // 2, 170))
+    if count == 1:
+        chains.append("[v0]null[out]")
+        return ";".join(chains)
 
-        title = str(deal.get("title") or deal.get("product_title") or "")[:70]
-        price = str(deal.get("new_price") or deal.get("sale_price") or "")
-        discount = str(deal.get("discount_pct") or deal.get("discount") or "")
+    last = "v0"
+    for i in range(1, count):
+        offset = round(i * (slide_duration - transition_duration), 3)
+        label = "out" if i == count - 1 else f"x{i}"
+        chains.append(
+            f"[{last}][v{i}]xfade=transition={transition}:duration={transition_duration}:offset={offset}[{label}]"
+        )
+        last = label
+    return ";".join(chains)
 
-        draw_centered_text(draw, title, 1110, load_font(52), "white", width)
-        if price:
-            draw_centered_text(draw, price, 1280, load_font(60), "#00ff88", width)
-        if discount and discount not in {"0", "0.0", "None"}:
-            draw_centered_text(draw, f"خصم {discount}", 1435, load_font(48), "#ff6b6b", width)
-        draw_centered_text(draw, "رابط في البايو", 1640, load_font(46), "#ffd166", width)
+
+def build_carousel_command(slide_paths, output_path, slide_duration, transition, transition_duration, ken_burns, streaming=False):
+    cmd = [FFMPEG_BIN, "-y", "-loglevel", "error"]
+    for path in slide_paths:
+        if ken_burns:
+            cmd += ["-i", path]
+        else:
+            cmd += ["-loop", "1", "-framerate", str(VIDEO_FPS), "-t", str(slide_duration), "-i", path]
+    graph = build_carousel_filtergraph(len(slide_paths), slide_duration, transition, transition_duration, ken_burns)
+    cmd += [
+        "-filter_complex", graph,
+        "-map", "[out]",
+        "-c:v", "libx264", "-preset", "veryfast", "-crf", "23",
+        "-pix_fmt", "yuv420p", "-r", str(VIDEO_FPS),
+    ]
+    if streaming:
+        cmd += ["-movflags", STREAM_MOVFLAGS, "-an", "-f", "mp4", "pipe:1"]
+    else:
+        cmd += ["-movflags", "+faststart", "-an", output_path]
+    return cmd
+
+
+def _carousel_options(items, slide_duration, transition, transition_duration, ken_burns, tmpdir):
+    items = [it for it in (items or []) if it]
+    if transition not in CAROUSEL_TRANSITIONS:
+        transition = "fade"
+    transition_duration = max(0.0, min(float(transition_duration), float(slide_duration) / 2))
+    images = [_resolve_carousel_image(it, index, tmpdir) for index, it in enumerate(items)]
+    cache_key = _stable_hash({
+        "template": TEMPLATE_VERSION,
+        "carousel": [_carousel_item_key(it, image) for it, image in zip(items, images)],
+        "slide_duration": float(slide_duration),
+        "transition": transition,
+        "transition_duration": transition_duration,
+        "ken_burns": bool(ken_burns),
+        "fps": VIDEO_FPS,
+        "fonts": fonts_fingerprint(),
+    })
+    return items, images, transition, transition_duration, cache_key
+
+
+def _prepare_carousel_slides(items, images, tmpdir):
+    slide_paths = []
+    for index, (item, image) in enumerate(zip(items, images)):
+        path = _prepare_carousel_slide(item, index, tmpdir, image)
+        if path:
+            slide_paths.append(path)
+    return slide_paths
+
+
+def create_carousel_video(items, output_path, slide_duration=4.0, transition="fade", transition_duration=0.6, ken_burns=True):
+    """
+    items: روابط/مسارات صور منتج واحد، أو قائمة صفقات (dict) — شريحة لكل عنصر
+    إن تعذرت شريحة (فشل تنزيل مؤقت) يُكتب الناتج المنقوص إلى output_path فقط دون الذاكرة المؤقتة
+    """
+    with tempfile.TemporaryDirectory() as tmpdir:
+        items, images, transition, transition_duration, cache_key = _carousel_options(
+            items, slide_duration, transition, transition_duration, ken_burns, tmpdir
+        )
+        if not items:
+            return None
+        cached = RENDER_CACHE_DIR / f"{cache_key}.mp4"
+        if cached.exists():
+            return _publish_cached(cached, output_path)
+
+        slide_paths = _prepare_carousel_slides(items, images, tmpdir)
+        if not slide_paths:
+            return None
+
+        def render(path):
+            cmd = build_carousel_command(slide_paths, path, slide_duration, transition, transition_duration, ken_burns)
+            try:
+                subprocess.run(cmd, check=True, capture_output=True)
+            except (OSError, subprocess.CalledProcessError):
+                return False
+            return True
+
+        # The key hashes every item, so a carousel missing a slide must never be stored under it.
+        if len(slide_paths) < len(items):
+            if not output_path or not _write_atomically(Path(output_path), render):
+                return None
+            return output_path
+
+        if not _write_atomically(cached, render):
+            return None
+        return _publish_cached(cached, output_path)
+
+
+# ─────────────────────────────────────────────
+# Streaming (no output_path)
+# ─────────────────────────────────────────────
+def _encode_to_spool(cmd):
+    """
+    يشغّل ffmpeg مع إخراج fMP4 إلى stdout ويجمعه في SpooledTemporaryFile
+    يرجع (ملف مفتوح عند البداية، الحجم) أو (None, 0)
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=VIDEO_SPOOL_MAX_MEMORY)
+    try:
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    except OSError:
+        spool.close()
+        return None, 0
+
+    for block in iter(lambda: proc.stdout.read(1024 * 1024), b""):
+        spool.write(block)
+    proc.stdout.close()
+
+    size = spool.tell()
+    if proc.wait() != 0 or size == 0:
+        spool.close()
+        return None, 0
+    spool.seek(0)
+    return spool, size
+
+
+def _open_cached(cached: Path):
+    try:
+        return open(cached, "rb"), cached.stat().st_size
+    except OSError:
+        return None, 0
+
+
+def build_slide_stream_command(slide_path, duration):
+    return [
+        FFMPEG_BIN, "-y", "-loglevel", "error",
+        "-loop", "1", "-framerate", str(VIDEO_FPS), "-t", str(duration), "-i", slide_path,
+        "-c:v", "libx264", "-preset", "veryfast", "-crf", "23",
+        "-pix_fmt", "yuv420p", "-r", str(VIDEO_FPS),
+        "-movflags", STREAM_MOVFLAGS, "-an", "-f", "mp4", "pipe:1",
+    ]
+
+
+def open_deal_video_stream(deal, duration=5.0):
+    fields = deal_render_fields(deal)
+    if not fields["image_url"]:
+        return None, 0
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        image = resolve_deal_image(deal, tmpdir)
+        if not image[1]:
+            return None, 0
+        cached = RENDER_CACHE_DIR / f"{render_cache_key(fields, duration, image[1])}.mp4"
+        if cached.exists():
+            return _open_cached(cached)
 
         slide_path = os.path.join(tmpdir, "slide.jpg")
-        background.save(slide_path, quality=95)
+        if not render_deal_slide(deal, slide_path, tmpdir, image):
+            return None, 0
+        return _encode_to_spool(build_slide_stream_command(slide_path, duration))
 
-        clip = ImageClip(slide_path, duration=duration)
-        clip.write_videofile(output_path, fps=24, codec="libx264", audio=False, verbose=False, logger=None)
-        return output_path
+
+def open_carousel_video_stream(items, slide_duration=4.0, transition="fade", transition_duration=0.6, ken_burns=True):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        items, images, transition, transition_duration, cache_key = _carousel_options(
+            items, slide_duration, transition, transition_duration, ken_burns, tmpdir
+        )
+        if not items:
+            return None, 0
+        cached = RENDER_CACHE_DIR / f"{cache_key}.mp4"
+        if cached.exists():
+            return _open_cached(cached)
+
+        slide_paths = _prepare_carousel_slides(items, images, tmpdir)
+        if not slide_paths:
+            return None, 0
+        cmd = build_carousel_command(
+            slide_paths, None, slide_duration, transition, transition_duration, ken_burns, streaming=True
+        )
+        return _encode_to_spool(cmd)